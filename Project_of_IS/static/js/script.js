@@ -45,11 +45,19 @@ document.getElementById('encryptForm').addEventListener('submit', async (e) => {
         const formData = new FormData();
         formData.append('password', password);
         formData.append('image', imageFile);
-
-        const response = await fetch('/encrypt', {
-            method: 'POST',
-            body: formData
-        });
+        if (document.getElementById('encryptThumbnail')?.checked) formData.append('thumbnail', '1');
+
+        const progress = trackProgress('encryptProgress');
+        let response;
+        try {
+            response = await fetch('/encrypt', {
+                method: 'POST',
+                headers: { 'X-Progress-Id': progress.id },
+                body: formData
+            });
+        } finally {
+            progress.close();
+        }
 
         const data = await response.json();
 
@@ -126,6 +134,56 @@ document.getElementById('decryptForm').addEventListener('submit', async (e) => {
     }
 });
 
+// ============= THUMBNAIL PREVIEW =============
+
+async function encryptedHeaderSlice(file) {
+    // Only the header and thumbnail section are needed: files starting with 'IVLT'
+    // store the thumbnail length right after the format byte (version 2) or at
+    // offset 11, after the cipher id and segment size (versions 3 and 4)
+    const head = new DataView(await file.slice(0, 15).arrayBuffer());
+    const container = head.byteLength >= 10 && head.getUint32(0) === 0x49564c54;
+    const version = container ? head.getUint8(4) : 0;
+    if ((version === 3 || version === 4) && head.byteLength === 15) {
+        const nonceLength = head.getUint8(6) === 3 ? 24 : 12;  // XChaCha20 uses a 24-byte nonce
+        const wrappedKeyLength = version === 4 ? nonceLength + 48 : 0;  // wrapping nonce + data key + tag
+        const thumbnailLength = head.getUint32(11);
+        return file.slice(0, 15 + 16 + wrappedKeyLength + nonceLength + (thumbnailLength ? 28 + thumbnailLength : 0));
+    }
+    const hasThumbnail = version === 2;
+    return hasThumbnail ? file.slice(0, 10 + 44 + 28 + head.getUint32(6)) : file.slice(0, 50);
+}
+
+document.getElementById('decryptPreviewBtn')?.addEventListener('click', async () => {
+    const password = document.getElementById('decryptPassword').value;
+    const encryptedFile = document.getElementById('encryptedFile').files[0];
+    const btn = document.getElementById('decryptPreviewBtn');
+    const previewCard = document.getElementById('decryptedImageCard');
+
+    if (!password || !encryptedFile) {
+        showToast('Choose an .enc file and enter its password', 'error');
+        return;
+    }
+
+    btn.disabled = true;
+    try {
+        const formData = new FormData();
+        formData.append('password', password);
+        formData.append('encrypted_file', await encryptedHeaderSlice(encryptedFile), encryptedFile.name);
+
+        const response = await fetch('/decrypt/preview', { method: 'POST', body: formData });
+        const data = await response.json();
+        if (!response.ok) throw new Error(data.error || 'Preview failed');
+
+        displayDecryptedResult(data);
+        previewCard.classList.remove('d-none');
+        showToast(`Thumbnail decrypted from ${formatFileSize(data.bytes_read)}`, 'success');
+    } catch (error) {
+        showToast(error.message || 'Preview failed', 'error');
+    } finally {
+        btn.disabled = false;
+    }
+});
+
 // ============= STEGANOGRAPHY HANDLERS =============
 
 document.getElementById('stegEmbedForm')?.addEventListener('submit', async (e) => {
@@ -138,7 +196,7 @@ document.getElementById('stegEmbedForm')?.addEventListener('submit', async (e) =
     const btn = e.target.querySelector('button');
 
     if (!fileInput.files[0]) {
-        showToast('Please select a PNG image', 'error');
+        showToast('Please select a PNG or JPEG image', 'error');
         return;
     }
 
@@ -148,17 +206,40 @@ document.getElementById('stegEmbedForm')?.addEventListener('submit', async (e) =
 
     try {
         const fd = new FormData();
-        fd.append('image', fileInput.files[0]);
+        for (const file of fileInput.files) fd.append('image', file);
         fd.append('message', message);
-
-        const res = await fetch('/steg/embed', { method: 'POST', body: fd });
+        const stegKey = document.getElementById('stegKeyEmbed')?.value;
+        if (stegKey) fd.append('password', stegKey);
+        if (document.getElementById('stegEccEmbed')?.checked) fd.append('ecc', '1');
+
+        const progress = trackProgress('stegEmbedProgress');
+        let res;
+        try {
+            res = await fetch('/steg/embed', { method: 'POST', headers: { 'X-Progress-Id': progress.id }, body: fd });
+        } finally {
+            progress.close();
+        }
         const data = await res.json();
         
         if (!res.ok) throw new Error(data.error || 'Embedding failed');
 
         previewImg.src = data.image_data;
-        downloadLink.href = `/download/${data.stego_filename}`;
+        downloadLink.href = data.download_url;
         downloadLink.download = data.stego_filename;
+
+        // Extra download links when the message was split across several images
+        const shardLinks = document.getElementById('stegShardLinks');
+        if (shardLinks) {
+            shardLinks.innerHTML = '';
+            (data.shards || []).slice(1).forEach((shard, i) => {
+                const link = document.createElement('a');
+                link.className = 'btn-secondary-glow w-100 text-center text-decoration-none mt-2 d-block';
+                link.href = shard.download_url;
+                link.download = shard.stego_filename;
+                link.textContent = `Download Stego Image ${i + 2} of ${data.shards.length}`;
+                shardLinks.appendChild(link);
+            });
+        }
         resultDiv.classList.remove('d-none');
         showToast('Message embedded successfully!', 'success');
         
@@ -179,7 +260,7 @@ document.getElementById('stegExtractForm')?.addEventListener('submit', async (e)
     const btn = e.target.querySelector('button');
 
     if (!fileInput.files[0]) {
-        showToast('Please select a Stego PNG image', 'error');
+        showToast('Please select a stego PNG or JPEG image', 'error');
         return;
     }
 
@@ -189,7 +270,10 @@ document.getElementById('stegExtractForm')?.addEventListener('submit', async (e)
 
     try {
         const fd = new FormData();
-        fd.append('image', fileInput.files[0]);
+        for (const file of fileInput.files) fd.append('image', file);
+        const stegKey = document.getElementById('stegKeyExtract')?.value;
+        if (stegKey) fd.append('password', stegKey);
+        if (document.getElementById('stegEccExtract')?.checked) fd.append('ecc', '1');
 
         const res = await fetch('/steg/extract', { method: 'POST', body: fd });
         const data = await res.json();
@@ -231,7 +315,7 @@ function displayEncryptedResult(data) {
     hexPreview.textContent = data.hex_preview;
     
     const downloadBtn = document.getElementById('downloadBtn');
-    downloadBtn.onclick = () => window.location.href = `/download/${data.encrypted_filename}`;
+    downloadBtn.onclick = () => window.location.href = data.download_url;
     
     // Animate hex text
     typeWriterEffect(hexPreview, data.hex_preview);
@@ -243,6 +327,7 @@ function displayDecryptedResult(data) {
     
     img.src = data.image_data;
     downloadBtn.href = data.image_data;
+    downloadBtn.download = `decrypted_image.${data.image_type === 'jpeg' ? 'jpg' : data.image_type}`;
 }
 
 function typeWriterEffect(element, text) {
@@ -316,6 +401,57 @@ function resetFilePreview(previewId, areaId) {
     document.getElementById(areaId).classList.remove('border-primary');
 }
 
+// ============= PROGRESS EVENTS =============
+
+// Share of the bar each server event fills up to, in the order they arrive
+const PROGRESS_STAGES = {
+    received: { from: 0, to: 40, label: 'Uploading' },
+    kdf: { from: 40, to: 50, label: 'Deriving key' },
+    encrypt: { from: 50, to: 90, label: 'Encrypting' },
+    embed: { from: 40, to: 90, label: 'Embedding' },
+    stored: { from: 90, to: 100, label: 'Saving' }
+};
+
+function trackProgress(containerId) {
+    // Subscribe to /progress/<id> before the upload starts; the upload sends the same id
+    const id = (crypto.randomUUID ? crypto.randomUUID() : Date.now().toString(36) + Math.random().toString(36).slice(2)).replace(/[^A-Za-z0-9_-]/g, '');
+    const container = document.getElementById(containerId);
+    if (!container || !window.EventSource) return { id, close() {} };
+
+    const bar = container.querySelector('.upload-progress-bar');
+    const label = container.querySelector('.upload-progress-label');
+    const source = new EventSource(`/progress/${id}`);
+    const show = (percent, text) => {
+        bar.style.width = `${percent}%`;
+        label.textContent = text;
+    };
+
+    bar.style.width = '0%';
+    label.textContent = '';
+    container.classList.remove('d-none');
+
+    Object.entries(PROGRESS_STAGES).forEach(([name, stage]) => {
+        source.addEventListener(name, (event) => {
+            const data = JSON.parse(event.data);
+            const fraction = data.total ? data.done / data.total : 1;
+            let text = stage.label;
+            if (name === 'received') text += ` ${formatFileSize(data.done)} / ${formatFileSize(data.total)}`;
+            else if (data.total > 1) text += ` ${Math.round(fraction * 100)}%`;
+            show(stage.from + (stage.to - stage.from) * fraction, text);
+        });
+    });
+    // complete and timeout end the stream; close so EventSource does not reconnect
+    ['complete', 'timeout'].forEach(name => source.addEventListener(name, () => source.close()));
+
+    return {
+        id,
+        close() {
+            source.close();
+            container.classList.add('d-none');
+        }
+    };
+}
+
 // ============= TOAST NOTIFICATIONS =============
 
 function showToast(message, type = 'success') {
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""
+Performance benchmarks for the crypto, steganography and HTTP paths.
+
+    python benchmark.py                         # run everything, print a table
+    python benchmark.py --quick                 # smaller sizes, fewer repeats
+    python benchmark.py --output new.json       # save results as JSON
+    python benchmark.py --compare old.json      # fail on regressions vs. a saved run
+    python benchmark.py --filter steg           # only cases whose name contains "steg"
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+# Add the current directory to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+# The HTTP cases hammer the app from one client; time the routes, not the rate limiter
+os.environ.setdefault('RATE_LIMIT_BACKEND', 'off')
+
+from imagevault import crypto, engine, fec, steg_jpeg, steg_png  # noqa: E402
+from imagevault.catalog import default_backend  # noqa: E402
+from imagevault.imaging import PNG_SIGNATURE  # noqa: E402
+from imagevault.preview import get_entropy_histogram, get_hex_preview, get_hexdump  # noqa: E402
+from imagevault.web import create_app  # noqa: E402
+
+KB = 1024
+MB = 1024 * 1024
+PASSWORD = 'benchmark-password'
+
+
+# ============= INPUT GENERATION =============
+
+def make_png(width, height, seed=0):
+    """Deterministic noisy gradient, a stand-in for a photo-like cover image."""
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:height, 0:width]
+    base = np.stack([(xx * 255 // max(1, width - 1)), (yy * 255 // max(1, height - 1)), (xx + yy) % 256], axis=-1)
+    pixels = np.clip(base + rng.normal(0, 4, base.shape), 0, 255).astype(np.uint8)
+    out = BytesIO()
+    Image.fromarray(pixels, 'RGB').save(out, format='PNG')
+    return out.getvalue()
+
+
+def make_jpeg(width, height, seed=0):
+    with Image.open(BytesIO(make_png(width, height, seed))) as img:
+        out = BytesIO()
+        img.save(out, format='JPEG', quality=90)
+        return out.getvalue()
+
+
+def random_bytes(size, seed=0):
+    return np.random.default_rng(seed).integers(0, 256, size, dtype=np.uint8).tobytes()
+
+
+def fake_image(size, seed=0):
+    """Random bytes behind a PNG signature: passes the upload sniffer without a real encode."""
+    return PNG_SIGNATURE + random_bytes(size - len(PNG_SIGNATURE), seed)
+
+
+# ============= TIMING =============
+
+def measure(func, repeats, warmup=1, budget=10.0):
+    """
+    Time func() `repeats` times after `warmup` calls.
+    Stops early once `budget` seconds are spent (keeping at least 3 samples).
+    """
+    for _ in range(warmup):
+        func()
+    samples = []
+    started = time.perf_counter()
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - t0)
+        if len(samples) >= 3 and time.perf_counter() - started > budget:
+            break
+    return samples
+
+
+def summarize(samples, nbytes=None):
+    result = {
+        'samples': len(samples),
+        'min': min(samples),
+        'median': statistics.median(samples),
+        'mean': statistics.fmean(samples),
+        'stdev': statistics.stdev(samples) if len(samples) > 1 else 0.0,
+    }
+    if nbytes:
+        result['bytes'] = nbytes
+        result['mb_per_s'] = nbytes / MB / result['median']
+    return result
+
+
+# ============= BENCHMARK CASES =============
+
+def build_cases(quick, upload_dir):
+    """Return a list of (name, func, bytes processed or None)."""
+    cases = []
+
+    cases.append(('kdf.derive_key', lambda: crypto.derive_key_from_password(PASSWORD, b'\x00' * 16), None))
+
+    sizes = [1 * KB, 64 * KB, 1 * MB] if quick else [1 * KB, 64 * KB, 1 * MB, 10 * MB, 50 * MB]
+    for size in sizes:
+        data = random_bytes(size)
+        encrypted = crypto.encrypt_image(data, PASSWORD)[0]
+        label = f'{size // KB}KB' if size < MB else f'{size // MB}MB'
+        cases.append((f'crypto.encrypt.{label}', lambda d=data: crypto.encrypt_image(d, PASSWORD), size))
+        cases.append((f'crypto.decrypt.{label}', lambda e=encrypted: crypto.decrypt_image(e, PASSWORD), size))
+
+    # Segment sealing alone, without the KDF, for each cipher the engine offers
+    for size in [1 * MB] if quick else [1 * MB, 10 * MB]:
+        data = random_bytes(size)
+        label = f'{size // MB}MB'
+        for cipher in engine.CIPHERS:
+            if engine.cipher_available(cipher):
+                aead, iv = engine.new_aead(cipher, random_bytes(32), random_bytes(engine.NONCE_SIZES[cipher]))
+                cases.append((f'crypto.seal.{cipher}.{label}',
+                              lambda a=aead, n=iv, d=data: engine.seal_segments(a, n, b'', d), size))
+
+    for size in [512, 64 * KB, 1 * MB]:
+        data = random_bytes(size)
+        cases.append((f'hex_preview.{size}B', lambda d=data: get_hex_preview(d), None))
+    cases.append(('hexdump.512B', lambda d=random_bytes(512): get_hexdump(d), None))
+    for size in [1 * MB] if quick else [1 * MB, 50 * MB]:
+        data = random_bytes(size)
+        cases.append((f'entropy_histogram.{size // MB}MB', lambda d=data: get_entropy_histogram([d]), size))
+
+    dims = [(256, 256), (1024, 768)] if quick else [(256, 256), (1024, 768), (2048, 1536), (4000, 3000)]
+    payloads = [100, 10 * KB]
+    for width, height in dims:
+        cover = make_png(width, height)
+        pixels = width * height
+        for payload in payloads:
+            if payload * 8 + 32 > pixels * 3:
+                continue
+            message = 'x' * payload
+            stego = steg_png.embed_message_in_png(cover, message)
+            label = f'{width}x{height}.{payload}B'
+            cases.append((f'steg.png.embed.{label}', lambda c=cover, m=message: steg_png.embed_message_in_png(c, m), len(cover)))
+            cases.append((f'steg.png.extract.{label}', lambda s=stego: steg_png.extract_message_from_png(s), len(stego)))
+        keyed = steg_png.embed_message_in_png(cover, 'x' * 100, PASSWORD)
+        cases.append((f'steg.png.extract_keyed.{width}x{height}.100B',
+                      lambda s=keyed: steg_png.extract_message_from_png(s, PASSWORD), len(keyed)))
+
+    jpeg = make_jpeg(*dims[-1])
+    jpeg_stego = steg_jpeg.embed_message_in_jpeg(jpeg, 'x' * 100)
+    label = f'{dims[-1][0]}x{dims[-1][1]}.100B'
+    cases.append((f'steg.jpeg.embed.{label}', lambda: steg_jpeg.embed_message_in_jpeg(jpeg, 'x' * 100), len(jpeg)))
+    cases.append((f'steg.jpeg.extract.{label}', lambda: steg_jpeg.extract_message_from_jpeg(jpeg_stego), len(jpeg)))
+
+    fec_data = random_bytes(64 * KB)
+    fec_encoded = fec.fec_encode(fec_data)
+    cases.append(('fec.encode.64KB', lambda: fec.fec_encode(fec_data), len(fec_data)))
+    cases.append(('fec.decode.64KB', lambda: fec.fec_decode(
+        fec_encoded[fec.FEC_HEADER_BITS // 8:], len(fec_data)), len(fec_data)))
+
+    cases.extend(build_http_cases(quick, upload_dir))
+    return cases
+
+
+def build_http_cases(quick, upload_dir):
+    """End-to-end requests through the Flask test client."""
+    # A catalog of its own, so benchmark uploads never show up in the real one
+    catalog_backend = default_backend(os.path.join(upload_dir, 'instance'))
+    client = create_app(upload_folder=upload_dir, catalog_backend=catalog_backend).test_client()
+    image = fake_image(256 * KB if quick else 1 * MB)
+    encrypted = crypto.encrypt_image(image, PASSWORD)[0]
+    cover = make_png(512, 512)
+    stego = steg_png.embed_message_in_png(cover, 'hello benchmark')
+
+    def post(path, data):
+        response = client.post(path, data=data, content_type='multipart/form-data')
+        assert response.status_code == 200, (path, response.status_code, response.get_data()[:200])
+
+    return [
+        ('http.health', lambda: client.get('/health'), None),
+        ('http.encrypt', lambda: post('/encrypt', {'password': PASSWORD, 'image': (BytesIO(image), 'bench.png')}), len(image)),
+        ('http.decrypt', lambda: post('/decrypt', {'password': PASSWORD, 'encrypted_file': (BytesIO(encrypted), 'bench.enc')}), len(image)),
+        ('http.steg_embed', lambda: post('/steg/embed', {'message': 'hello benchmark', 'image': (BytesIO(cover), 'bench.png')}), len(cover)),
+        ('http.steg_extract', lambda: post('/steg/extract', {'image': (BytesIO(stego), 'bench.png')}), len(stego)),
+    ]
+
+
+# ============= REPORTING =============
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except Exception:
+        return None
+
+
+def compare(results, baseline, threshold):
+    """Print median ratios against a baseline run. Returns the names that regressed."""
+    regressions = []
+    print(f"\n{'benchmark':48} {'baseline':>12} {'current':>12} {'ratio':>8}")
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        ratio = current['median'] / previous['median'] if previous['median'] else float('inf')
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = '  [REGRESSION]'
+            regressions.append(name)
+        print(f"{name:48} {previous['median'] * 1000:10.2f}ms {current['median'] * 1000:10.2f}ms {ratio:8.2f}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark crypto, steganography and HTTP paths')
+    parser.add_argument('--quick', action='store_true', help='smaller inputs and fewer repeats')
+    parser.add_argument('--repeats', type=int, default=None, help='timed runs per case')
+    parser.add_argument('--filter', default='', help='only run cases whose name contains this text')
+    parser.add_argument('--output', help='write results JSON to this path')
+    parser.add_argument('--compare', help='baseline results JSON to compare against')
+    parser.add_argument('--threshold', type=float, default=0.15,
+                        help='allowed slowdown of the median before a case counts as a regression (0.15 = 15%%)')
+    args = parser.parse_args()
+
+    repeats = args.repeats or (3 if args.quick else 7)
+
+    # Keep route side effects (encrypted/stego files) out of the working tree
+    with tempfile.TemporaryDirectory() as upload_dir:
+        print("Preparing inputs...")
+        cases = [case for case in build_cases(args.quick, upload_dir) if args.filter in case[0]]
+
+        results = {}
+        print(f"\n{'benchmark':48} {'median':>12} {'min':>12} {'MB/s':>10}")
+        for name, func, nbytes in cases:
+            result = summarize(measure(func, repeats), nbytes)
+            results[name] = result
+            rate = f"{result['mb_per_s']:10.1f}" if 'mb_per_s' in result else f"{'':>10}"
+            print(f"{name:48} {result['median'] * 1000:10.2f}ms {result['min'] * 1000:10.2f}ms {rate}")
+
+    report = {
+        'meta': {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'quick': args.quick,
+            'repeats': repeats,
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n[FAIL] {len(regressions)} regression(s) above {args.threshold:.0%}")
+            return 1
+        print("\n[PASS] No regressions")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
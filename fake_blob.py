@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for Vercel Blob storage.
+
+Runs an in-memory blob server over HTTP and provides put/get/delete/list
+with the call shapes the app uses from `vercel.blob`. install() registers
+them as the `vercel.blob` module, so the IS_VERCEL code paths run locally:
+
+    python fake_blob.py --port 8765         # standalone server
+
+    import fake_blob
+    fake_blob.install()                     # before importing the app
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import types
+import urllib.error
+import urllib.request
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from urllib.parse import parse_qs, quote, unquote, urlparse
+
+# Base URL of the blob server used by the client functions below
+SERVER_URL = os.environ.get('FAKE_BLOB_URL', 'http://127.0.0.1:8765')
+
+
+# ============= SERVER =============
+
+class BlobStore:
+    """Thread-safe in-memory pathname -> (data, uploaded_at) store."""
+
+    def __init__(self):
+        self._blobs = {}
+        self._lock = threading.Lock()
+
+    def put(self, pathname, data):
+        with self._lock:
+            self._blobs[pathname] = (data, datetime.now(timezone.utc).isoformat())
+
+    def get(self, pathname):
+        with self._lock:
+            entry = self._blobs.get(pathname)
+        return entry[0] if entry else None
+
+    def delete(self, pathname):
+        with self._lock:
+            return self._blobs.pop(pathname, None) is not None
+
+    def list(self, prefix=''):
+        with self._lock:
+            return [(name, len(data), uploaded) for name, (data, uploaded) in sorted(self._blobs.items())
+                    if name.startswith(prefix)]
+
+
+class BlobRequestHandler(BaseHTTPRequestHandler):
+    """PUT/GET/DELETE /<pathname>; GET /?prefix=... lists blobs as JSON."""
+
+    def _pathname(self):
+        return unquote(urlparse(self.path).path.lstrip('/'))
+
+    def _url(self, pathname):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}/{quote(pathname)}'
+
+    def _send(self, status, body=b'', content_type='application/json'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_PUT(self):
+        pathname = self._pathname()
+        data = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.server.store.put(pathname, data)
+        self._send(200, json.dumps({'url': self._url(pathname), 'pathname': pathname, 'size': len(data)}).encode())
+
+    def do_GET(self):
+        pathname = self._pathname()
+        if not pathname:
+            prefix = parse_qs(urlparse(self.path).query).get('prefix', [''])[0]
+            blobs = [{'url': self._url(name), 'pathname': name, 'size': size, 'uploadedAt': uploaded}
+                     for name, size, uploaded in self.server.store.list(prefix)]
+            self._send(200, json.dumps({'blobs': blobs}).encode())
+            return
+        data = self.server.store.get(pathname)
+        if data is None:
+            self._send(404, b'{"error": "not found"}')
+        else:
+            self._send(200, data, 'application/octet-stream')
+
+    def do_DELETE(self):
+        found = self.server.store.delete(self._pathname())
+        self._send(200 if found else 404)
+
+    def log_message(self, format, *args):
+        # Keep load tests quiet
+        pass
+
+
+def start_server(host='127.0.0.1', port=0):
+    """Start a blob server on a daemon thread. Returns the server; its URL is server.url."""
+    server = ThreadingHTTPServer((host, port), BlobRequestHandler)
+    server.daemon_threads = True
+    server.store = BlobStore()
+    server.url = f'http://{host}:{server.server_address[1]}'
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# ============= CLIENT (vercel.blob API) =============
+
+def _blob(info):
+    return types.SimpleNamespace(url=info['url'], pathname=info['pathname'], size=info['size'],
+                                 uploaded_at=info.get('uploadedAt'))
+
+
+def put(pathname, body, options=None):
+    """Upload body under pathname. Returns an object with .url, .pathname and .size."""
+    request = urllib.request.Request(f'{SERVER_URL}/{quote(pathname)}', data=bytes(body), method='PUT')
+    with urllib.request.urlopen(request) as response:
+        return _blob(json.loads(response.read()))
+
+
+def get(url, options=None):
+    """Fetch a blob by URL. Returns a file-like object."""
+    with urllib.request.urlopen(url) as response:
+        return BytesIO(response.read())
+
+
+def delete(url, options=None):
+    """Delete a blob (or a list of blobs) by URL."""
+    for target in ([url] if isinstance(url, str) else url):
+        try:
+            urllib.request.urlopen(urllib.request.Request(target, method='DELETE')).close()
+        except urllib.error.HTTPError as e:
+            if e.code != 404:
+                raise
+
+
+def list(prefix='', options=None):  # noqa: A001 - mirrors vercel.blob.list
+    """List blobs whose pathname starts with prefix. Returns an object with .blobs."""
+    with urllib.request.urlopen(f'{SERVER_URL}/?prefix={quote(prefix)}') as response:
+        return types.SimpleNamespace(blobs=[_blob(info) for info in json.loads(response.read())['blobs']])
+
+
+def install(server_url=None):
+    """
+    Register this module as `vercel.blob`. Starts an in-process server unless
+    server_url points at a running one. Returns the server (or None).
+    """
+    global SERVER_URL
+    server = None
+    if server_url is None:
+        server = start_server()
+        server_url = server.url
+    SERVER_URL = server_url
+
+    package = sys.modules.get('vercel') or types.ModuleType('vercel')
+    package.__path__ = getattr(package, '__path__', [])
+    package.blob = sys.modules[__name__]
+    sys.modules['vercel'] = package
+    sys.modules['vercel.blob'] = sys.modules[__name__]
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='In-memory Vercel Blob stand-in')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+    blob_server = ThreadingHTTPServer((args.host, args.port), BlobRequestHandler)
+    blob_server.store = BlobStore()
+    print(f"Fake blob server on http://{args.host}:{args.port}")
+    try:
+        blob_server.serve_forever()
+    except KeyboardInterrupt:
+        pass
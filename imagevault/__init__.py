@@ -0,0 +1 @@
+"""Image encryption and steganography tools shared by the web app and the command line."""
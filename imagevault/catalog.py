@@ -0,0 +1,351 @@
+"""
+Metadata catalog of stored encrypted and stego files.
+
+Every file the web app or a background job stores gets a row here: its
+download key, owner, kind, image format, size, content hash and creation
+time, indexed so GET /files pages through them without listing storage.
+The content hash of an .enc file covers the ciphertext after the header,
+so it identifies the image data and survives a rekey. Web uploads are
+hashed on a background thread after the row is written, so their
+content_hash is NULL for a moment rather than the request waiting on it.
+Rows take their kind from the route or job that stored the file. A rebuild
+only has the files, so it counts a PNG or JPEG as stego when it carries the
+_stego_ name the app gives them, or an unkeyed payload header like those
+`python -m imagevault embed` writes under the cover's name.
+
+Storage stays the source of truth: `python -m imagevault catalog rebuild`
+walks the upload folder (or lists blob storage on Vercel), hashing files
+in parallel, and rewrites the catalog from what it finds. Owners are not
+recorded in storage, so a rebuild keeps those of rows it already had.
+"""
+import base64
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+
+from .crypto import parse_header
+from .formats import sniff_format
+from .storage import IS_VERCEL, VERCEL_BLOB_AVAILABLE, MappedFile, get_from_blob, list_blobs
+
+# sqlite:///path/to/catalog.db or off; unset keeps catalog.db in CATALOG_FOLDER (in /tmp on Vercel)
+CATALOG_BACKEND = os.environ.get('CATALOG_BACKEND', '')
+# Kept out of the upload folder, so the catalog is never served or listed as a stored file. The
+# default is the app's Flask instance folder, beside the imagevault package whatever the working directory
+CATALOG_FOLDER = os.environ.get('CATALOG_FOLDER',
+                                os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'instance'))
+CATALOG_PAGE_SIZE = int(os.environ.get('CATALOG_PAGE_SIZE', 50))
+CATALOG_MAX_PAGE_SIZE = 500
+CATALOG_REBUILD_WORKERS = int(os.environ.get('CATALOG_REBUILD_WORKERS', min(8, (os.cpu_count() or 1) * 2)))
+CATALOG_FILENAME = 'catalog.db'
+
+ENCRYPTED, STEGO = 'encrypted', 'stego'
+KINDS = (ENCRYPTED, STEGO)
+STEGO_FORMATS = ('png', 'jpeg')
+STEGO_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+# In the names /steg/embed and steg_embed jobs give their output
+STEGO_MARKER = '_stego_'
+COLUMNS = ('key', 'name', 'owner', 'kind', 'image_format', 'size', 'content_hash', 'created')
+HASH_CHUNK = 1024 * 1024
+
+
+def _carries_payload(image_format, data):
+    """
+    Whether a PNG or JPEG holds an unkeyed payload of the app's stego routes:
+    a length header that fits the image. Keyed payloads look like plain images.
+    """
+    from .errors import ImageVaultError
+    from .imaging import inspect_png_header
+    from .steganalysis import _check_own_png_payload, analyze_jpeg_payload
+    try:
+        if image_format == 'png':
+            return _check_own_png_payload(data, *inspect_png_header(data)[:2])['detected']
+        return analyze_jpeg_payload(data)['own_payload']['detected']
+    except (ImageVaultError, OSError, ValueError):
+        return False
+
+
+def kind_of(name, data):
+    """
+    Catalog kind of a stored file from its name and contents, for files whose
+    storing route is unknown. Returns: ENCRYPTED, STEGO, or None for files the app did not write
+    """
+    if name.endswith('.enc'):
+        return ENCRYPTED
+    image_format = sniff_format(data)
+    if image_format in STEGO_FORMATS and (STEGO_MARKER in name or _carries_payload(image_format, data)):
+        return STEGO
+    return None
+
+
+def _candidate(name):
+    """Whether a stored file name could be catalogued, checked before reading it."""
+    return name.lower().endswith(('.enc',) + STEGO_EXTENSIONS)
+
+
+def describe(key, data, owner=None, created=None, digest=True, kind=None):
+    """
+    Catalog entry for a stored file. key is its download key (local filename
+    or blob URL); data is its contents, as one buffer or a list of chunks.
+    kind is ENCRYPTED or STEGO from the route that stored it; None works it out with kind_of.
+    With digest=False content_hash is left None, for hash_later to fill in.
+    Returns: dict with the COLUMNS fields, or None if the file is not one the app writes
+    """
+    parts = data if isinstance(data, list) else [data]
+    name = key.rsplit('/', 1)[-1]
+    kind = kind or kind_of(name, parts[0])
+    if kind is None:
+        return None
+    skip = 0
+    if kind == ENCRYPTED:
+        header = parse_header(parts[0])
+        image_format = header.image_format if header else None
+        skip = header.offset if header else 0
+    else:
+        image_format = sniff_format(parts[0])
+    hasher = hashlib.sha256() if digest else None
+    size = 0
+    for part in parts:
+        view = memoryview(part)
+        size += len(view)
+        if hasher is None:
+            continue
+        start = min(skip, len(view))
+        skip -= start
+        for pos in range(start, len(view), HASH_CHUNK):
+            hasher.update(view[pos:pos + HASH_CHUNK])
+    return {
+        'key': key, 'name': name, 'owner': owner, 'kind': kind, 'image_format': image_format,
+        'size': size, 'content_hash': hasher.hexdigest() if hasher else None,
+        'created': time.time() if created is None else created,
+    }
+
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def _pool():
+    """Single background hashing thread, recreated after a fork."""
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='catalog')
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def _fill_hash(catalog, key, data, kind):
+    try:
+        catalog.set_hash(key, describe(key, data, kind=kind)['content_hash'])
+    except sqlite3.Error:
+        pass
+
+
+def hash_later(catalog, key, data, kind):
+    """
+    Hash a file of kind added with describe(digest=False) off the request path.
+    Serverless functions stop with the response, so on Vercel it hashes inline.
+    Returns: the Future, or None when it ran inline
+    """
+    if IS_VERCEL:
+        return _fill_hash(catalog, key, data, kind)
+    return _pool().submit(_fill_hash, catalog, key, data, kind)
+
+
+def encode_cursor(row):
+    return base64.urlsafe_b64encode(json.dumps([row['created'], row['key']]).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """(created, key) of the last row of the previous page. Raises ValueError if malformed."""
+    try:
+        created, key = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return float(created), str(key)
+    except Exception:
+        raise ValueError('Invalid cursor')
+
+
+class Catalog:
+    """Catalog rows in a SQLite table, shared by every process on the host."""
+
+    def __init__(self, path):
+        self.path = path
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS files (key TEXT PRIMARY KEY, name TEXT, owner TEXT, kind TEXT, '
+                         'image_format TEXT, size INTEGER, content_hash TEXT, created REAL)')
+            # Listing pages run newest first, keyed by (created, key) so a page never skips or repeats rows
+            conn.execute('CREATE INDEX IF NOT EXISTS files_owner ON files (owner, created, key)')
+            conn.execute('CREATE INDEX IF NOT EXISTS files_created ON files (created, key)')
+            conn.execute('CREATE INDEX IF NOT EXISTS files_size ON files (size)')
+            conn.execute('CREATE INDEX IF NOT EXISTS files_type ON files (kind, image_format, created)')
+            conn.execute('CREATE INDEX IF NOT EXISTS files_hash ON files (content_hash)')
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def add(self, entry):
+        with self._connect() as conn:
+            conn.execute(f"INSERT OR REPLACE INTO files VALUES ({', '.join('?' * len(COLUMNS))})",
+                         [entry[column] for column in COLUMNS])
+
+    def set_hash(self, key, content_hash):
+        """Fill in the content hash of a row added without one."""
+        with self._connect() as conn:
+            conn.execute('UPDATE files SET content_hash = ? WHERE key = ? AND content_hash IS NULL', (content_hash, key))
+
+    def rename(self, key, new_key):
+        """Point key's row at new_key, for files stored again under a new blob URL."""
+        with self._connect() as conn:
+            conn.execute('UPDATE files SET key = ? WHERE key = ?', (new_key, key))
+
+    def get(self, key):
+        with self._connect() as conn:
+            row = conn.execute('SELECT * FROM files WHERE key = ?', (key,)).fetchone()
+        return dict(row) if row else None
+
+    def query(self, owner=None, kind=None, image_format=None, content_hash=None, min_size=None, max_size=None,
+              since=None, until=None, cursor=None, limit=CATALOG_PAGE_SIZE):
+        """
+        One page of entries, newest first, matching every filter given.
+        owner='' matches files stored without a logged-in user.
+        Returns: (entries, cursor for the next page or None)
+        """
+        clauses, args = [], []
+        for column, value in (('owner', owner), ('kind', kind), ('image_format', image_format),
+                              ('content_hash', content_hash)):
+            if value == '' and column == 'owner':
+                clauses.append('owner IS NULL')
+            elif value is not None:
+                clauses.append(f'{column} = ?')
+                args.append(value)
+        for clause, value in (('size >= ?', min_size), ('size <= ?', max_size),
+                              ('created >= ?', since), ('created < ?', until)):
+            if value is not None:
+                clauses.append(clause)
+                args.append(value)
+        if cursor is not None:
+            clauses.append('(created < ? OR (created = ? AND key < ?))')
+            args.extend([cursor[0], cursor[0], cursor[1]])
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        with self._connect() as conn:
+            rows = conn.execute(f'SELECT * FROM files {where} ORDER BY created DESC, key DESC LIMIT ?',
+                                args + [limit + 1]).fetchall()
+        entries = [dict(row) for row in rows[:limit]]
+        return entries, encode_cursor(entries[-1]) if len(rows) > limit else None
+
+    def replace(self, entries, started):
+        """
+        Make the catalog match a rebuild's entries in one transaction. Rows
+        added after the rebuild started win over what it read (the file may
+        have been half written then), and known owners are kept.
+        """
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                owners = dict(conn.execute('SELECT key, owner FROM files WHERE owner IS NOT NULL').fetchall())
+                conn.execute('DELETE FROM files WHERE created < ?', (started,))
+                conn.executemany(f"INSERT OR IGNORE INTO files VALUES ({', '.join('?' * len(COLUMNS))})",
+                                 [[owners.get(entry['key']) if column == 'owner' else entry[column]
+                                   for column in COLUMNS] for entry in entries])
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+
+
+def default_backend(folder=CATALOG_FOLDER):
+    """sqlite:/// URL of catalog.db in folder (created if missing), or in /tmp on Vercel."""
+    folder = tempfile.gettempdir() if IS_VERCEL else folder
+    os.makedirs(folder, exist_ok=True)
+    return 'sqlite:///' + os.path.join(folder, CATALOG_FILENAME)
+
+
+def open_catalog(backend):
+    """Build the catalog named by a CATALOG_BACKEND URL, or None when it is off."""
+    if backend in ('', 'off'):
+        return None
+    if backend.startswith('sqlite:///'):
+        return Catalog(backend[len('sqlite:///'):])
+    raise ValueError(f'Unsupported CATALOG_BACKEND: {backend}')
+
+
+# ============= REBUILD =============
+
+def _uploaded_at(value):
+    if isinstance(value, datetime):
+        return value.timestamp()
+    if isinstance(value, str):
+        return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+    return None
+
+
+def _describe_local(folder, name):
+    path = os.path.join(folder, name)
+    with MappedFile(path) as stored:
+        return describe(name, stored.view, created=os.path.getmtime(path))
+
+
+def _describe_blob(blob):
+    data, error = get_from_blob(blob['url'])
+    if error or data is None:
+        raise OSError(f"{blob['url']}: {error or 'not found'}")
+    return describe(blob['url'], data, created=_uploaded_at(blob.get('uploaded')))
+
+
+def rebuild(catalog, upload_folder, workers=CATALOG_REBUILD_WORKERS):
+    """
+    Rewrite the catalog from storage: the upload folder, or blob storage on
+    Vercel. Files are read and hashed on a thread pool (hashlib and blob
+    fetches release the GIL); .png and .jpg files that kind_of does not
+    count as stego are left out.
+    Returns: (files catalogued, errors)
+    """
+    started = time.time()
+    if IS_VERCEL and VERCEL_BLOB_AVAILABLE:
+        blobs, error = list_blobs()
+        if error:
+            return 0, [f'Blob listing error: {error}']
+        tasks = [(_describe_blob, blob) for blob in blobs if _candidate(blob['pathname'])]
+    else:
+        names = sorted(os.listdir(upload_folder)) if os.path.isdir(upload_folder) else []
+        tasks = [(_describe_local, upload_folder, name) for name in names
+                 if _candidate(name) and os.path.isfile(os.path.join(upload_folder, name))]
+
+    def run(task):
+        try:
+            return task[0](*task[1:]), None
+        except (OSError, ValueError) as e:
+            return None, str(e)
+
+    with ThreadPoolExecutor(max(1, workers)) as pool:
+        results = list(pool.map(run, tasks))
+    entries = [entry for entry, _ in results if entry is not None]
+    catalog.replace(entries, started)
+    return len(entries), [error for _, error in results if error]
+
+
+def init_app(app, backend=CATALOG_BACKEND):
+    """
+    Open the catalog for app's stored files; routes find it in app.extensions.
+    Apps storing files in a folder of their own should pass a backend of their
+    own too, or their rows land in the default catalog.
+    """
+    app.config['CATALOG_BACKEND'] = backend or default_backend()
+    catalog = open_catalog(app.config['CATALOG_BACKEND'])
+    if catalog is not None:
+        app.extensions['imagevault_catalog'] = catalog
@@ -0,0 +1,292 @@
+"""
+Batch command-line tool for offline encryption and steganography.
+
+    python -m imagevault encrypt photos/ -o vault/              # every file, recursively
+    python -m imagevault decrypt vault/ -o restored/
+    python -m imagevault rekey vault/                            # change the password in place
+    python -m imagevault embed covers/ -o stego/ --message "hi"
+    python -m imagevault extract stego/                          # prints path: message
+    python -m imagevault selftest                                # AES-NI and MB/s on this host
+    python -m imagevault catalog rebuild                         # re-index stored files for GET /files
+
+The password comes from --password, the IMAGEVAULT_PASSWORD environment
+variable or a prompt (for rekey, the new one from --new-password,
+IMAGEVAULT_NEW_PASSWORD or a second prompt). Files are handed to a process pool by path; each worker
+reads and writes its own files, so the parent never holds file contents.
+"""
+import argparse
+import getpass
+import multiprocessing
+import os
+import sys
+import time
+
+from . import engine
+from .catalog import CATALOG_BACKEND, CATALOG_REBUILD_WORKERS, default_backend, open_catalog, rebuild
+from .crypto import decrypt_into, encrypt_stream, read_header, parse_header, rekey_stream
+from .errors import ImageVaultError, error_code
+from .steg import embed_payload, extract_payload
+from .steg_jpeg import STEG_EXTENSIONS
+from .storage import UPLOAD_FOLDER, MappedFile
+
+PASSWORD_ENV = 'IMAGEVAULT_PASSWORD'
+NEW_PASSWORD_ENV = 'IMAGEVAULT_NEW_PASSWORD'
+PROGRESS_INTERVAL = 2.0  # seconds between progress lines on stderr
+
+
+# ============= JOBS =============
+
+def _write_atomic(dst, write):
+    """Run write(file) into dst via a temporary file. Returns write's result; the file is kept only if truthy."""
+    os.makedirs(os.path.dirname(dst) or '.', exist_ok=True)
+    tmp = dst + '.part'
+    try:
+        with open(tmp, 'wb') as f:
+            result = write(f)
+        if result:
+            os.replace(tmp, dst)
+        return result
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def _encrypt(src, dst, options):
+    with open(src, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        _write_atomic(dst, lambda out: encrypt_stream(f, out, options['password'], cipher=options['cipher']) or True)
+    return size, None, None
+
+
+def _decrypt(src, dst, options):
+    # decrypt_into raises a CryptoError naming the failure, and the partial output is removed
+    with MappedFile(src) as stored:
+        _write_atomic(dst, lambda out: decrypt_into(stored.view, out, options['password'], stored.release))
+    return os.path.getsize(dst), None, None
+
+
+def _rekey(src, dst, options):
+    # Only the key fields in the header are rewritten, so this costs two key derivations per file whatever its size
+    with open(src, 'r+b') as f:
+        header = parse_header(read_header(f))
+        if header is None:
+            return 0, 'Not an encrypted file', None
+        if header.wrapped_key is None:
+            return 0, 'File predates envelope encryption; decrypt and re-encrypt it to enable rekeying', None
+        f.seek(0)
+        if not rekey_stream(f, options['password'], options['new_password']):
+            return 0, 'Invalid password or corrupted file', None
+        return os.fstat(f.fileno()).st_size, None, None
+
+
+def _embed(src, dst, options):
+    with open(src, 'rb') as f:
+        image_bytes = f.read()
+    stego_bytes = embed_payload(image_bytes, options['message'], options['key'], options['ecc'])
+    if stego_bytes is None:
+        return 0, 'Message too large for image capacity', None
+    _write_atomic(dst, lambda out: out.write(stego_bytes) or True)
+    return len(image_bytes), None, None
+
+
+def _extract(src, dst, options):
+    with open(src, 'rb') as f:
+        image_bytes = f.read()
+    payload = extract_payload(image_bytes, options['key'], options['ecc'])
+    if payload is None:
+        return 0, 'No hidden message found', None
+    if dst is not None:
+        _write_atomic(dst, lambda out: out.write(payload) or True)
+        return len(image_bytes), None, None
+    try:
+        return len(image_bytes), None, payload.decode('utf-8')
+    except UnicodeDecodeError:
+        return 0, 'Hidden payload is not UTF-8 text; use -o to save it', None
+
+
+# Each job returns (bytes processed, error or None, extracted message or None)
+JOBS = {'encrypt': _encrypt, 'decrypt': _decrypt, 'rekey': _rekey, 'embed': _embed, 'extract': _extract}
+
+
+def _run_job(task):
+    """
+    Pool entry point. A failure is reported for its file only, so the rest of
+    the batch still runs; unexpected ones are labelled with their error code.
+    Returns (src, bytes processed, error, message).
+    """
+    command, src, dst, options = task
+    try:
+        return (src,) + JOBS[command](src, dst, options)
+    except (OSError, ImageVaultError) as e:
+        return src, 0, str(e), None
+    except Exception as e:
+        return src, 0, f'{error_code(e)} ({type(e).__name__}: {e})', None
+
+
+# ============= FILE DISCOVERY =============
+
+def _output_path(command, rel, output):
+    if command == 'encrypt':
+        return os.path.join(output, rel + '.enc')
+    if command == 'decrypt':
+        return os.path.join(output, rel[:-4] if rel.endswith('.enc') else rel + '.dec')
+    if command == 'rekey':
+        return None
+    if command == 'extract':
+        return None if output is None else os.path.join(output, os.path.splitext(rel)[0] + '.txt')
+    return os.path.join(output, rel)
+
+
+def _wanted(command, path):
+    if command in ('decrypt', 'rekey'):
+        return path.endswith('.enc')
+    if command in ('embed', 'extract'):
+        return path.lower().endswith(STEG_EXTENSIONS)
+    return True
+
+
+def iter_tasks(command, sources, output, options):
+    """Yield one task per input file, walking directories recursively and mirroring them under output."""
+    for source in sources:
+        if os.path.isfile(source):
+            yield command, source, _output_path(command, os.path.basename(source), output), options
+            continue
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                if _wanted(command, path):
+                    rel = os.path.relpath(path, source)
+                    yield command, path, _output_path(command, rel, output), options
+
+
+# ============= MAIN =============
+
+def _password(value=None, env=PASSWORD_ENV, prompt='Password: '):
+    password = value or os.environ.get(env)
+    if not password:
+        password = getpass.getpass(prompt)
+    if len(password) < 4:
+        raise SystemExit('Password must be at least 4 characters')
+    return password
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='python -m imagevault', description=__doc__.split('\n\n')[0].strip())
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    def add(name, help_text, output_required=True, output=True):
+        sub = commands.add_parser(name, help=help_text)
+        sub.add_argument('sources', nargs='+', help='files or directories (searched recursively)')
+        if output:
+            sub.add_argument('-o', '--output', required=output_required, help='output directory')
+        sub.add_argument('-j', '--workers', type=int, default=os.cpu_count() or 1, help='worker processes')
+        return sub
+
+    for name, help_text in (('encrypt', 'encrypt files with AES-256-GCM or ChaCha20-Poly1305'),
+                            ('decrypt', 'decrypt .enc files')):
+        sub = add(name, help_text)
+        sub.add_argument('--password', help=f'defaults to ${PASSWORD_ENV} or a prompt')
+        if name == 'encrypt':
+            sub.add_argument('--cipher', choices=('auto',) + tuple(engine.CIPHERS), default=engine.CRYPTO_CIPHER,
+                             help='defaults to $CRYPTO_CIPHER or auto (the faster one on this host)')
+    sub = add('rekey', 'change the password of .enc files in place', output=False)
+    sub.add_argument('--password', help=f'current password; defaults to ${PASSWORD_ENV} or a prompt')
+    sub.add_argument('--new-password', help=f'defaults to ${NEW_PASSWORD_ENV} or a prompt')
+
+    for name, help_text in (('embed', 'hide a message in PNG/JPEG images'), ('extract', 'read hidden messages')):
+        sub = add(name, help_text, output_required=(name == 'embed'))
+        sub.add_argument('--key', help='stego key used to scatter the payload')
+        sub.add_argument('--ecc', action='store_true', help='Reed-Solomon protected payload')
+        if name == 'embed':
+            message = sub.add_mutually_exclusive_group(required=True)
+            message.add_argument('--message', help='text to hide')
+            message.add_argument('--message-file', help='file whose bytes are hidden')
+    sub = commands.add_parser('selftest', help='report AES-NI support and cipher throughput')
+    sub.add_argument('--size', type=int, default=engine.SELF_TEST_SIZE // (1024 * 1024), help='test buffer in MB')
+    sub = commands.add_parser('catalog', help='maintain the metadata catalog behind GET /files')
+    sub.add_argument('action', choices=('rebuild',), help='rebuild: re-read every stored file and rewrite the catalog')
+    sub.add_argument('--folder', default=UPLOAD_FOLDER, help='upload folder (on Vercel, blob storage is listed instead)')
+    sub.add_argument('--backend', default=CATALOG_BACKEND, help='defaults to $CATALOG_BACKEND or catalog.db in $CATALOG_FOLDER')
+    sub.add_argument('-j', '--workers', type=int, default=CATALOG_REBUILD_WORKERS, help='reader threads')
+    return parser
+
+
+def _selftest(args):
+    result = engine.self_test(args.size * 1024 * 1024)
+    aes_ni = {True: 'yes', False: 'no', None: 'unknown'}[result['aes_ni']]
+    print(f"AES-NI:        {aes_ni} ({result['openssl']})")
+    print(f"threads:       {result['threads']} of {result['cpus']} CPUs, {result['segment_size'] // 1024} KB segments")
+    print(f"single-thread: {result['single_mbps']:.1f} MB/s")
+    print(f"parallel:      {result['parallel_mbps']:.1f} MB/s ({result['speedup']}x)")
+    for cipher, rate in result['ciphers'].items():
+        print(f"{cipher + ':':23}{rate:.1f} MB/s{' (selected)' if cipher == result['cipher'] else ''}")
+    return 0
+
+
+def _catalog(args):
+    catalog = open_catalog(args.backend or default_backend())
+    if catalog is None:
+        raise SystemExit('The catalog is off (CATALOG_BACKEND=off)')
+    started = time.perf_counter()
+    count, errors = rebuild(catalog, args.folder, args.workers)
+    for error in errors:
+        print(f'[FAIL] {error}', file=sys.stderr)
+    print(f'catalog: {count} files indexed in {time.perf_counter() - started:.2f}s', file=sys.stderr)
+    return 1 if errors else 0
+
+
+def _init_worker():
+    # Files are already spread over processes; threads per process would oversubscribe
+    engine.CRYPTO_THREADS = 1
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.command == 'selftest':
+        return _selftest(args)
+    if args.command == 'catalog':
+        return _catalog(args)
+
+    options = {}
+    if args.command in ('encrypt', 'decrypt', 'rekey'):
+        options['password'] = _password(args.password)
+    else:
+        options['key'] = args.key or None
+        options['ecc'] = args.ecc
+    if args.command == 'embed':
+        if args.message_file:
+            with open(args.message_file, 'rb') as f:
+                options['message'] = f.read()
+        else:
+            options['message'] = args.message.encode('utf-8')
+    if args.command == 'rekey':
+        options['new_password'] = _password(args.new_password, NEW_PASSWORD_ENV, 'New password: ')
+    if args.command == 'encrypt':
+        # Pick once here, so workers do not each benchmark
+        options['cipher'] = engine.select_cipher(args.cipher)
+
+    files = total_bytes = failed = 0
+    started = last_report = time.perf_counter()
+    tasks = iter_tasks(args.command, args.sources, getattr(args, 'output', None), options)
+    workers = max(1, args.workers)
+    with multiprocessing.Pool(workers, _init_worker if workers > 1 else None) as pool:
+        for src, nbytes, error, message in pool.imap_unordered(_run_job, tasks, chunksize=16):
+            files += 1
+            total_bytes += nbytes
+            if error:
+                failed += 1
+                print(f'[FAIL] {src}: {error}', file=sys.stderr)
+            elif message is not None:
+                print(f'{src}: {message}')
+            now = time.perf_counter()
+            if now - last_report >= PROGRESS_INTERVAL:
+                last_report = now
+                print(f'... {files} files, {files / (now - started):.1f} files/s', file=sys.stderr)
+
+    elapsed = time.perf_counter() - started
+    print(f'{args.command}: {files - failed}/{files} files ({failed} failed), '
+          f'{total_bytes / (1024 * 1024):.1f} MB in {elapsed:.2f}s '
+          f'({files / elapsed if elapsed else 0:.1f} files/s, {total_bytes / (1024 * 1024) / elapsed if elapsed else 0:.1f} MB/s)',
+          file=sys.stderr)
+    return 1 if failed else 0
@@ -0,0 +1,484 @@
+"""AES-256-GCM or ChaCha20-Poly1305 encryption with PBKDF2 password-derived keys."""
+import secrets
+import struct
+from collections import namedtuple
+from io import BytesIO
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+
+from . import engine
+from .engine import (
+    CIPHER_IDS, CIPHER_NAMES, DEFAULT_CIPHER, MAX_SEGMENT_SIZE, MIN_SEGMENT_SIZE, NONCE_SIZES, SEGMENT_SIZE, TAG_SIZE,
+    MissingFinalSegmentError, new_aead, open_segments, read_exact, seal_segments, select_cipher,
+)
+from .errors import (
+    AuthenticationError, CorruptedFileError, CryptoError, EnvelopeRequiredError, NoThumbnailError, NotEncryptedError,
+    TruncatedFileError, WrongPasswordError,
+)
+from .formats import FORMAT_CODES, FORMAT_NAMES, SNIFF_BYTES, sniff_format
+from .metrics import span
+
+
+def derive_key_from_password(password, salt):
+    """
+    Derive a 32-byte AES-256 key from password using PBKDF2.
+    """
+    kdf = PBKDF2HMAC(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=salt,
+        iterations=100000,
+        backend=default_backend()
+    )
+    with span('kdf'):
+        key = kdf.derive(password.encode())
+    return key
+
+# Container header written before salt + iv + tag: magic, version and the
+# image format code. It is passed to GCM as associated data, so the format
+# tag is authenticated along with the ciphertext.
+CONTAINER_MAGIC = b'IVLT'
+CONTAINER_VERSION = 1
+# Version 2 adds a separately encrypted thumbnail between the header and the
+# ciphertext: the prefix gains its length, the header gains its IV and tag
+THUMBNAIL_VERSION = 2
+# Version 3 seals the image as independently authenticated segments (see
+# engine.py): the prefix gains the cipher id, segment size and thumbnail
+# length, the single tag moves to the end of every segment, and the nonce
+# after the salt is 12 bytes, or 24 for XChaCha20
+SEGMENTED_VERSION = 3
+# Version 4 adds envelope encryption: a random data key seals the image and
+# thumbnail, and the password-derived key only wraps it. Changing the password
+# rewrites the salt and wrapped key (see rekey_header); the segments, whose
+# associated data is just the prefix, are left as they are
+ENVELOPE_VERSION = 4
+CONTAINER_VERSIONS = (CONTAINER_VERSION, THUMBNAIL_VERSION, SEGMENTED_VERSION, ENVELOPE_VERSION)
+PREFIX_SIZE = len(CONTAINER_MAGIC) + 2
+# Files from before the container header start directly with the salt
+LEGACY_HEADER_SIZE = 44
+HEADER_SIZE = PREFIX_SIZE + LEGACY_HEADER_SIZE
+THUMBNAIL_FIELDS_SIZE = 4 + 12 + 16
+# Versions 3 and 4: magic, version, format, cipher id, segment size, thumbnail length (0 for none)
+SEGMENTED_PREFIX = struct.Struct('>4sBBBII')
+DATA_KEY_SIZE = 32
+# Associated data suffixes keeping the thumbnail, image and wrapped key sections from being swapped
+THUMBNAIL_AAD = b'thumbnail'
+KEY_WRAP_AAD = b'data-key'
+
+# segment_size is 0 for versions 1 and 2, whose image is one GCM message with tag;
+# wrapped_key is (nonce, wrapped data key) for version 4
+Header = namedtuple('Header', 'aad image_format salt iv tag offset thumbnail cipher segment_size wrapped_key',
+                    defaults=(DEFAULT_CIPHER, 0, None))
+
+def container_prefix(image_format, thumbnail_size=0, segment_size=SEGMENT_SIZE, cipher=DEFAULT_CIPHER):
+    """
+    Version 4 header prefix for an image of image_format (a formats.IMAGE_FORMATS
+    name, or None), sealed in segment_size segments, with a thumbnail section
+    of thumbnail_size bytes if nonzero.
+    """
+    return SEGMENTED_PREFIX.pack(CONTAINER_MAGIC, ENVELOPE_VERSION, FORMAT_CODES.get(image_format, 0),
+                                 CIPHER_IDS[cipher], segment_size, thumbnail_size)
+
+def container_version(head):
+    """
+    Container version from the first PREFIX_SIZE bytes, or None for legacy files.
+    A legacy file whose random salt happened to start with the magic, a known
+    version and a valid format code (about 1 in 2^44) would be misread; none are expected.
+    """
+    head = bytes(head[:PREFIX_SIZE])
+    if (len(head) == PREFIX_SIZE and head[:len(CONTAINER_MAGIC)] == CONTAINER_MAGIC
+            and head[4] in CONTAINER_VERSIONS and (head[5] == 0 or head[5] in FORMAT_NAMES)):
+        return head[4]
+    return None
+
+def header_length(head):
+    """
+    Bytes in front of the image ciphertext, including any thumbnail section.
+    head must hold at least the first HEADER_SIZE bytes of the file.
+    Raises: TruncatedFileError if head ends inside the fields giving the length
+    """
+    version = container_version(head)
+    if version is None:
+        return LEGACY_HEADER_SIZE
+    fields_end = {THUMBNAIL_VERSION: PREFIX_SIZE + 4}.get(version, SEGMENTED_PREFIX.size)
+    if version != CONTAINER_VERSION and len(head) < fields_end:
+        raise TruncatedFileError('File is truncated: its header is incomplete')
+    if version == THUMBNAIL_VERSION:
+        return HEADER_SIZE + THUMBNAIL_FIELDS_SIZE + struct.unpack('>I', bytes(head[PREFIX_SIZE:PREFIX_SIZE + 4]))[0]
+    if version in (SEGMENTED_VERSION, ENVELOPE_VERSION):
+        cipher_id, _, thumbnail_size = SEGMENTED_PREFIX.unpack(bytes(head[:SEGMENTED_PREFIX.size]))[3:]
+        nonce_size = NONCE_SIZES.get(CIPHER_NAMES.get(cipher_id), 12)
+        key_fields = _key_fields_size(nonce_size) if version == ENVELOPE_VERSION else 16
+        return SEGMENTED_PREFIX.size + key_fields + nonce_size + (12 + 16 + thumbnail_size if thumbnail_size else 0)
+    return HEADER_SIZE
+
+def _key_fields_size(nonce_size):
+    """Version 4 salt, key wrapping nonce and wrapped data key: the bytes a rekey rewrites."""
+    return 16 + nonce_size + DATA_KEY_SIZE + TAG_SIZE
+
+def _parse_segmented_header(encrypted_data, version):
+    if len(encrypted_data) < SEGMENTED_PREFIX.size:
+        return None
+    aad = bytes(encrypted_data[:SEGMENTED_PREFIX.size])
+    _, _, format_code, cipher_id, segment_size, thumbnail_size = SEGMENTED_PREFIX.unpack(aad)
+    if cipher_id not in CIPHER_NAMES or not MIN_SEGMENT_SIZE <= segment_size <= MAX_SEGMENT_SIZE:
+        return None
+    cipher = CIPHER_NAMES[cipher_id]
+    nonce_size = NONCE_SIZES[cipher]
+    pos = SEGMENTED_PREFIX.size
+    salt = bytes(encrypted_data[pos:pos + 16])
+    pos += 16
+    wrapped_key = None
+    if version == ENVELOPE_VERSION:
+        wrap_end = pos + nonce_size + DATA_KEY_SIZE + TAG_SIZE
+        wrapped_key = (bytes(encrypted_data[pos:pos + nonce_size]), bytes(encrypted_data[pos + nonce_size:wrap_end]))
+        pos = wrap_end
+    nonce = bytes(encrypted_data[pos:pos + nonce_size])
+    pos += nonce_size
+    thumbnail = None
+    if thumbnail_size:
+        thumbnail = (bytes(encrypted_data[pos:pos + 12]), bytes(encrypted_data[pos + 12:pos + 28]), pos + 28, thumbnail_size)
+        pos += 28 + thumbnail_size
+    if len(encrypted_data) < pos:
+        return None
+    return Header(aad, FORMAT_NAMES.get(format_code), salt, nonce, None, pos, thumbnail, cipher, segment_size, wrapped_key)
+
+def parse_header(encrypted_data):
+    """
+    Split the header off encrypted data (which must include all header_length bytes).
+    Returns: Header(aad, image_format, salt, iv (the cipher's nonce), tag (None for segmented files),
+             ciphertext offset, thumbnail (iv, tag, start, length) or None,
+             cipher, segment_size, wrapped_key), or None if too short or malformed
+    """
+    version = container_version(encrypted_data)
+    if version in (SEGMENTED_VERSION, ENVELOPE_VERSION):
+        return _parse_segmented_header(encrypted_data, version)
+    pos = 0
+    aad = b''
+    thumbnail_size = None
+    if version is not None:
+        pos = PREFIX_SIZE
+        if version == THUMBNAIL_VERSION:
+            thumbnail_size = struct.unpack('>I', bytes(encrypted_data[pos:pos + 4]))[0]
+            pos += 4
+        aad = bytes(encrypted_data[:pos])
+    salt, iv, tag = (bytes(encrypted_data[pos + start:pos + end]) for start, end in ((0, 16), (16, 28), (28, 44)))
+    pos += LEGACY_HEADER_SIZE
+    thumbnail = None
+    if thumbnail_size is not None:
+        thumbnail = (bytes(encrypted_data[pos:pos + 12]), bytes(encrypted_data[pos + 12:pos + 28]), pos + 28, thumbnail_size)
+        pos += 28 + thumbnail_size
+    if len(encrypted_data) < pos:
+        return None
+    image_format = FORMAT_NAMES.get(aad[5]) if aad else None
+    return Header(aad, image_format, salt, iv, tag, pos, thumbnail)
+
+def header_format(encrypted_data):
+    """
+    Image format recorded in the header, or None for legacy files.
+    Only trustworthy once the file has decrypted, since the tag is checked then.
+    """
+    if container_version(encrypted_data) is None:
+        return None
+    return FORMAT_NAMES.get(encrypted_data[5])
+
+def _wrap_data_key(cipher, password, data_key, prefix):
+    """Version 4 key fields: a fresh salt and nonce, and data_key sealed under the key derived from password."""
+    salt = secrets.token_bytes(16)
+    wrap_nonce = secrets.token_bytes(NONCE_SIZES[cipher])
+    aead, iv = new_aead(cipher, derive_key_from_password(password, salt), wrap_nonce)
+    return salt + wrap_nonce + aead.encrypt(iv, data_key, prefix + KEY_WRAP_AAD)
+
+def _file_key(header, password):
+    """
+    Key the image and thumbnail are sealed with: derived from password, or for
+    version 4 the data key unwrapped with it. Raises WrongPasswordError if it does not unwrap.
+    """
+    key = derive_key_from_password(password, header.salt)
+    if header.wrapped_key is None:
+        return key
+    wrap_nonce, wrapped = header.wrapped_key
+    aead, iv = new_aead(header.cipher, key, wrap_nonce)
+    try:
+        return aead.decrypt(iv, wrapped, header.aad + KEY_WRAP_AAD)
+    except InvalidTag:
+        raise WrongPasswordError('Invalid password')
+
+def rekey_fields(head, old_password, new_password):
+    """
+    Rewrap a version 4 file's data key under new_password. Only the key fields
+    change, so the image ciphertext is neither read nor rewritten.
+    head must hold at least the first header_length bytes.
+    Raises NotEncryptedError, EnvelopeRequiredError for older containers, or
+    WrongPasswordError if old_password does not unwrap the key.
+    Returns: (offset, replacement key fields)
+    """
+    header = parse_header(head)
+    if header is None:
+        raise NotEncryptedError('Not an encrypted file')
+    if header.wrapped_key is None:
+        raise EnvelopeRequiredError('File predates envelope encryption; decrypt and re-encrypt it to enable rekeying')
+    data_key = _file_key(header, old_password)
+    return len(header.aad), _wrap_data_key(header.cipher, new_password, data_key, header.aad)
+
+def rekey_header(head, old_password, new_password):
+    """
+    rekey_fields, for callers that only need to know whether it worked.
+    Returns: (offset, replacement key fields), or None if the file is not
+             version 4 or old_password does not unwrap its key
+    """
+    try:
+        return rekey_fields(head, old_password, new_password)
+    except CryptoError:
+        return None
+
+def rekey_stream(f, old_password, new_password):
+    """
+    Rekey the version 4 file open for reading and writing in f (positioned at
+    its start) in place, overwriting just its key fields.
+    Returns: True if rekeyed
+    """
+    start = f.tell()
+    rekeyed = rekey_header(read_header(f), old_password, new_password)
+    if rekeyed is None:
+        return False
+    offset, key_fields = rekeyed
+    f.seek(start + offset)
+    f.write(key_fields)
+    return True
+
+def encrypt_image(image_bytes, password, progress=None, image_format=None, thumbnail=None, cipher=None):
+    """
+    Encrypt image bytes with PBKDF2 key derivation and the engine's selected cipher
+    (engine.CRYPTO_CIPHER), or cipher if given.
+    image_format is recorded in the header; by default it is sniffed from the bytes.
+    thumbnail, if given, is encrypted as its own section, readable with decrypt_thumbnail.
+    progress(phase, done, total), if given, is called after the KDF and after
+    each SEGMENT_SIZE segment of ciphertext.
+    Returns: (encrypted_data, salt, iv, tag of the last segment)
+    """
+    parts = encrypt_image_parts(image_bytes, password, progress, image_format, thumbnail, cipher)
+    header = parse_header(parts[0])
+    return b''.join(parts), header.salt, header.iv, parts[-1][-TAG_SIZE:]
+
+def encrypt_image_parts(image_bytes, password, progress=None, image_format=None, thumbnail=None, cipher=None):
+    """
+    Encrypt like encrypt_image, but leave the output in pieces so large files
+    can be written out without first copying them into one buffer.
+    Segments are sealed in parallel on the engine's thread pool.
+    Returns: [header (including any thumbnail section), sealed segments...]
+    """
+    cipher = cipher or select_cipher()
+    prefix = container_prefix(image_format or sniff_format(image_bytes[:SNIFF_BYTES]),
+                              len(thumbnail) if thumbnail else 0, cipher=cipher)
+
+    # Random data key, wrapped with the password-derived key
+    data_key = secrets.token_bytes(DATA_KEY_SIZE)
+    nonce = secrets.token_bytes(NONCE_SIZES[cipher])  # base of every segment nonce
+    key_fields = _wrap_data_key(cipher, password, data_key, prefix)
+    if progress:
+        progress('kdf', 1, 1)
+    
+    aead, iv = new_aead(cipher, data_key, nonce)
+    with span('cipher'):
+        thumbnail_section = b''
+        if thumbnail:
+            # Same data key, its own random IV
+            thumbnail_iv = secrets.token_bytes(12)
+            sealed = aead.encrypt(thumbnail_iv, thumbnail, prefix + THUMBNAIL_AAD)
+            thumbnail_section = thumbnail_iv + sealed[-TAG_SIZE:] + sealed[:-TAG_SIZE]
+        parts = seal_segments(aead, iv, prefix, image_bytes, SEGMENT_SIZE, progress=progress)
+    
+    # Layout: prefix (15) + salt (16) + wrapping nonce + wrapped data key (48) + nonce (nonces are 12 bytes,
+    #         or 24 for XChaCha20) [+ thumbnail iv (12) + tag (16) + ciphertext] + segments (ciphertext + tag (16))
+    return [prefix + key_fields + nonce + thumbnail_section] + parts
+
+def decrypt_image(encrypted_data, password):
+    """
+    Decrypt image bytes written by encrypt_image, or by earlier single-message versions.
+    The cipher is read from the header.
+    encrypted_data format: prefix + salt (16) + [wrapped data key] + nonce + [thumbnail section] + segments,
+    or for versions 1, 2 and legacy files: [prefix] + salt (16) + iv (12) + tag (16) + [thumbnail section] + ciphertext
+    Returns: decrypted image bytes or None if decryption fails (decrypt_into raises the reason)
+    """
+    out = BytesIO()
+    try:
+        decrypt_into(encrypted_data, out, password)
+    except CryptoError:
+        return None
+    return out.getvalue()
+
+def decrypt_into(encrypted_data, dst, password, consumed=None):
+    """
+    Decrypt a buffer (bytes, or the memoryview of an mmap'ed file) into file
+    object dst a batch at a time, slicing it with memoryviews so neither the
+    ciphertext nor the whole plaintext is copied into Python bytes.
+    consumed(offset), if given, is called once everything before offset has
+    been read, so a mapped file can drop those pages.
+    Raises a CryptoError subclass if the data is not a container or a tag
+    fails; dst must then be discarded. Version 4 files tell a wrong password
+    (WrongPasswordError) from damaged ciphertext (CorruptedFileError,
+    TruncatedFileError); older files raise AuthenticationError for either.
+    Returns: True
+    """
+    view = memoryview(encrypted_data)
+    header = parse_header(view)
+    if header is None:
+        raise NotEncryptedError('Not an encrypted file')
+    key = _file_key(header, password)
+    envelope = header.wrapped_key is not None
+    body = view[header.offset:]
+    try:
+        with span('cipher'):
+            if header.segment_size:
+                aead, iv = new_aead(header.cipher, key, header.iv)
+                step = header.segment_size + TAG_SIZE
+                batch_size = step * max(1, engine.CRYPTO_THREADS)
+                # An empty body still goes through once, so the missing final segment is caught
+                for start in range(0, len(body) or 1, batch_size):
+                    batch = body[start:start + batch_size]
+                    dst.writelines(open_segments(aead, iv, header.aad, batch, header.segment_size, start // step,
+                                                 final=start + batch_size >= len(body)))
+                    if consumed:
+                        consumed(header.offset + start + len(batch))
+                return True
+            decryptor = Cipher(algorithms.AES(key), modes.GCM(header.iv, header.tag), backend=default_backend()).decryptor()
+            if header.aad:
+                decryptor.authenticate_additional_data(header.aad)
+            for start in range(0, len(body), STREAM_CHUNK):
+                dst.write(decryptor.update(body[start:start + STREAM_CHUNK]))
+                if consumed:
+                    consumed(header.offset + start + STREAM_CHUNK)
+            decryptor.finalize()
+        return True
+    except InvalidTag:
+        if envelope:
+            raise CorruptedFileError('File is corrupted: the password is right but the image data failed authentication')
+        raise AuthenticationError('Invalid password or corrupted file')
+    except MissingFinalSegmentError:
+        if envelope:
+            raise TruncatedFileError('File is truncated: its final segment is missing')
+        raise AuthenticationError('Invalid password or corrupted file')
+
+def open_thumbnail(encrypted_head, password):
+    """
+    Decrypt only the thumbnail section. encrypted_head needs just the first
+    header_length bytes of the file, not the image ciphertext.
+    Raises NotEncryptedError, NoThumbnailError, or an AuthenticationError
+    subclass as decrypt_into does.
+    Returns: thumbnail bytes
+    """
+    header = parse_header(encrypted_head)
+    if header is None:
+        raise NotEncryptedError('Not an encrypted file')
+    if header.thumbnail is None:
+        raise NoThumbnailError('File has no thumbnail')
+    thumbnail_iv, thumbnail_tag, start, length = header.thumbnail
+    key = _file_key(header, password)
+    aead = new_aead(header.cipher, key, header.iv)[0]
+    try:
+        with span('cipher'):
+            return aead.decrypt(thumbnail_iv, bytes(encrypted_head[start:start + length]) + thumbnail_tag,
+                                header.aad + THUMBNAIL_AAD)
+    except InvalidTag:
+        if header.wrapped_key is not None:
+            raise CorruptedFileError('File is corrupted: the password is right but the thumbnail failed authentication')
+        raise AuthenticationError('Invalid password or corrupted file')
+
+def decrypt_thumbnail(encrypted_head, password):
+    """
+    open_thumbnail, returning None instead of raising.
+    Returns: thumbnail bytes, or None if there is none or decryption fails
+    """
+    try:
+        return open_thumbnail(encrypted_head, password)
+    except CryptoError:
+        return None
+
+# Read size for the streaming file helpers of single-message files
+STREAM_CHUNK = 1024 * 1024
+
+def read_header(src):
+    """Read exactly the header (including any thumbnail section) from file object src."""
+    head = src.read(HEADER_SIZE)
+    length = header_length(head)
+    if length > len(head):
+        head += src.read(length - len(head))
+    return head
+
+def encrypt_stream(src, dst, password, segment_size=SEGMENT_SIZE, cipher=None):
+    """
+    Encrypt file object src into dst, reading one segment per engine thread at a time.
+    Output layout matches encrypt_image, with the format sniffed from the first bytes.
+    Returns: number of plaintext bytes
+    """
+    cipher = cipher or select_cipher()
+    batch_size = segment_size * max(1, engine.CRYPTO_THREADS)
+    batch = read_exact(src, batch_size)
+    prefix = container_prefix(sniff_format(batch[:SNIFF_BYTES]), segment_size=segment_size, cipher=cipher)
+    data_key = secrets.token_bytes(DATA_KEY_SIZE)
+    nonce = secrets.token_bytes(NONCE_SIZES[cipher])
+    aead, iv = new_aead(cipher, data_key, nonce)
+
+    dst.write(prefix + _wrap_data_key(cipher, password, data_key, prefix) + nonce)
+    total = index = 0
+    with span('cipher'):
+        while True:
+            # Read ahead so the last segment can be flagged as such
+            following = read_exact(src, batch_size)
+            dst.writelines(seal_segments(aead, iv, prefix, batch, segment_size, index, final=not following))
+            total += len(batch)
+            index += len(batch) // segment_size
+            if not following:
+                return total
+            batch = following
+
+def decrypt_stream(src, dst, password, chunk_size=STREAM_CHUNK):
+    """
+    Decrypt file object src (written by encrypt_image or encrypt_stream) into dst.
+    Segmented files are written only one authenticated batch at a time, but a
+    later segment can still fail, and single-message files are written before
+    their tag is checked, so callers must discard dst when this returns False.
+    Returns: True if every authentication tag verified
+    """
+    head = read_header(src)
+    header = parse_header(head)
+    if header is None:
+        return False
+    try:
+        key = _file_key(header, password)
+        if header.segment_size:
+            aead, iv = new_aead(header.cipher, key, header.iv)
+            return _decrypt_segmented_stream(src, dst, aead, iv, header, head[header.offset:])
+        decryptor = Cipher(algorithms.AES(key), modes.GCM(header.iv, header.tag), backend=default_backend()).decryptor()
+        if header.aad:
+            decryptor.authenticate_additional_data(header.aad)
+        with span('cipher'):
+            # A legacy header is shorter, so part of what was read is already ciphertext
+            dst.write(decryptor.update(head[header.offset:]))
+            for chunk in iter(lambda: src.read(chunk_size), b''):
+                dst.write(decryptor.update(chunk))
+            decryptor.finalize()
+        return True
+    except (CryptoError, InvalidTag, MissingFinalSegmentError):
+        return False
+
+def _decrypt_segmented_stream(src, dst, aead, iv, header, leftover):
+    step = header.segment_size + TAG_SIZE
+    batch_size = step * max(1, engine.CRYPTO_THREADS)
+    # read_header may have read a few bytes past a short header
+    batch = leftover + read_exact(src, batch_size - len(leftover))
+    index = 0
+    with span('cipher'):
+        while True:
+            following = read_exact(src, batch_size)
+            dst.writelines(open_segments(aead, iv, header.aad, batch, header.segment_size, index,
+                                         final=not following))
+            index += len(batch) // step
+            if not following:
+                return True
+            batch = following
@@ -0,0 +1,103 @@
+"""
+Typed errors raised by the crypto and stego engines and by storage.
+
+Each class carries a stable `code`, used as the error counter label, in log
+events and in API error responses, and the HTTP `status` the web app
+answers with. Messages are written for the client, so routes return them
+as they are; anything else is reported only by its code.
+"""
+
+
+class ImageVaultError(Exception):
+    """Base class for errors the engines raise on bad input or failed authentication."""
+    code = 'error'
+    status = 400
+
+
+class CryptoError(ImageVaultError):
+    code = 'crypto_error'
+
+
+class NotEncryptedError(CryptoError):
+    """The data has no recognizable container header."""
+    code = 'not_encrypted'
+
+
+class AuthenticationError(CryptoError):
+    """
+    A tag did not verify. Before envelope encryption (container version 4) a
+    wrong password and a corrupted file cannot be told apart, so older files
+    raise this rather than one of the subclasses.
+    """
+    code = 'auth_failed'
+    status = 401
+
+
+class WrongPasswordError(AuthenticationError):
+    """The password does not unwrap the file's data key (or the key fields were altered)."""
+    code = 'wrong_password'
+
+
+class CorruptedFileError(AuthenticationError):
+    """The data key unwrapped, so the password is right, but the image ciphertext failed authentication."""
+    code = 'corrupted'
+    status = 422
+
+
+class TruncatedFileError(CorruptedFileError):
+    """The file ends inside its header or before its final segment."""
+    code = 'truncated'
+
+
+class NoThumbnailError(CryptoError):
+    """The file was encrypted without a thumbnail."""
+    code = 'no_thumbnail'
+    status = 404
+
+
+class EnvelopeRequiredError(CryptoError):
+    """The file predates envelope encryption (container version 4), so its password cannot be changed in place."""
+    code = 'envelope_required'
+
+
+class StegoError(ImageVaultError):
+    code = 'stego_error'
+
+
+class CapacityError(StegoError):
+    """The message does not fit in the cover image(s)."""
+    code = 'capacity_exceeded'
+
+
+class PayloadNotFoundError(StegoError):
+    """No hidden message was found, or the stego key does not match."""
+    code = 'no_payload'
+    status = 404
+
+
+class IncompleteShardSetError(StegoError):
+    """Shards of a multi-image message were found, but some are missing, mixed with another set, or damaged."""
+    code = 'incomplete_shards'
+    status = 422
+
+
+class StorageError(ImageVaultError):
+    """Blob storage failed to read or write a file."""
+    code = 'storage_error'
+    status = 500
+
+
+def error_code(exc):
+    """Counter and log label for any exception: its typed code, out_of_memory, or internal."""
+    if isinstance(exc, ImageVaultError):
+        return exc.code
+    if isinstance(exc, MemoryError):
+        return 'out_of_memory'
+    return 'internal'
+
+
+def error_status(exc):
+    """HTTP status for any exception: the typed status, 503 when out of memory (worth retrying), or 500."""
+    if isinstance(exc, ImageVaultError):
+        return exc.status
+    return 503 if isinstance(exc, MemoryError) else 500
@@ -0,0 +1,223 @@
+"""Reed-Solomon forward error correction for stego payloads."""
+import math
+
+import numpy as np
+
+# RS(255, 223) data codewords; the 4-byte length header gets its own short codeword
+FEC_DATA = 223
+FEC_PARITY = 32
+FEC_HEADER_PARITY = 12
+FEC_HEADER_BITS = (4 + FEC_HEADER_PARITY) * 8
+
+# GF(256) log/antilog tables over the 0x11d primitive polynomial
+_GF_EXP = np.zeros(512, dtype=np.int32)
+_GF_LOG = np.zeros(256, dtype=np.int32)
+_x = 1
+for _i in range(255):
+    _GF_EXP[_i] = _x
+    _GF_LOG[_x] = _i
+    _x <<= 1
+    if _x & 0x100:
+        _x ^= 0x11d
+_GF_EXP[255:510] = _GF_EXP[:255]
+_GF_EXP_LIST = _GF_EXP.tolist()
+_GF_LOG_LIST = _GF_LOG.tolist()
+
+
+def _gf_mul(a, b):
+    if a == 0 or b == 0:
+        return 0
+    return _GF_EXP_LIST[_GF_LOG_LIST[a] + _GF_LOG_LIST[b]]
+
+def _gf_div(a, b):
+    if a == 0:
+        return 0
+    return _GF_EXP_LIST[(_GF_LOG_LIST[a] + 255 - _GF_LOG_LIST[b]) % 255]
+
+def _gf_pow(a, power):
+    return _GF_EXP_LIST[(_GF_LOG_LIST[a] * power) % 255]
+
+def _gf_poly_scale(p, x):
+    return [_gf_mul(c, x) for c in p]
+
+def _gf_poly_add(p, q):
+    r = [0] * max(len(p), len(q))
+    for i, c in enumerate(p):
+        r[i + len(r) - len(p)] = c
+    for i, c in enumerate(q):
+        r[i + len(r) - len(q)] ^= c
+    return r
+
+def _gf_poly_mul(p, q):
+    r = [0] * (len(p) + len(q) - 1)
+    for j, qj in enumerate(q):
+        for i, pi in enumerate(p):
+            r[i + j] ^= _gf_mul(pi, qj)
+    return r
+
+def _gf_poly_eval(p, x):
+    y = p[0]
+    for c in p[1:]:
+        y = _gf_mul(y, x) ^ c
+    return y
+
+def _gf_vec_mul(a, log_b):
+    """Multiply a uint8 array by a constant (or broadcast array) given as its log."""
+    out = _GF_EXP[_GF_LOG[a] + log_b]
+    return np.where(a == 0, 0, out).astype(np.uint8)
+
+
+_RS_GENERATORS = {}
+
+def _rs_generator(nsym):
+    if nsym not in _RS_GENERATORS:
+        g = [1]
+        for i in range(nsym):
+            g = _gf_poly_mul(g, [1, _gf_pow(2, i)])
+        _RS_GENERATORS[nsym] = g
+    return _RS_GENERATORS[nsym]
+
+
+def _rs_encode_blocks(blocks, nsym):
+    """
+    Systematic RS encode of every row of a (codewords, k) uint8 array at once.
+    Returns the (codewords, k + nsym) codeword array.
+    """
+    gen = np.array(_rs_generator(nsym)[1:], dtype=np.int32)
+    gen_log = np.where(gen == 0, 0, _GF_LOG[gen])
+    parity = np.zeros((blocks.shape[0], nsym), dtype=np.uint8)
+    for i in range(blocks.shape[1]):
+        feedback = blocks[:, i] ^ parity[:, 0]
+        parity[:, :-1] = parity[:, 1:]
+        parity[:, -1] = 0
+        product = _gf_vec_mul(feedback[:, None], gen_log[None, :])
+        product[:, gen == 0] = 0
+        parity ^= product
+    return np.hstack([blocks, parity])
+
+
+def _rs_syndromes(codewords, nsym):
+    """Syndromes of every row of a (codewords, n) array, evaluated by vectorized Horner."""
+    powers = np.arange(nsym, dtype=np.int32)[None, :]
+    synd = np.zeros((codewords.shape[0], nsym), dtype=np.uint8)
+    for i in range(codewords.shape[1]):
+        synd = _gf_vec_mul(synd, powers) ^ codewords[:, i, None]
+    return synd
+
+
+def _rs_correct(codeword, synd, nsym):
+    """
+    Berlekamp-Massey, Chien search and Forney correction of one codeword.
+    Returns the corrected codeword list or None if it has too many errors.
+    """
+    synd = [0] + synd
+    err_loc = [1]
+    old_loc = [1]
+    for i in range(nsym):
+        delta = synd[i + 1]
+        for j in range(1, len(err_loc)):
+            delta ^= _gf_mul(err_loc[-(j + 1)], synd[i + 1 - j])
+        old_loc = old_loc + [0]
+        if delta != 0:
+            if len(old_loc) > len(err_loc):
+                new_loc = _gf_poly_scale(old_loc, delta)
+                old_loc = _gf_poly_scale(err_loc, _gf_div(1, delta))
+                err_loc = new_loc
+            err_loc = _gf_poly_add(err_loc, _gf_poly_scale(old_loc, delta))
+    while err_loc and err_loc[0] == 0:
+        del err_loc[0]
+    errs = len(err_loc) - 1
+    if errs * 2 > nsym:
+        return None
+
+    # Chien search for the error positions
+    n = len(codeword)
+    reversed_loc = err_loc[::-1]
+    err_pos = [n - 1 - i for i in range(n) if _gf_poly_eval(reversed_loc, _gf_pow(2, i)) == 0]
+    if len(err_pos) != errs:
+        return None
+
+    # Forney algorithm for the error magnitudes
+    coef_pos = [n - 1 - p for p in err_pos]
+    locator = [1]
+    for p in coef_pos:
+        locator = _gf_poly_mul(locator, _gf_poly_add([1], [_gf_pow(2, p), 0]))
+    product = _gf_poly_mul(synd[::-1], locator)
+    evaluator = product[len(product) - len(locator):][::-1]
+    xs = [_gf_pow(2, p) for p in coef_pos]
+    out = list(codeword)
+    for i, xi in enumerate(xs):
+        xi_inv = _gf_div(1, xi)
+        denom = 1
+        for j, xj in enumerate(xs):
+            if j != i:
+                denom = _gf_mul(denom, 1 ^ _gf_mul(xi_inv, xj))
+        if denom == 0:
+            return None
+        y = _gf_mul(xi, _gf_poly_eval(evaluator[::-1], xi_inv))
+        out[err_pos[i]] ^= _gf_div(y, denom)
+    return out
+
+
+def _rs_decode_blocks(codewords, nsym):
+    """
+    Correct every row of a (codewords, n) array. Syndromes are computed for all
+    rows at once; only rows with errors go through the scalar decoder.
+    Returns the (codewords, n - nsym) data array or None if any row is unrecoverable.
+    """
+    codewords = codewords.copy()
+    synd = _rs_syndromes(codewords, nsym)
+    for row in np.flatnonzero(synd.any(axis=1)):
+        fixed = _rs_correct(codewords[row].tolist(), synd[row].tolist(), nsym)
+        if fixed is None:
+            return None
+        fixed = np.array(fixed, dtype=np.uint8)
+        if _rs_syndromes(fixed[None, :], nsym).any():
+            return None
+        codewords[row] = fixed
+    return codewords[:, :codewords.shape[1] - nsym]
+
+
+def _fec_layout(length):
+    """(codeword count, data bytes per codeword) for a payload length."""
+    count = math.ceil(length / FEC_DATA)
+    return count, (math.ceil(length / count) if count else 0)
+
+
+def fec_encode(data):
+    """
+    Protect a payload with Reed-Solomon codes: a header codeword holding the length,
+    then the data codewords interleaved column by column, so a burst of damaged
+    bytes is spread over many codewords.
+    """
+    length = np.frombuffer(len(data).to_bytes(4, 'big'), dtype=np.uint8)[None, :]
+    header = _rs_encode_blocks(length, FEC_HEADER_PARITY).tobytes()
+    count, k = _fec_layout(len(data))
+    if count == 0:
+        return header
+    blocks = np.zeros((count, k), dtype=np.uint8)
+    blocks.flat[:len(data)] = np.frombuffer(data, dtype=np.uint8)
+    return header + _rs_encode_blocks(blocks, FEC_PARITY).T.tobytes()
+
+
+def fec_decode_length(header):
+    """Decode the length header codeword. Returns the payload length or None."""
+    codeword = np.frombuffer(header, dtype=np.uint8)[None, :]
+    data = _rs_decode_blocks(codeword, FEC_HEADER_PARITY)
+    return None if data is None else int.from_bytes(data.tobytes(), 'big')
+
+
+def fec_body_size(length):
+    """Bytes of interleaved codewords following the header for a payload length."""
+    count, k = _fec_layout(length)
+    return count * (k + FEC_PARITY)
+
+
+def fec_decode(body, length):
+    """De-interleave and correct the data codewords. Returns the payload or None."""
+    count, k = _fec_layout(length)
+    if count == 0:
+        return b''
+    codewords = np.frombuffer(body, dtype=np.uint8).reshape(k + FEC_PARITY, count).T
+    data = _rs_decode_blocks(codewords, FEC_PARITY)
+    return None if data is None else data.tobytes()[:length]
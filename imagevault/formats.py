@@ -0,0 +1,59 @@
+"""Image format detection from magic bytes."""
+
+# Bytes needed to tell every supported format apart
+SNIFF_BYTES = 16
+
+# Format name -> (one-byte code stored in the encrypted header, MIME type, file extensions)
+IMAGE_FORMATS = {
+    'png': (1, 'image/png', ('png',)),
+    'jpeg': (2, 'image/jpeg', ('jpg', 'jpeg')),
+    'gif': (3, 'image/gif', ('gif',)),
+    'bmp': (4, 'image/bmp', ('bmp',)),
+    'webp': (5, 'image/webp', ('webp',)),
+    'tiff': (6, 'image/tiff', ('tif', 'tiff')),
+}
+FORMAT_CODES = {name: code for name, (code, _, _) in IMAGE_FORMATS.items()}
+FORMAT_NAMES = {code: name for name, code in FORMAT_CODES.items()}
+EXTENSION_FORMATS = {ext: name for name, (_, _, exts) in IMAGE_FORMATS.items() for ext in exts}
+
+
+def sniff_format(head):
+    """
+    Identify an image from its first SNIFF_BYTES bytes.
+    Returns: format name from IMAGE_FORMATS, or None if unrecognized
+    """
+    head = bytes(head[:SNIFF_BYTES])
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'jpeg'
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        return 'gif'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    if head[:4] in (b'II*\x00', b'MM\x00*', b'II+\x00', b'MM\x00+'):
+        return 'tiff'
+    # 'BM' alone is too weak a signature; also require the reserved header words to be zero
+    if head[:2] == b'BM' and len(head) >= 10 and head[6:10] == b'\x00\x00\x00\x00':
+        return 'bmp'
+    return None
+
+
+def sniff_upload(file, allowed=None):
+    """
+    Check an uploaded FileStorage's magic bytes against its extension before
+    the body is read, leaving the stream at the start.
+    allowed limits the accepted format names (default: all of IMAGE_FORMATS).
+    Returns: (format name, error message)
+    """
+    extension = file.filename.rsplit('.', 1)[-1].lower() if '.' in file.filename else ''
+    head = file.stream.read(SNIFF_BYTES)
+    file.stream.seek(0)
+    detected = sniff_format(head)
+    if detected is None:
+        return None, 'File content is not a supported image'
+    if allowed is not None and detected not in allowed:
+        return None, f'{detected.upper()} images are not supported here'
+    if EXTENSION_FORMATS.get(extension) != detected:
+        return None, f'File content is {detected.upper()} but the extension is .{extension}'
+    return detected, None
@@ -0,0 +1,224 @@
+"""Bounded-memory PNG decoding and encoding in row strips."""
+import os
+import struct
+import zlib
+from io import BytesIO
+
+from PIL import Image
+
+from .errors import ImageVaultError
+from .metrics import span
+
+# Decoding budgets for uploaded images (overridable via environment)
+MAX_IMAGE_PIXELS = int(os.environ.get('MAX_IMAGE_PIXELS', 40 * 1000 * 1000))
+MAX_DECODE_MEMORY = int(os.environ.get('MAX_DECODE_MEMORY', 256 * 1024 * 1024))
+STRIP_MEMORY = int(os.environ.get('STRIP_MEMORY', 4 * 1024 * 1024))
+THUMBNAIL_SIZE = int(os.environ.get('THUMBNAIL_SIZE', 256))  # longest side in pixels
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# (bit depth, colour type) -> Pillow mode for the strip decoder
+_PNG_STRIP_MODES = {
+    (8, 0): ('L', 1),
+    (8, 2): ('RGB', 3),
+    (8, 3): ('P', 1),
+    (8, 4): ('LA', 2),
+    (8, 6): ('RGBA', 4),
+}
+
+
+class ImageGuardError(ImageVaultError, ValueError):
+    """Raised when an uploaded image is malformed or exceeds the decoding budget."""
+    code = 'image_rejected'
+
+
+def inspect_png_header(image_bytes):
+    """
+    Read the IHDR chunk without decoding any pixel data.
+    Returns: (width, height, bit_depth, color_type, interlace)
+    """
+    if len(image_bytes) < 33 or image_bytes[:8] != PNG_SIGNATURE or image_bytes[12:16] != b'IHDR':
+        raise ImageGuardError('Not a valid PNG image')
+    width, height, bit_depth, color_type, _, _, interlace = struct.unpack('>IIBBBBB', image_bytes[16:29])
+    if width == 0 or height == 0:
+        raise ImageGuardError('Invalid PNG dimensions')
+    return width, height, bit_depth, color_type, interlace
+
+
+def check_decode_budget(width, height, rows=None):
+    """
+    Reject images above MAX_IMAGE_PIXELS, or whose decoded RGBA size
+    (the whole image, or `rows` rows when decoding in strips) exceeds MAX_DECODE_MEMORY.
+    """
+    if width * height > MAX_IMAGE_PIXELS:
+        raise ImageGuardError(f'Image too large: {width}x{height} exceeds {MAX_IMAGE_PIXELS} pixels')
+    if width * 4 * (height if rows is None else rows) > MAX_DECODE_MEMORY:
+        raise ImageGuardError(f'Image too large: {width}x{height} exceeds decode memory budget')
+
+
+def _strip_rows(width):
+    """Number of rows per strip so one RGBA strip stays within STRIP_MEMORY."""
+    return max(1, STRIP_MEMORY // (width * 4))
+
+
+def _iter_png_chunks(image_bytes):
+    """Yield (chunk_type, data) with data as a zero-copy memoryview."""
+    view = memoryview(image_bytes)
+    pos = 8
+    while pos + 8 <= len(view):
+        length, chunk_type = struct.unpack('>I4s', view[pos:pos + 8])
+        end = pos + 8 + length
+        if end + 4 > len(view):
+            raise ImageGuardError('Truncated PNG chunk')
+        yield chunk_type, view[pos + 8:end]
+        if chunk_type == b'IEND':
+            return
+        pos = end + 4
+
+
+def iter_png_strips(image_bytes):
+    """
+    Decode a PNG as RGBA row strips, yielding (y, rows, rgba_bytes).
+    Only one strip of decoded pixels is held at a time. Corrupt image data
+    raises ImageGuardError, like any other rejected upload.
+    """
+    width, height, bit_depth, color_type, interlace = inspect_png_header(image_bytes)
+    strip_rows = _strip_rows(width)
+    fmt = _PNG_STRIP_MODES.get((bit_depth, color_type))
+
+    if fmt is None or interlace:
+        # 16-bit, sub-byte and interlaced images need a full decode,
+        # which is only allowed when the whole image fits the budget
+        check_decode_budget(width, height)
+        try:
+            with span('image_decode'), Image.open(BytesIO(image_bytes)) as img:
+                img = img.convert('RGBA')
+        except (OSError, ValueError, zlib.error, Image.DecompressionBombError) as e:
+            raise ImageGuardError(f'Corrupt PNG image data: {e}')
+        for y in range(0, height, strip_rows):
+            rows = min(strip_rows, height - y)
+            with span('image_decode'):
+                strip = img.crop((0, y, width, y + rows)).tobytes()
+            yield y, rows, strip
+        return
+
+    check_decode_budget(width, height, rows=strip_rows)
+    mode, bpp = fmt
+    stride = 1 + width * bpp
+
+    palette = None
+    transparency = None
+    idat = []
+    for chunk_type, data in _iter_png_chunks(image_bytes):
+        if chunk_type == b'PLTE':
+            palette = bytes(data)
+        elif chunk_type == b'tRNS':
+            transparency = bytes(data)
+        elif chunk_type == b'IDAT':
+            idat.append(data)
+    try:
+        if transparency is not None and color_type == 0:
+            transparency = struct.unpack('>H', transparency[:2])[0]
+        elif transparency is not None and color_type == 2:
+            transparency = struct.unpack('>HHH', transparency[:6])
+    except struct.error:
+        raise ImageGuardError('Corrupt PNG transparency chunk')
+
+    inflater = zlib.decompressobj()
+    chunks = iter(idat)
+    pending = bytearray()
+    prev_row = None
+    y = 0
+    while y < height:
+        rows = min(strip_rows, height - y)
+        needed = rows * stride
+        with span('image_decode'):
+            while len(pending) < needed:
+                data = inflater.unconsumed_tail or next(chunks, None)
+                if data is None or inflater.eof:
+                    raise ImageGuardError('Truncated PNG image data')
+                try:
+                    pending += inflater.decompress(data, needed - len(pending))
+                except zlib.error as e:
+                    raise ImageGuardError(f'Corrupt PNG image data: {e}')
+            filtered = bytes(pending[:needed])
+            del pending[:needed]
+
+            # Pillow undoes the PNG row filters in C; prepending the previous
+            # (already unfiltered) row lets Up/Average/Paeth rows see real data
+            skip = 0 if prev_row is None else 1
+            if skip:
+                filtered = b'\x00' + prev_row + filtered
+            try:
+                strip = Image.frombytes(mode, (width, rows + skip), zlib.compress(filtered, 0), 'zip', mode)
+                prev_row = strip.crop((0, rows + skip - 1, width, rows + skip)).tobytes()
+                if skip:
+                    strip = strip.crop((0, 1, width, rows + 1))
+                if palette is not None:
+                    strip.putpalette(palette)
+                if transparency is not None:
+                    strip.info['transparency'] = transparency
+                rgba = strip.convert('RGBA').tobytes()
+            except (OSError, ValueError) as e:
+                # Bad filter types, or a palette that does not fit the image
+                raise ImageGuardError(f'Corrupt PNG image data: {e}')
+        yield y, rows, rgba
+        y += rows
+
+
+class PNGStripWriter:
+    """Encode an RGBA PNG incrementally, one strip of rows at a time."""
+
+    def __init__(self, width, height, compress_level=6):
+        self.width = width
+        self._deflater = zlib.compressobj(compress_level)
+        self._prev_row = None
+        self._out = BytesIO()
+        self._out.write(PNG_SIGNATURE)
+        self._chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0))
+
+    def _chunk(self, chunk_type, data):
+        self._out.write(struct.pack('>I', len(data)))
+        self._out.write(chunk_type)
+        self._out.write(data)
+        self._out.write(struct.pack('>I', zlib.crc32(data, zlib.crc32(chunk_type))))
+
+    def write_strip(self, rgba_bytes, rows):
+        # Pillow picks the per-row filters (stored uncompressed at level 0);
+        # the previous row is prepended so the first row filters against it
+        with span('png_encode'):
+            skip = 0 if self._prev_row is None else 1
+            raw = rgba_bytes if not skip else self._prev_row + bytes(rgba_bytes)
+            strip = Image.frombytes('RGBA', (self.width, rows + skip), bytes(raw))
+            filtered = zlib.decompress(strip.tobytes('zip', 'RGBA', 0, 0))
+            self._prev_row = bytes(rgba_bytes[-self.width * 4:])
+            data = self._deflater.compress(memoryview(filtered)[skip * (1 + self.width * 4):])
+            if data:
+                self._chunk(b'IDAT', data)
+
+    def finish(self):
+        with span('png_encode'):
+            self._chunk(b'IDAT', self._deflater.flush())
+            self._chunk(b'IEND', b'')
+        return self._out.getvalue()
+
+
+def make_thumbnail(image_bytes, max_side=THUMBNAIL_SIZE, quality=80):
+    """
+    Downscale an image to fit within max_side pixels and encode it as JPEG.
+    JPEG sources use draft mode, so the DCT is only decoded at a reduced scale.
+    Returns: JPEG bytes
+    """
+    try:
+        with span('image_decode'), Image.open(BytesIO(image_bytes)) as img:
+            check_decode_budget(*img.size)
+            img.draft('RGB', (max_side, max_side))
+            img.thumbnail((max_side, max_side))
+            if img.mode not in ('RGB', 'L'):
+                img = img.convert('RGB')
+            out = BytesIO()
+            img.save(out, 'JPEG', quality=quality)
+    except (OSError, Image.DecompressionBombError) as e:
+        raise ImageGuardError(f'Cannot decode image for thumbnail: {e}')
+    return out.getvalue()
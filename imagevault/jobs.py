@@ -0,0 +1,514 @@
+"""
+Background jobs for long-running encryptions and stego embeds.
+
+Jobs are queued in a pluggable store (in-process, SQLite, or Redis / the
+LocalRedis stand-in) and run by a small pool of worker threads. Passwords
+and messages never reach the store: they stay in the runner's memory, so a
+job whose process restarts fails as interrupted instead of leaking them.
+For the same reason each runner only claims the jobs it submitted; the
+shared stores let any process report a job's status.
+"""
+import json
+import os
+import secrets
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from werkzeug.utils import secure_filename
+
+from .catalog import ENCRYPTED, STEGO, describe
+from .crypto import encrypt_image_parts
+from .errors import CapacityError, ImageVaultError, StorageError
+from .logs import report_error
+from .preview import build_previews
+from .storage import IS_VERCEL, save_file
+
+# memory:// (default), sqlite:///path/to/jobs.db, redis://host:6379/0 or redis+local://
+JOB_QUEUE = os.environ.get('JOB_QUEUE', 'memory://')
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+JOB_TTL = int(os.environ.get('JOB_TTL', 3600))  # seconds a job is kept after its last update
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = 'queued', 'running', 'done', 'failed', 'cancelled'
+FINISHED = (DONE, FAILED, CANCELLED)
+
+
+class JobCancelled(Exception):
+    """Raised inside a job when cancellation was requested."""
+
+
+def _new_job(job_id, kind, params, owner):
+    now = time.time()
+    return {
+        'id': job_id,
+        'kind': kind,
+        'owner': owner,
+        'status': QUEUED,
+        'phase': None,
+        'progress': 0.0,
+        'params': params,
+        'result': None,
+        'error': None,
+        'cancel_requested': False,
+        'created': now,
+        'updated': now,
+    }
+
+
+# ============= QUEUE BACKENDS =============
+
+class MemoryJobStore:
+    """Jobs in a dict, queue in a deque. Only visible to this process."""
+
+    def __init__(self):
+        self._jobs = {}
+        self._queues = {}
+        self._cond = threading.Condition()
+
+    def create(self, job_id, kind, params, owner):
+        job = _new_job(job_id, kind, params, owner)
+        with self._cond:
+            cutoff = time.time() - JOB_TTL
+            for stale in [j['id'] for j in self._jobs.values() if j['updated'] < cutoff]:
+                del self._jobs[stale]
+            self._jobs[job['id']] = job
+            self._queues.setdefault(owner, deque()).append(job['id'])
+            self._cond.notify_all()
+        return dict(job)
+
+    def get(self, job_id):
+        with self._cond:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def update(self, job_id, **fields):
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job:
+                job.update(fields, updated=time.time())
+
+    def cancel_queued(self, job_id):
+        """Move a job from queued to cancelled, unless a worker claimed it first. Returns: True if cancelled"""
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None or job['status'] != QUEUED:
+                return False
+            job.update(status=CANCELLED, cancel_requested=True, updated=time.time())
+            return True
+
+    def claim(self, owner, timeout):
+        """Mark owner's oldest queued job running and return it, or None after timeout."""
+        with self._cond:
+            deadline = time.monotonic() + timeout
+            queue = self._queues.setdefault(owner, deque())
+            while True:
+                while queue:
+                    job = self._jobs.get(queue.popleft())
+                    if job and job['status'] == QUEUED:
+                        job.update(status=RUNNING, updated=time.time())
+                        return dict(job)
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._cond.wait(remaining):
+                    return None
+
+
+class SQLiteJobStore:
+    """Jobs in a SQLite table, so their state survives restarts and is shared by processes."""
+
+    POLL_INTERVAL = 0.2
+
+    def __init__(self, path):
+        self.path = path
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, owner TEXT, status TEXT, '
+                         'created REAL, updated REAL, data TEXT)')
+            conn.execute('CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (owner, status, created)')
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def create(self, job_id, kind, params, owner):
+        job = _new_job(job_id, kind, params, owner)
+        with self._connect() as conn:
+            conn.execute('DELETE FROM jobs WHERE updated < ?', (time.time() - JOB_TTL,))
+            conn.execute('INSERT INTO jobs VALUES (?, ?, ?, ?, ?, ?)',
+                         (job['id'], owner, job['status'], job['created'], job['updated'], json.dumps(job)))
+        return job
+
+    def get(self, job_id):
+        with self._connect() as conn:
+            row = conn.execute('SELECT data FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def update(self, job_id, **fields):
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('SELECT data FROM jobs WHERE id = ?', (job_id,)).fetchone()
+            if row:
+                job = json.loads(row[0])
+                job.update(fields, updated=time.time())
+                conn.execute('UPDATE jobs SET status = ?, updated = ?, data = ? WHERE id = ?',
+                             (job['status'], job['updated'], json.dumps(job), job_id))
+            conn.execute('COMMIT')
+
+    def cancel_queued(self, job_id):
+        with self._connect() as conn:
+            # The same write lock as claim, so exactly one of them moves the job out of queued
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('SELECT data FROM jobs WHERE id = ? AND status = ?', (job_id, QUEUED)).fetchone()
+            if row:
+                job = json.loads(row[0])
+                job.update(status=CANCELLED, cancel_requested=True, updated=time.time())
+                conn.execute('UPDATE jobs SET status = ?, updated = ?, data = ? WHERE id = ? AND status = ?',
+                             (CANCELLED, job['updated'], json.dumps(job), job_id, QUEUED))
+            conn.execute('COMMIT')
+        return row is not None
+
+    def claim(self, owner, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._connect() as conn:
+                conn.execute('BEGIN IMMEDIATE')
+                row = conn.execute('SELECT data FROM jobs WHERE owner = ? AND status = ? ORDER BY created LIMIT 1',
+                                   (owner, QUEUED)).fetchone()
+                if row:
+                    job = json.loads(row[0])
+                    job.update(status=RUNNING, updated=time.time())
+                    conn.execute('UPDATE jobs SET status = ?, updated = ?, data = ? WHERE id = ?',
+                                 (RUNNING, job['updated'], json.dumps(job), job['id']))
+                conn.execute('COMMIT')
+            if row:
+                return job
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(self.POLL_INTERVAL)
+
+
+class LocalRedis:
+    """
+    In-process stand-in for the few Redis commands RedisJobStore uses
+    (SET [NX]/GET/EXPIRE/LPUSH/BRPOP), for development without a Redis server.
+    """
+
+    def __init__(self):
+        self._values = {}
+        self._expiry = {}
+        self._lists = {}
+        self._cond = threading.Condition()
+
+    def _expired(self, key):
+        deadline = self._expiry.get(key)
+        if deadline is not None and deadline < time.time():
+            self._values.pop(key, None)
+            self._expiry.pop(key, None)
+
+    def set(self, key, value, ex=None, nx=False):
+        with self._cond:
+            self._expired(key)
+            if nx and key in self._values:
+                return None
+            self._values[key] = value
+            self._expiry.pop(key, None)
+            if ex:
+                self._expiry[key] = time.time() + ex
+            return True
+
+    def get(self, key):
+        with self._cond:
+            self._expired(key)
+            return self._values.get(key)
+
+    def expire(self, key, seconds):
+        with self._cond:
+            if key in self._values:
+                self._expiry[key] = time.time() + seconds
+
+    def lpush(self, key, value):
+        with self._cond:
+            self._lists.setdefault(key, deque()).appendleft(value)
+            self._cond.notify()
+
+    def brpop(self, key, timeout=0):
+        with self._cond:
+            deadline = time.monotonic() + timeout
+            while not self._lists.get(key):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+            return key, self._lists[key].pop()
+
+
+class RedisJobStore:
+    """
+    Jobs as JSON strings under job:<id>, queued ids in a list per owner.
+    Works with redis-py (decode_responses=True) or LocalRedis.
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    def _key(self, job_id):
+        return f'job:{job_id}'
+
+    def _save(self, job):
+        self.client.set(self._key(job['id']), json.dumps(job), ex=JOB_TTL)
+
+    def create(self, job_id, kind, params, owner):
+        job = _new_job(job_id, kind, params, owner)
+        self._save(job)
+        self.client.lpush(f'jobs:queue:{owner}', job['id'])
+        return job
+
+    def get(self, job_id):
+        data = self.client.get(self._key(job_id))
+        if not data:
+            return None
+        job = json.loads(data)
+        job['cancel_requested'] = bool(self.client.get(self._key(job_id) + ':cancel'))
+        return job
+
+    def update(self, job_id, **fields):
+        # The worker rewrites the whole record without a transaction, so cancel
+        # requests go to their own key where they cannot be overwritten
+        if fields.pop('cancel_requested', False):
+            self.client.set(self._key(job_id) + ':cancel', '1', ex=JOB_TTL)
+        job = self.get(job_id)
+        if job and fields:
+            job.update(fields, updated=time.time())
+            self._save(job)
+
+    def _leave_queue(self, job_id, status):
+        """
+        Take a queued job out of the queue for status, atomically: SET NX on
+        job:<id>:dequeued lets exactly one of a worker's claim and a cancel win.
+        Returns: the updated job, or None if it is gone or was already taken
+        """
+        job = self.get(job_id)
+        if not job or job['status'] != QUEUED:
+            return None
+        if not self.client.set(self._key(job_id) + ':dequeued', status, ex=JOB_TTL, nx=True):
+            return None
+        job.update(status=status, updated=time.time())
+        self._save(job)
+        return job
+
+    def cancel_queued(self, job_id):
+        return self._leave_queue(job_id, CANCELLED) is not None
+
+    def claim(self, owner, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            item = self.client.brpop(f'jobs:queue:{owner}', timeout=max(1, int(remaining)))
+            if item is None:
+                return None
+            job = self._leave_queue(item[1], RUNNING)
+            if job is not None:
+                return job
+
+
+def open_job_store(url=JOB_QUEUE):
+    """Build the job store named by a JOB_QUEUE URL."""
+    if url.startswith('sqlite:///'):
+        return SQLiteJobStore(url[len('sqlite:///'):])
+    if url.startswith('redis+local://'):
+        return RedisJobStore(LocalRedis())
+    if url.startswith(('redis://', 'rediss://')):
+        import redis
+        return RedisJobStore(redis.Redis.from_url(url, decode_responses=True))
+    if url.startswith('memory://'):
+        return MemoryJobStore()
+    raise ValueError(f'Unsupported JOB_QUEUE: {url}')
+
+
+# ============= JOB HANDLERS =============
+
+def _run_encrypt(data, params, private, progress, folder, record):
+    thumbnail = None
+    if params.get('thumbnail'):
+        from .imaging import ImageGuardError, make_thumbnail
+        try:
+            thumbnail = make_thumbnail(data)
+        except ImageGuardError:
+            pass
+    parts = encrypt_image_parts(data, private['password'], progress, params.get('format'), thumbnail)
+    progress('store', 0, 1)
+    base_name = os.path.splitext(params['filename'])[0]
+    encrypted_filename = f"{base_name}_{secrets.token_hex(4)}.enc"
+    blob_url, error = save_file(parts, encrypted_filename, folder)
+    if error:
+        raise StorageError(f'Blob storage error: {error}')
+    record(blob_url or encrypted_filename, parts, ENCRYPTED)
+    previews = build_previews(parts, ['hex'] + params.get('preview', []))
+    result = {
+        'encrypted_filename': encrypted_filename,
+        'hex_preview': previews.pop('hex'),
+        'file_size': sum(len(part) for part in parts),
+        'original_name': params['filename'],
+        'thumbnail_size': len(thumbnail) if thumbnail else 0,
+        'download_key': blob_url or encrypted_filename,
+    }
+    result.update(previews)
+    return result
+
+
+def _run_steg_embed(data, params, private, progress, folder, record):
+    from .steg import embed_payload, steg_capacity
+    from .steg_jpeg import JPEG_SOI
+
+    stego_bytes = embed_payload(data, private['message'].encode('utf-8'), private['password'], params['ecc'], progress)
+    if stego_bytes is None:
+        raise CapacityError(f"Message too large for image capacity ({steg_capacity(data, params['ecc'])} bytes)")
+    progress('store', 0, 1)
+    base_name = os.path.splitext(params['filename'])[0]
+    extension = 'jpg' if stego_bytes[:2] == JPEG_SOI else 'png'
+    stego_filename = f"{base_name}_stego_{secrets.token_hex(4)}.{extension}"
+    blob_url, error = save_file(stego_bytes, stego_filename, folder)
+    if error:
+        raise StorageError(f'Blob storage error: {error}')
+    record(blob_url or stego_filename, stego_bytes, STEGO)
+    return {
+        'stego_filename': stego_filename,
+        'file_size': len(stego_bytes),
+        'download_key': blob_url or stego_filename,
+    }
+
+
+HANDLERS = {'encrypt': _run_encrypt, 'steg_embed': _run_steg_embed}
+
+
+# ============= RUNNER =============
+
+class JobRunner:
+    """Owns a job store and the worker threads that drain it; workers start on first submit."""
+
+    CLAIM_TIMEOUT = 1.0
+    # Seconds a worker waits after a store error, doubling on each one in a row up to MAX_BACKOFF
+    BACKOFF = 0.5
+    MAX_BACKOFF = 30.0
+
+    def __init__(self, store, upload_folder, workers=JOB_WORKERS, catalog=None):
+        self.store = store
+        self.upload_folder = upload_folder
+        self.catalog = catalog
+        self.workers = workers
+        # Uploaded inputs wait on local disk; on Vercel only /tmp is writable
+        self.input_folder = os.path.join(tempfile.gettempdir() if IS_VERCEL else upload_folder, 'jobs')
+        self.owner = secrets.token_hex(8)
+        self._secrets = {}
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def _start(self):
+        with self._lock:
+            if self._threads:
+                return
+            os.makedirs(self.input_folder, exist_ok=True)
+            for _ in range(self.workers):
+                thread = threading.Thread(target=self._work, daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, kind, data, params, private):
+        """
+        Queue a job. data is the uploaded file; params are stored with the job,
+        private (password, message) stays in this process's memory only.
+        """
+        self._start()
+        params = dict(params, filename=secure_filename(params.get('filename', '')) or 'upload')
+        # Input and secrets must be in place before a worker can claim the job
+        job_id = secrets.token_hex(16)
+        with open(os.path.join(self.input_folder, job_id), 'wb') as f:
+            f.write(data)
+        self._secrets[job_id] = private
+        return self.get(self.store.create(job_id, kind, params, self.owner)['id'])
+
+    def get(self, job_id):
+        job = self.store.get(job_id)
+        if job is not None:
+            for field in ('params', 'owner', 'cancel_requested'):
+                job.pop(field, None)
+        return job
+
+    def cancel(self, job_id):
+        """Cancel a queued job now, or ask a running one to stop. Returns the job or None."""
+        job = self.store.get(job_id)
+        if job is None or job['status'] in FINISHED:
+            return self.get(job_id)
+        # A worker may claim the job at any moment: only discard its input if it was still queued
+        if job['status'] == QUEUED and self.store.cancel_queued(job_id):
+            self._discard(job_id)
+        else:
+            self.store.update(job_id, cancel_requested=True)
+        return self.get(job_id)
+
+    def _record(self, key, data, kind, owner):
+        """Catalog a stored output; like the synchronous routes, a catalog failure does not fail the job."""
+        if self.catalog is not None:
+            try:
+                self.catalog.add(describe(key, data, owner, kind=kind))
+            except sqlite3.Error:
+                pass
+
+    def _discard(self, job_id):
+        self._secrets.pop(job_id, None)
+        path = os.path.join(self.input_folder, job_id)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def _work(self):
+        failures = 0
+        while True:
+            try:
+                job = self.store.claim(self.owner, self.CLAIM_TIMEOUT)
+                if job is not None:
+                    self._run(job)
+                failures = 0
+            except Exception as e:
+                # A store outage must not end the thread and leave queued jobs waiting forever
+                report_error(e, route='job:worker')
+                failures += 1
+                time.sleep(min(self.MAX_BACKOFF, self.BACKOFF * 2 ** (failures - 1)))
+
+    def _run(self, job):
+        job_id = job['id']
+        last = [0.0]
+
+        def progress(phase, done, total):
+            # Throttle store round trips; cancellation is noticed within 0.1s of work
+            now = time.monotonic()
+            if now - last[0] >= 0.1 or done >= total:
+                last[0] = now
+                if self.store.get(job_id).get('cancel_requested'):
+                    raise JobCancelled()
+                self.store.update(job_id, phase=phase, progress=round(done / total, 4) if total else 1.0)
+
+        try:
+            if job_id not in self._secrets:
+                raise RuntimeError('Job interrupted; submit it again')
+            with open(os.path.join(self.input_folder, job_id), 'rb') as f:
+                data = f.read()
+            owner = job['params'].get('user')
+            result = HANDLERS[job['kind']](data, job['params'], self._secrets[job_id], progress, self.upload_folder,
+                                           lambda key, stored, kind: self._record(key, stored, kind, owner))
+            self.store.update(job_id, status=DONE, phase=None, progress=1.0, result=result)
+        except JobCancelled:
+            self.store.update(job_id, status=CANCELLED)
+        except Exception as e:
+            code = report_error(e, route=f"job:{job['kind']}")
+            # Typed errors and interruptions are written for the client; anything else only by its code
+            message = str(e) if isinstance(e, (ImageVaultError, RuntimeError)) else f'Internal error ({code})'
+            self.store.update(job_id, status=FAILED, error=message, code=code)
+        finally:
+            self._discard(job_id)
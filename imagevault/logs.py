@@ -0,0 +1,198 @@
+"""
+Structured JSON logging that stays off the request path.
+
+Records from the `imagevault` loggers (app.logger included) go through a
+bounded in-memory queue to a listener thread that formats them as one JSON
+object per line on stderr, so a request only pays for building the record.
+When the queue is full, records are dropped and counted rather than
+blocking the request.
+
+Every record made during a request carries its request id (also sent back
+in X-Request-Id), route and method. Debug events, such as the per-request
+summary with its phase timings, are kept for a LOG_DEBUG_SAMPLE_RATE
+fraction of requests, whole requests at a time. report_error counts each
+failure by error code and route for GET /metrics and logs it, with the
+traceback for internal errors.
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import re
+import secrets
+import sys
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+from flask import g, has_request_context, request
+
+from .errors import ImageVaultError, error_code, error_status
+from .metrics import Counter
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+# Fraction of requests whose debug events are logged; 0 leaves debug logging off
+LOG_DEBUG_SAMPLE_RATE = float(os.environ.get('LOG_DEBUG_SAMPLE_RATE', 1.0 if LOG_LEVEL == 'DEBUG' else 0.0))
+
+logger = logging.getLogger('imagevault')
+
+ERRORS = Counter('imagevault_errors_total', 'Failed operations by error code and route.', ('code', 'route'))
+DROPPED = Counter('imagevault_log_records_dropped_total', 'Log records dropped because the log queue was full.', ())
+
+# Accepted from an upstream X-Request-Id header; anything else gets a fresh id
+REQUEST_ID = re.compile(r'^[A-Za-z0-9._:-]{1,64}$')
+# LogRecord attributes that are not event fields
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: time, level, logger, event, context and any extra fields."""
+
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname.lower(),
+            'logger': record.name,
+            'event': record.getMessage(),
+        }
+        entry.update((key, value) for key, value in vars(record).items() if key not in _RECORD_ATTRS)
+        if record.exc_info:
+            entry['exc_type'] = record.exc_info[0].__name__
+            entry['traceback'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, separators=(',', ':'))
+
+
+class ContextFilter(logging.Filter):
+    """Runs where the record is made, before it is queued: drops unsampled debug records, stamps request context."""
+
+    def filter(self, record):
+        if record.levelno <= logging.DEBUG and not debug_sampled():
+            return False
+        if has_request_context():
+            record.request_id = g.get('request_id')
+            record.route = request.url_rule.rule if request.url_rule else None
+            record.method = request.method
+        return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    QueueHandler that never waits on a full queue, and starts its listener
+    thread lazily in each process, so it survives forking workers.
+    """
+
+    def __init__(self, target, maxsize=LOG_QUEUE_SIZE):
+        super().__init__(queue.Queue(maxsize))
+        self.target = target
+        self._listener = None
+        self._pid = None
+        self._listener_lock = threading.Lock()
+        atexit.register(self.flush)
+
+    def _ensure_listener(self):
+        if self._pid == os.getpid():
+            return
+        with self._listener_lock:
+            if self._pid != os.getpid():
+                # A forked child inherits the queue but not the thread draining it
+                self.queue = queue.Queue(self.queue.maxsize)
+                self._listener = QueueListener(self.queue, self.target, respect_handler_level=True)
+                self._listener.start()
+                self._pid = os.getpid()
+
+    def prepare(self, record):
+        # The listener is in this process, so the record is not pickled: just freeze the message
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        self._ensure_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DROPPED.inc(())
+
+    def flush(self):
+        """Wait until the listener has written everything queued so far; the next record starts it again."""
+        with self._listener_lock:
+            if self._listener is not None and self._pid == os.getpid():
+                self._listener.stop()
+                self._listener = self._pid = None
+
+
+_handler = None
+
+
+def configure(stream=None):
+    """Route the imagevault loggers through the JSON queue handler (once per process). Returns the handler."""
+    global _handler
+    if _handler is None:
+        target = logging.StreamHandler(stream or sys.stderr)
+        target.setFormatter(JsonFormatter())
+        _handler = NonBlockingQueueHandler(target)
+        _handler.addFilter(ContextFilter())
+        logger.addHandler(_handler)
+        logger.propagate = False
+        # Debug records are only built when some of them will be kept
+        logger.setLevel(logging.DEBUG if LOG_DEBUG_SAMPLE_RATE > 0 else LOG_LEVEL)
+    return _handler
+
+
+def debug_sampled():
+    """Whether debug events are kept: decided once per request, or per event outside one."""
+    if not has_request_context():
+        return random.random() < LOG_DEBUG_SAMPLE_RATE
+    if 'log_debug' not in g:
+        g.log_debug = random.random() < LOG_DEBUG_SAMPLE_RATE
+    return g.log_debug
+
+
+def report_error(exc, route=None):
+    """
+    Count exc under its error code and log it: client errors (typed, below 500)
+    at info, everything else at error with the traceback.
+    Returns: the error code
+    """
+    code, status = error_code(exc), error_status(exc)
+    if route is None:
+        route = request.url_rule.rule if has_request_context() and request.url_rule else 'none'
+    ERRORS.inc((code, route))
+    fields = {'code': code, 'status': status}
+    if not has_request_context():
+        # Inside a request, ContextFilter adds the route
+        fields['route'] = route
+    if isinstance(exc, ImageVaultError) and status < 500:
+        logger.info('error', extra=dict(fields, error=str(exc)))
+    else:
+        logger.error('error', extra=fields, exc_info=(type(exc), exc, exc.__traceback__))
+    return code
+
+
+def _start_request():
+    upstream = request.headers.get('X-Request-Id', '')
+    g.request_id = upstream if REQUEST_ID.match(upstream) else secrets.token_hex(8)
+
+
+def _finish_request(response):
+    response.headers['X-Request-Id'] = g.get('request_id', '')
+    if logger.isEnabledFor(logging.DEBUG) and debug_sampled():
+        spans = g.get('spans', {})
+        started = g.get('request_start')
+        logger.debug('request', extra={
+            'status': response.status_code,
+            'duration_ms': round((time.perf_counter() - started) * 1000, 2) if started else None,
+            'request_bytes': request.content_length,
+            'phases_ms': {phase: round(seconds * 1000, 2) for phase, seconds in spans.items()},
+        })
+    return response
+
+
+def init_app(app):
+    """Install the JSON queue handler and the request id and sampled request summary hooks."""
+    configure()
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
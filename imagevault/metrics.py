@@ -0,0 +1,129 @@
+"""Request latency histograms, per-phase spans, counters and the Server-Timing header."""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    """
+    Labelled latency histogram rendered in the Prometheus text format.
+    Counts are per process; each worker exports its own series.
+    """
+
+    def __init__(self, name, help_text, label_names, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+            idx = bisect.bisect_left(self.buckets, value)
+            if idx < len(self.buckets):
+                series[0][idx] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = sorted((labels, list(counts), total, count) for labels, (counts, total, count) in self._series.items())
+        for labels, counts, total, count in series:
+            label_str = ','.join(f'{name}="{_escape_label(value)}"' for name, value in zip(self.label_names, labels))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{{{label_str},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{label_str},le="+Inf"}} {count}')
+            lines.append(f'{self.name}_sum{{{label_str}}} {total}')
+            lines.append(f'{self.name}_count{{{label_str}}} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+class Counter:
+    """Labelled counter rendered in the Prometheus text format; per process, like Histogram."""
+
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, labels):
+        with self._lock:
+            return self._values.get(labels, 0)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            label_str = ','.join(f'{name}="{_escape_label(v)}"' for name, v in zip(self.label_names, labels))
+            lines.append(f'{self.name}{{{label_str}}} {value}' if label_str else f'{self.name} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+REQUEST_LATENCY = Histogram('http_request_duration_seconds', 'Request latency by route.', ('route', 'method', 'status'))
+PHASE_LATENCY = Histogram('http_request_phase_duration_seconds', 'Time spent per request phase.', ('route', 'phase'))
+
+
+@contextmanager
+def span(phase):
+    """
+    Time a block as one phase of the current request.
+    Repeated spans of the same phase add up; outside a request this is a no-op.
+    """
+    if not has_request_context() or 'spans' not in g:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        g.spans[phase] = g.spans.get(phase, 0.0) + time.perf_counter() - start
+
+
+def _start_request_timer():
+    g.request_start = time.perf_counter()
+    g.spans = {}
+
+
+def _record_request_timing(response):
+    if 'request_start' not in g:
+        return response
+    total = time.perf_counter() - g.request_start
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    REQUEST_LATENCY.observe((route, request.method, str(response.status_code)), total)
+    timings = []
+    for phase, seconds in g.spans.items():
+        PHASE_LATENCY.observe((route, phase), seconds)
+        timings.append(f'{phase};dur={seconds * 1000:.2f}')
+    timings.append(f'total;dur={total * 1000:.2f}')
+    response.headers['Server-Timing'] = ', '.join(timings)
+    return response
+
+
+def init_app(app):
+    """Register the request timing hooks on a Flask app."""
+    app.before_request(_start_request_timer)
+    app.after_request(_record_request_timing)
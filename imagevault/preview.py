@@ -0,0 +1,132 @@
+"""Hex previews and entropy summaries of encrypted data."""
+import math
+
+# Formats the encrypt routes can return alongside the plain hex preview
+PREVIEW_FORMATS = ('hex', 'hexdump', 'entropy')
+ENTROPY_BLOCK_SIZE = 4096
+ENTROPY_BINS = 16
+# Blocks scored per numpy pass, so the per-block byte counts stay small
+ENTROPY_BATCH_BLOCKS = 256
+
+
+def leading_bytes(parts, max_bytes):
+    """
+    Return the first max_bytes of data held as a list of buffers, copying only those bytes.
+    """
+    head = bytearray()
+    for part in parts:
+        head += memoryview(part)[:max_bytes - len(head)]
+        if len(head) >= max_bytes:
+            break
+    return bytes(head)
+
+
+def get_hex_preview(data, max_bytes=512):
+    """
+    Get hexadecimal preview of encrypted data.
+    """
+    hex_string = memoryview(data)[:max_bytes].hex()
+    # Format in rows of 32 hex chars (16 bytes)
+    rows = [hex_string[i:i+32] for i in range(0, len(hex_string), 32)]
+    return '\n'.join(rows)
+
+
+def get_hexdump(data, max_bytes=512):
+    """
+    Get an `hexdump -C` style preview: offset, 16 hex bytes, printable ASCII.
+    """
+    view = memoryview(data)[:max_bytes]
+    lines = []
+    for offset in range(0, len(view), 16):
+        row = bytes(view[offset:offset + 16])
+        hex_part = ' '.join(f'{b:02x}' for b in row[:8]) + '  ' + ' '.join(f'{b:02x}' for b in row[8:])
+        ascii_part = ''.join(chr(b) if 32 <= b < 127 else '.' for b in row)
+        lines.append(f'{offset:08x}  {hex_part:<48}  |{ascii_part}|')
+    return '\n'.join(lines)
+
+
+def _iter_blocks(parts, block_size):
+    """Yield uint8 arrays of whole blocks across a list of buffers; the short tail block comes last."""
+    import numpy as np
+
+    carry = b''
+    for part in parts:
+        view = memoryview(part)
+        if carry:
+            # Finish the block left over from the previous buffer
+            need = block_size - len(carry)
+            carry += view[:need]
+            view = view[need:]
+            if len(carry) < block_size:
+                continue
+            yield np.frombuffer(carry, dtype=np.uint8).reshape(1, -1)
+            carry = b''
+        whole = len(view) // block_size * block_size
+        if whole:
+            yield np.frombuffer(view[:whole], dtype=np.uint8).reshape(-1, block_size)
+        carry = bytes(view[whole:])
+    if carry:
+        yield np.frombuffer(carry, dtype=np.uint8).reshape(1, -1)
+
+
+def block_entropies(parts, block_size=ENTROPY_BLOCK_SIZE):
+    """
+    Shannon entropy (bits per byte) of each block_size block of the data in parts.
+    Byte counts come from one bincount per batch of blocks instead of a Python loop.
+    """
+    import numpy as np
+
+    results = []
+    for blocks in _iter_blocks(parts, block_size):
+        for start in range(0, len(blocks), ENTROPY_BATCH_BLOCKS):
+            batch = blocks[start:start + ENTROPY_BATCH_BLOCKS]
+            rows, width = batch.shape
+            # Offset each block's byte values into its own 256-wide range
+            keys = batch + (np.arange(rows, dtype=np.int64) * 256)[:, None]
+            counts = np.bincount(keys.ravel(), minlength=rows * 256).reshape(rows, 256)
+            p = counts / width
+            with np.errstate(divide='ignore', invalid='ignore'):
+                results.append(-np.where(p > 0, p * np.log2(p), 0.0).sum(axis=1))
+    return np.concatenate(results) if results else np.zeros(0)
+
+
+def get_entropy_histogram(parts, block_size=ENTROPY_BLOCK_SIZE, bins=ENTROPY_BINS):
+    """
+    Summarize per-block entropy over the whole ciphertext.
+    Well-encrypted data sits just under 8 bits per byte in every block;
+    low-entropy blocks point at plaintext or a broken cipher mode.
+    Returns: dict with block stats and a histogram over 0-8 bits
+    """
+    import numpy as np
+
+    entropies = block_entropies(parts, block_size)
+    counts, edges = np.histogram(entropies, bins=bins, range=(0.0, 8.0))
+    return {
+        'block_size': block_size,
+        'blocks': int(len(entropies)),
+        'min': round(float(entropies.min()), 4) if len(entropies) else 0.0,
+        'mean': round(float(entropies.mean()), 4) if len(entropies) else 0.0,
+        'max': round(float(entropies.max()), 4) if len(entropies) else 0.0,
+        # Highest entropy a block of this size can reach
+        'ceiling': round(math.log2(min(block_size, 256)), 4),
+        'bin_edges': [round(float(edge), 2) for edge in edges],
+        'counts': [int(count) for count in counts],
+    }
+
+
+def build_previews(parts, formats, max_bytes=512):
+    """
+    Render the requested preview formats for encrypted output held as
+    [header, ciphertext chunks...]. The hex formats read only the first
+    max_bytes; the entropy histogram covers the ciphertext.
+    Returns: {format: preview}
+    """
+    previews = {}
+    head = leading_bytes(parts, max_bytes) if {'hex', 'hexdump'} & set(formats) else b''
+    if 'hex' in formats:
+        previews['hex'] = get_hex_preview(head, max_bytes)
+    if 'hexdump' in formats:
+        previews['hexdump'] = get_hexdump(head, max_bytes)
+    if 'entropy' in formats:
+        previews['entropy'] = get_entropy_histogram(parts[1:])
+    return previews
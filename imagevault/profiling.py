@@ -0,0 +1,174 @@
+"""Opt-in request profiling: sampled stacks or cProfile, kept through the storage layer."""
+import cProfile
+import marshal
+import os
+import random
+import re
+import secrets
+import sys
+import threading
+import time
+
+from flask import current_app, g, request, session
+
+from .storage import IS_VERCEL, VERCEL_BLOB_AVAILABLE, get_from_blob, list_blobs, save_to_blob
+
+# Opt-in per request with the X-Profile header (logged-in sessions only),
+# or for a random PROFILE_SAMPLE_RATE fraction of all requests
+PROFILE_HEADER = 'X-Profile'
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+PROFILE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL', 0.005))  # seconds between stack samples
+PROFILE_KEEP = int(os.environ.get('PROFILE_KEEP', 50))  # local profiles kept before the oldest are pruned
+PROFILE_PREFIX = 'profiles/'
+PROFILE_NAME = re.compile(r'^[\w.-]+\.(folded|pstats)$')
+
+
+class StackSampler:
+    """
+    Statistical profiler: a background thread samples one thread's stack
+    every `interval` seconds and counts each distinct stack. render() gives
+    the folded format read by flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, thread_id, interval=PROFILE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            if stack:
+                key = ';'.join(reversed(stack))
+                self.stacks[key] = self.stacks.get(key, 0) + 1
+
+    def render(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in sorted(self.stacks.items())).encode()
+
+
+def _profile_dir():
+    return os.path.join(current_app.config['UPLOAD_FOLDER'], 'profiles')
+
+
+def save_profile(name, data):
+    """Store a profile in blob storage or the local profiles folder. Returns error or None."""
+    if IS_VERCEL and VERCEL_BLOB_AVAILABLE:
+        return save_to_blob(data, PROFILE_PREFIX + name)[1]
+    folder = _profile_dir()
+    os.makedirs(folder, exist_ok=True)
+    with open(os.path.join(folder, name), 'wb') as f:
+        f.write(data)
+    # Names start with a timestamp, so sorting puts the oldest first
+    for old in sorted(os.listdir(folder))[:-PROFILE_KEEP]:
+        os.remove(os.path.join(folder, old))
+    return None
+
+
+def list_profiles():
+    """Stored profiles, newest first. Returns ([{'name', 'size'}], error)."""
+    if IS_VERCEL and VERCEL_BLOB_AVAILABLE:
+        blobs, error = list_blobs(PROFILE_PREFIX)
+        if error:
+            return None, error
+        profiles = [{'name': b['pathname'][len(PROFILE_PREFIX):], 'size': b['size']} for b in blobs]
+    else:
+        folder = _profile_dir()
+        names = os.listdir(folder) if os.path.isdir(folder) else []
+        profiles = [{'name': name, 'size': os.path.getsize(os.path.join(folder, name))} for name in names]
+    return sorted(profiles, key=lambda p: p['name'], reverse=True), None
+
+
+def load_profile(name):
+    """Read one stored profile. Returns (data, error); data is None if it does not exist."""
+    if IS_VERCEL and VERCEL_BLOB_AVAILABLE:
+        blobs, error = list_blobs(PROFILE_PREFIX + name)
+        if error:
+            return None, error
+        match = next((b for b in blobs if b['pathname'] == PROFILE_PREFIX + name), None)
+        return get_from_blob(match['url']) if match else (None, None)
+    path = os.path.join(_profile_dir(), name)
+    if not os.path.exists(path):
+        return None, None
+    with open(path, 'rb') as f:
+        return f.read(), None
+
+
+def _profile_mode():
+    """'cprofile', 'sample' or None for the current request."""
+    if request.endpoint in ('static', 'web.profiles', 'web.download_profile'):
+        return None
+    header = request.headers.get(PROFILE_HEADER, '')
+    if header and session.get('user'):
+        return 'cprofile' if header.lower() == 'cprofile' else 'sample'
+    if PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+        return 'sample'
+    return None
+
+
+def _start_profiler():
+    mode = _profile_mode()
+    if mode == 'cprofile':
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Only one deterministic profiler can run per process (Python 3.12+)
+            return
+    elif mode == 'sample':
+        profiler = StackSampler(threading.get_ident())
+        profiler.start()
+    else:
+        return
+    g.profiler = profiler
+
+
+def _stop_profiler():
+    profiler = g.pop('profiler', None)
+    if isinstance(profiler, StackSampler):
+        profiler.stop()
+    elif profiler is not None:
+        profiler.disable()
+    return profiler
+
+
+def _save_profile(response):
+    profiler = _stop_profiler()
+    if profiler is None:
+        return response
+    if isinstance(profiler, StackSampler):
+        data, ext = profiler.render(), 'folded'
+    else:
+        # Same layout as Profile.dump_stats, readable by pstats and snakeviz
+        profiler.create_stats()
+        data, ext = marshal.dumps(profiler.stats), 'pstats'
+    elapsed_ms = int((time.perf_counter() - g.request_start) * 1000) if 'request_start' in g else 0
+    name = f"{time.strftime('%Y%m%dT%H%M%S')}_{request.endpoint or 'unmatched'}_{elapsed_ms}ms_{secrets.token_hex(3)}.{ext}"
+    if save_profile(name, data) is None:
+        response.headers['X-Profile-Id'] = name
+    return response
+
+
+def _discard_profiler(error=None):
+    # Requests that failed before after_request still stop their sampler thread
+    _stop_profiler()
+
+
+def init_app(app):
+    """Register the profiling hooks on a Flask app."""
+    app.before_request(_start_profiler)
+    app.after_request(_save_profile)
+    app.teardown_request(_discard_profiler)
@@ -0,0 +1,179 @@
+"""
+Server-sent progress events for uploads and long-running requests.
+
+The client picks a random id, opens GET /progress/<id> as an EventSource and
+sends the same id in the X-Progress-Id header of its upload. The request then
+publishes received / kdf / encrypt / embed / stored events to that channel,
+and a final complete event once the response is ready. Channels live in the
+process that serves the upload, so both requests must reach the same worker.
+"""
+import json
+import re
+import threading
+import time
+
+from flask import g, request
+
+PROGRESS_HEADER = 'X-Progress-Id'
+PROGRESS_TTL = 60        # seconds an idle or finished channel stays readable
+KEEPALIVE_INTERVAL = 15  # seconds between SSE comments on a quiet stream
+MIN_INTERVAL = 0.05      # seconds between two events of the same kind, except the last one
+
+_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{8,64}$')
+
+
+def valid_progress_id(progress_id):
+    return bool(progress_id and _ID_PATTERN.match(progress_id))
+
+
+class ProgressChannel:
+    """Append-only event log for one request; subscribers replay it from the start."""
+
+    def __init__(self):
+        self.events = []
+        self.closed = False
+        self.touched = time.monotonic()
+        self._last_sent = {}
+        self._cond = threading.Condition()
+
+    def publish(self, event, data, final=False):
+        with self._cond:
+            if self.closed:
+                return
+            now = time.monotonic()
+            # Coalesce bursts: a 50MB upload arrives in hundreds of small reads
+            done = data.get('done') is not None and data.get('done') == data.get('total')
+            if not final and not done and now - self._last_sent.get(event, 0.0) < MIN_INTERVAL:
+                return
+            self._last_sent[event] = now
+            self.events.append((event, data))
+            self.closed = final
+            self.touched = now
+            self._cond.notify_all()
+
+    def iter_events(self, timeout=KEEPALIVE_INTERVAL):
+        """Yield (event, data) pairs, or None after timeout seconds without news, until closed."""
+        index = 0
+        while True:
+            with self._cond:
+                if index >= len(self.events) and not self.closed:
+                    self._cond.wait(timeout)
+                pending = self.events[index:]
+                closed = self.closed
+            index += len(pending)
+            if not pending and not closed:
+                yield None
+            for item in pending:
+                yield item
+            if closed and index >= len(self.events):
+                return
+
+
+_channels = {}
+_channels_lock = threading.Lock()
+
+
+def get_channel(progress_id):
+    """Return the channel for progress_id, creating it (and pruning stale ones) if needed."""
+    with _channels_lock:
+        now = time.monotonic()
+        for stale in [key for key, channel in _channels.items() if now - channel.touched > PROGRESS_TTL]:
+            del _channels[stale]
+        channel = _channels.get(progress_id)
+        if channel is None:
+            channel = _channels[progress_id] = ProgressChannel()
+        return channel
+
+
+def reporter():
+    """
+    Progress callback for the current request, or None if the client did not ask for events.
+    Matches the progress(phase, done, total) hook of encrypt_image and the embed functions.
+    """
+    channel = g.get('progress_channel')
+    if channel is None:
+        return None
+
+    def progress(phase, done, total):
+        channel.publish(phase, {'done': done, 'total': total})
+    return progress
+
+
+def publish(event, **data):
+    """Publish an event for the current request, if it has a progress channel."""
+    channel = g.get('progress_channel')
+    if channel is not None:
+        channel.publish(event, data)
+
+
+def event_stream(progress_id):
+    """Render a channel as text/event-stream chunks, ending after the complete event."""
+    channel = get_channel(progress_id)
+    deadline = time.monotonic() + PROGRESS_TTL
+    for item in channel.iter_events():
+        if item is None:
+            # Nobody published within PROGRESS_TTL: the upload went elsewhere or never came
+            if not channel.events and time.monotonic() > deadline:
+                yield 'event: timeout\ndata: {}\n\n'
+                return
+            yield ': keepalive\n\n'
+            continue
+        event, data = item
+        yield f'event: {event}\ndata: {json.dumps(data)}\n\n'
+
+
+class _CountingStream:
+    """wsgi.input wrapper that reports bytes read against the declared Content-Length."""
+
+    def __init__(self, stream, total, channel):
+        self._stream = stream
+        self._total = total
+        self._channel = channel
+        self._done = 0
+
+    def _count(self, size):
+        self._done += size or 0
+        self._channel.publish('received', {'done': self._done, 'total': self._total})
+
+    def read(self, *args):
+        data = self._stream.read(*args)
+        self._count(len(data))
+        return data
+
+    def readline(self, *args):
+        data = self._stream.readline(*args)
+        self._count(len(data))
+        return data
+
+    def readinto(self, buffer):
+        # Werkzeug's LimitedStream reads this way when the server's stream supports it
+        size = self._stream.readinto(buffer)
+        self._count(size)
+        return size
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+def _attach_channel():
+    progress_id = request.headers.get(PROGRESS_HEADER)
+    if request.method != 'POST' or not valid_progress_id(progress_id):
+        return
+    g.progress_channel = channel = get_channel(progress_id)
+    total = request.content_length
+    if total:
+        # Werkzeug parses the form lazily, so wrapping the input here sees the whole upload
+        request.environ['wsgi.input'] = _CountingStream(request.environ['wsgi.input'], total, channel)
+
+
+def _close_channel(response):
+    channel = g.get('progress_channel')
+    if channel is not None:
+        channel.publish('complete', {'status': response.status_code}, final=True)
+    return response
+
+
+def init_app(app):
+    """Register the hooks that attach progress channels to requests."""
+    app.before_request(_attach_channel)
+    app.after_request(_close_channel)
@@ -0,0 +1,175 @@
+"""
+Token-bucket rate limiting for the CPU-heavy routes.
+
+Every client has a bucket of RATE_LIMIT_BURST tokens that refills at
+RATE_LIMIT_RATE tokens per second. A request to a route in ROUTE_COSTS takes
+its base cost, plus RATE_LIMIT_KDF_COST per PBKDF2 derivation the route runs,
+plus RATE_LIMIT_MB_COST per megabyte of request body. The cost is known from
+the headers, so a client over its budget gets a 429 before its upload is
+read. Clients are keyed by IP address, or with RATE_LIMIT_KEY=session by
+their logged-in session, falling back to the IP.
+
+Rate limiting is off unless RATE_LIMIT_BACKEND is set: memory:// keeps
+buckets in an in-process LRU, so each worker process limits on its own, and
+sqlite:///path shares them between processes. Behind a reverse proxy, set
+RATE_LIMIT_PROXIES to the number of proxies that append to X-Forwarded-For,
+or every client shares the proxy's bucket.
+"""
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from flask import jsonify, request, session
+
+from .storage import IS_VERCEL
+
+# off (default), memory:// or sqlite:///path/to/ratelimit.db
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'off')
+RATE_LIMIT_RATE = float(os.environ.get('RATE_LIMIT_RATE', 5.0))     # tokens refilled per second
+RATE_LIMIT_BURST = float(os.environ.get('RATE_LIMIT_BURST', 120.0))  # bucket size; costlier requests need a full bucket
+RATE_LIMIT_KDF_COST = float(os.environ.get('RATE_LIMIT_KDF_COST', 5.0))  # tokens per 100k-iteration PBKDF2 run
+RATE_LIMIT_MB_COST = float(os.environ.get('RATE_LIMIT_MB_COST', 1.0))    # tokens per MB of request body
+RATE_LIMIT_KEY = os.environ.get('RATE_LIMIT_KEY', 'ip')  # ip or session
+# Proxies in front of the app that append to X-Forwarded-For (Vercel's edge is one)
+RATE_LIMIT_PROXIES = int(os.environ.get('RATE_LIMIT_PROXIES', 1 if IS_VERCEL else 0))
+RATE_LIMIT_MAX_KEYS = int(os.environ.get('RATE_LIMIT_MAX_KEYS', 100000))
+
+# Endpoint -> (base tokens, PBKDF2 derivations). Stego routes derive a key
+# only when given a stego password, but are charged for one regardless,
+# since the body is not parsed before the check.
+ROUTE_COSTS = {
+    'web.encrypt_route': (1, 1),
+    'web.decrypt_route': (1, 1),
+    'web.decrypt_preview': (1, 1),
+    'web.decrypt_stored': (1, 1),
+    'web.rekey': (1, 2),
+    'web.job_encrypt': (1, 1),
+    'web.steg_embed': (3, 1),
+    'web.steg_extract': (3, 1),
+    'web.steg_analyze': (3, 0),
+    'web.job_steg_embed': (3, 1),
+}
+
+
+def refill(tokens, updated, now, rate, capacity):
+    """Tokens in a bucket last left at tokens at time updated, as of now."""
+    return min(capacity, tokens + max(0.0, now - updated) * rate)
+
+
+class MemoryBucketStore:
+    """Buckets in an OrderedDict; the least recently used are dropped past max_keys (they refill anyway)."""
+
+    def __init__(self, max_keys=RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, cost, rate, capacity, now=None):
+        """Take cost tokens from key's bucket if it holds them. Returns: (allowed, tokens left)."""
+        now = time.time() if now is None else now
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (capacity, now))
+            tokens = refill(tokens, updated, now, rate, capacity)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return allowed, tokens
+
+
+class SQLiteBucketStore:
+    """Buckets as rows in SQLite, shared by every process on the host."""
+
+    def __init__(self, path):
+        self.path = path
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL, updated REAL)')
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def take(self, key, cost, rate, capacity, now=None):
+        now = time.time() if now is None else now
+        with self._connect() as conn:
+            # Take the write lock up front so two processes cannot spend the same tokens
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = conn.execute('SELECT tokens, updated FROM buckets WHERE key = ?', (key,)).fetchone()
+                tokens = refill(row[0], row[1], now, rate, capacity) if row else capacity
+                allowed = tokens >= cost
+                if allowed:
+                    tokens -= cost
+                conn.execute('INSERT OR REPLACE INTO buckets VALUES (?, ?, ?)', (key, tokens, now))
+                # Sweep buckets that have refilled completely now and then
+                if secrets.randbelow(1000) == 0:
+                    conn.execute('DELETE FROM buckets WHERE updated < ?', (now - capacity / rate,))
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+        return allowed, tokens
+
+
+def open_bucket_store(backend=RATE_LIMIT_BACKEND):
+    """Build the bucket store named by RATE_LIMIT_BACKEND, or None when rate limiting is off."""
+    if backend in ('', 'off'):
+        return None
+    if backend.startswith('sqlite:///'):
+        return SQLiteBucketStore(backend[len('sqlite:///'):])
+    if backend.startswith('memory://'):
+        return MemoryBucketStore()
+    raise ValueError(f'Unsupported RATE_LIMIT_BACKEND: {backend}')
+
+
+def request_cost(endpoint, content_length):
+    """Tokens a request to endpoint with a body of content_length bytes costs, or 0 for unlimited routes."""
+    if endpoint not in ROUTE_COSTS:
+        return 0.0
+    base, kdf_runs = ROUTE_COSTS[endpoint]
+    return base + kdf_runs * RATE_LIMIT_KDF_COST + (content_length or 0) / (1024 * 1024) * RATE_LIMIT_MB_COST
+
+
+def client_key():
+    """Bucket key for the current request: the logged-in session's client id, or the client IP."""
+    if RATE_LIMIT_KEY == 'session' and session.get('client_id'):
+        return 'session:' + session['client_id']
+    forwarded = [hop.strip() for hop in request.headers.get('X-Forwarded-For', '').split(',') if hop.strip()]
+    if RATE_LIMIT_PROXIES and len(forwarded) >= RATE_LIMIT_PROXIES:
+        # The rightmost entries were added by our own proxies; anything further left is client-supplied
+        return 'ip:' + forwarded[-RATE_LIMIT_PROXIES]
+    return 'ip:' + (request.remote_addr or 'unknown')
+
+
+def _check_rate_limit(store):
+    cost = request_cost(request.endpoint, request.content_length)
+    if not cost:
+        return None
+    # A request costing more than the bucket holds needs a full bucket rather than being refused forever
+    cost = min(cost, RATE_LIMIT_BURST)
+    allowed, tokens = store.take(client_key(), cost, RATE_LIMIT_RATE, RATE_LIMIT_BURST)
+    if allowed:
+        return None
+    retry_after = max(1, int((cost - tokens) / RATE_LIMIT_RATE + 0.999))
+    response = jsonify({'error': f'Rate limit exceeded. Retry in {retry_after}s', 'retry_after': retry_after})
+    return response, 429, {'Retry-After': str(retry_after)}
+
+
+def init_app(app, backend=RATE_LIMIT_BACKEND):
+    """Check CPU-heavy routes against the client's token bucket before they run."""
+    store = open_bucket_store(backend)
+    if store is None:
+        return
+    app.extensions['imagevault_ratelimit'] = store
+    app.before_request(lambda: _check_rate_limit(store))
@@ -0,0 +1,162 @@
+"""
+Optional server-side sessions.
+
+By default Flask keeps the whole session in the signed cookie. With
+SESSION_BACKEND set, the cookie only carries a signed random session id and
+the data lives in an in-process LRU or a SQLite table. The memory backend is
+per process, so use SQLite (or the default cookie) behind several workers.
+"""
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from flask.sessions import SessionInterface, SessionMixin
+from itsdangerous import BadSignature, Signer
+from werkzeug.datastructures import CallbackDict
+
+# cookie (default), memory:// or sqlite:///path/to/sessions.db
+SESSION_BACKEND = os.environ.get('SESSION_BACKEND', 'cookie')
+SESSION_MAX_ENTRIES = int(os.environ.get('SESSION_MAX_ENTRIES', 10000))
+
+
+class LRUSessionStore:
+    """Sessions in an OrderedDict; the least recently used are evicted past max_entries."""
+
+    def __init__(self, max_entries=SESSION_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, sid):
+        with self._lock:
+            entry = self._data.get(sid)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                del self._data[sid]
+                return None
+            self._data.move_to_end(sid)
+            return dict(entry[1])
+
+    def set(self, sid, data, ttl):
+        with self._lock:
+            self._data[sid] = (time.time() + ttl, dict(data))
+            self._data.move_to_end(sid)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, sid):
+        with self._lock:
+            self._data.pop(sid, None)
+
+
+class SQLiteSessionStore:
+    """Sessions as JSON rows in SQLite, shared by every process on the host."""
+
+    def __init__(self, path):
+        self.path = path
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS sessions (sid TEXT PRIMARY KEY, expires REAL, data TEXT)')
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def get(self, sid):
+        with self._connect() as conn:
+            row = conn.execute('SELECT data FROM sessions WHERE sid = ? AND expires >= ?', (sid, time.time())).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, sid, data, ttl):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO sessions VALUES (?, ?, ?)', (sid, now + ttl, json.dumps(dict(data))))
+            # Sweep expired rows now and then instead of on every write
+            if secrets.randbelow(100) == 0:
+                conn.execute('DELETE FROM sessions WHERE expires < ?', (now,))
+
+    def delete(self, sid):
+        with self._connect() as conn:
+            conn.execute('DELETE FROM sessions WHERE sid = ?', (sid,))
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """Keep session data in a store; the cookie holds only the signed session id."""
+
+    def __init__(self, store):
+        self.store = store
+
+    def _signer(self, app):
+        return Signer(app.secret_key, salt='imagevault-session')
+
+    def open_session(self, app, request):
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if cookie:
+            try:
+                sid = self._signer(app).unsign(cookie).decode()
+            except BadSignature:
+                sid = None
+            data = self.store.get(sid) if sid else None
+            if data is not None:
+                return ServerSession(data, sid=sid)
+        return ServerSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if not session:
+            if session.modified:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+        if not self.should_set_cookie(app, session):
+            return
+        self.store.set(session.sid, session, int(app.permanent_session_lifetime.total_seconds()))
+        response.set_cookie(
+            name,
+            self._signer(app).sign(session.sid).decode(),
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+        )
+
+
+def open_session_store(backend=SESSION_BACKEND):
+    """Build the session store named by SESSION_BACKEND, or None to keep cookie sessions."""
+    if backend in ('', 'cookie'):
+        return None
+    if backend.startswith('sqlite:///'):
+        return SQLiteSessionStore(backend[len('sqlite:///'):])
+    if backend.startswith('memory://'):
+        return LRUSessionStore()
+    raise ValueError(f'Unsupported SESSION_BACKEND: {backend}')
+
+
+def init_app(app, backend=SESSION_BACKEND):
+    """Switch app to server-side sessions when a backend is configured."""
+    store = open_session_store(backend)
+    if store is not None:
+        app.session_interface = ServerSideSessionInterface(store)
@@ -0,0 +1,118 @@
+"""Format dispatch and multi-image sharding for stego payloads."""
+import hashlib
+import secrets
+import struct
+
+from .errors import IncompleteShardSetError
+from .imaging import inspect_png_header
+from .steg_jpeg import JPEG_SOI, embed_payload_in_jpeg, estimate_jpeg_capacity, extract_payload_from_jpeg
+from .steg_png import embed_payload_in_png, extract_payload_from_png, payload_capacity
+
+
+def steg_capacity(image_bytes, ecc=False):
+    """Message capacity in bytes for a PNG or JPEG cover image."""
+    if image_bytes[:2] == JPEG_SOI:
+        return estimate_jpeg_capacity(image_bytes, ecc)
+    width, height = inspect_png_header(image_bytes)[:2]
+    return payload_capacity(width * height * 3, ecc)
+
+def embed_payload(image_bytes, payload, password=None, ecc=False, progress=None):
+    """
+    Embed raw bytes into a PNG or JPEG cover, chosen by its signature.
+    progress(phase, done, total) follows PNG strips; JPEG edits the scan in one pass.
+    """
+    if image_bytes[:2] == JPEG_SOI:
+        stego_bytes = embed_payload_in_jpeg(image_bytes, payload, password, ecc)
+        if progress:
+            progress('embed', 1, 1)
+        return stego_bytes
+    return embed_payload_in_png(image_bytes, payload, password, ecc, progress)
+
+def extract_payload(image_bytes, password=None, ecc=False):
+    """Extract raw bytes from a PNG or JPEG stego image, chosen by its signature."""
+    if image_bytes[:2] == JPEG_SOI:
+        return extract_payload_from_jpeg(image_bytes, password, ecc)
+    return extract_payload_from_png(image_bytes, password, ecc)
+
+# ============= MULTI-IMAGE SHARDING =============
+
+SHARD_MAGIC = b'SHRD'
+# magic (4) + set id (8) + sequence (2) + shard count (2) + SHA-256 of the whole message (32)
+SHARD_HEADER = struct.Struct('>4s8sHH32s')
+
+
+def embed_message_in_images(images, message, password=None, ecc=False):
+    """
+    Split a message across several cover images, filling each in turn.
+    Every shard carries SHARD_HEADER. Shards are embedded one after another
+    in the calling thread; the JSteg scan walk holds the GIL, so a thread
+    pool would not overlap them.
+    Returns [(cover_index, stego_bytes), ...] for the covers used, or None if the set is too small.
+    """
+    msg_bytes = message.encode('utf-8')
+    chunks = []
+    offset = 0
+    for index, image_bytes in enumerate(images):
+        if chunks and offset >= len(msg_bytes):
+            break
+        room = steg_capacity(image_bytes, ecc) - SHARD_HEADER.size
+        if room <= 0:
+            continue
+        chunks.append((index, msg_bytes[offset:offset + room]))
+        offset += room
+    if not chunks or offset < len(msg_bytes):
+        return None
+
+    set_id = secrets.token_bytes(8)
+    digest = hashlib.sha256(msg_bytes).digest()
+    results = [
+        embed_payload(images[index], SHARD_HEADER.pack(SHARD_MAGIC, set_id, seq, len(chunks), digest) + chunk,
+                      password, ecc)
+        for seq, (index, chunk) in enumerate(chunks)
+    ]
+    if any(result is None for result in results):
+        return None
+    return [(index, result) for (index, _), result in zip(chunks, results)]
+
+
+def is_shard_payload(payload):
+    """True if an extracted payload is one shard of a multi-image message."""
+    return payload is not None and len(payload) >= SHARD_HEADER.size and payload[:4] == SHARD_MAGIC
+
+
+def reassemble_shards(payloads):
+    """
+    Join shard payloads (any order) back into the message.
+    Raises IncompleteShardSetError if shards are missing, from different sets,
+    or fail the integrity check.
+    Returns the message string, or None if no payload is a shard.
+    """
+    shards = {}
+    set_info = None
+    for payload in payloads:
+        if not is_shard_payload(payload):
+            continue
+        _, set_id, seq, total, digest = SHARD_HEADER.unpack_from(payload)
+        if set_info is None:
+            set_info = (set_id, total, digest)
+        elif set_info != (set_id, total, digest):
+            raise IncompleteShardSetError('Images hold shards of different messages')
+        shards[seq] = payload[SHARD_HEADER.size:]
+    if set_info is None:
+        return None
+    _, total, digest = set_info
+    if sorted(shards) != list(range(total)):
+        raise IncompleteShardSetError(f'Images hold {len(shards)} of {total} shards; upload the whole set')
+    msg_bytes = b''.join(shards[seq] for seq in range(total))
+    if hashlib.sha256(msg_bytes).digest() != digest:
+        raise IncompleteShardSetError('Shards failed the integrity check; an image is damaged')
+    try:
+        return msg_bytes.decode('utf-8')
+    except Exception:
+        return None
+
+
+def extract_message_from_images(images, password=None, ecc=False):
+    """Extract shards from a set of stego images and reassemble the message."""
+    return reassemble_shards([extract_payload(image_bytes, password, ecc) for image_bytes in images])
+
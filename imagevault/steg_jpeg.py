@@ -0,0 +1,333 @@
+"""JSteg-style steganography in quantized JPEG DCT coefficients."""
+import itertools
+import math
+import re
+import struct
+from io import BytesIO
+
+from PIL import Image
+
+from .imaging import ImageGuardError, check_decode_budget
+from .metrics import span
+from .steg_png import STEG_MAX_PAYLOAD, _bits_to_bytes, _frame_payload, _slot_order, _unframe_payload, payload_capacity
+
+JPEG_SOI = b'\xff\xd8'
+STEG_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+# End of entropy-coded data: any marker other than a stuffed 0xFF00 or RSTn
+_JPEG_SCAN_END = re.compile(rb'\xff[^\x00\xd0-\xd7]')
+_JPEG_RST = re.compile(rb'(\xff[\xd0-\xd7])')
+
+
+def _peek16(data, pos):
+    """Next 16 bits from bit position pos, padded with 1-bits past the end."""
+    i = pos >> 3
+    chunk = int.from_bytes(data[i:i + 3].ljust(3, b'\xff'), 'big')
+    return (chunk >> (8 - (pos & 7))) & 0xFFFF
+
+
+class _HuffmanTable:
+    """Canonical JPEG Huffman table with an 8-bit fast lookup."""
+
+    def __init__(self, counts, symbols):
+        self.symbols = symbols
+        self.fast = [None] * 256
+        self.maxcode = [-1] * 17
+        self.valptr = [0] * 17
+        self.mincode = [0] * 17
+        code = 0
+        k = 0
+        for length in range(1, 17):
+            self.valptr[length] = k
+            self.mincode[length] = code
+            for _ in range(counts[length - 1]):
+                if length <= 8:
+                    shift = 8 - length
+                    for low in range(1 << shift):
+                        self.fast[(code << shift) | low] = (length, symbols[k])
+                code += 1
+                k += 1
+            if counts[length - 1]:
+                self.maxcode[length] = code - 1
+            code <<= 1
+
+    def decode(self, data, pos):
+        """Decode one symbol at bit position pos. Returns (symbol, new_pos)."""
+        peek = _peek16(data, pos)
+        hit = self.fast[peek >> 8]
+        if hit is not None:
+            return hit[1], pos + hit[0]
+        for length in range(9, 17):
+            code = peek >> (16 - length)
+            if code <= self.maxcode[length]:
+                return self.symbols[self.valptr[length] + code - self.mincode[length]], pos + length
+        raise ImageGuardError('Corrupt JPEG entropy-coded data')
+
+
+def _parse_jpeg(image_bytes):
+    """
+    Walk the marker segments up to the first scan.
+    Returns frame/scan/table info, or None when the stream is not
+    sequential Huffman-coded (progressive, arithmetic, 12-bit, ...).
+    """
+    if image_bytes[:2] != JPEG_SOI:
+        raise ImageGuardError('Not a valid JPEG image')
+    tables = {}
+    frame = None
+    restart_interval = 0
+    pos = 2
+    while True:
+        if pos + 4 > len(image_bytes) or image_bytes[pos] != 0xFF:
+            raise ImageGuardError('Corrupt or truncated JPEG image')
+        marker = image_bytes[pos + 1]
+        if marker == 0xFF:
+            pos += 1
+            continue
+        length = struct.unpack('>H', image_bytes[pos + 2:pos + 4])[0]
+        if length < 2 or pos + 2 + length > len(image_bytes):
+            raise ImageGuardError('Corrupt or truncated JPEG image')
+        seg = image_bytes[pos + 4:pos + 2 + length]
+        if marker == 0xC4:
+            i = 0
+            while i + 17 <= len(seg):
+                counts = list(seg[i + 1:i + 17])
+                n = sum(counts)
+                if i + 17 + n > len(seg):
+                    raise ImageGuardError('Corrupt JPEG Huffman table')
+                tables[(seg[i] >> 4, seg[i] & 15)] = _HuffmanTable(counts, list(seg[i + 17:i + 17 + n]))
+                i += 17 + n
+        elif marker == 0xDD:
+            restart_interval = struct.unpack('>H', seg[:2])[0]
+        elif marker in (0xC0, 0xC1):
+            if len(seg) < 6 or len(seg) < 6 + 3 * seg[5]:
+                raise ImageGuardError('Corrupt JPEG frame header')
+            precision, height, width, ncomp = struct.unpack('>BHHB', seg[:6])
+            if precision != 8 or height == 0:
+                return None
+            check_decode_budget(width, height, rows=8)
+            comps = {}
+            for c in range(ncomp):
+                cid, hv = seg[6 + 3 * c], seg[7 + 3 * c]
+                comps[cid] = (hv >> 4, hv & 15)
+            frame = (width, height, comps)
+        elif 0xC2 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            return None
+        elif marker == 0xDA:
+            if frame is None:
+                raise ImageGuardError('Corrupt JPEG image: scan before frame header')
+            if not seg or len(seg) < 1 + 2 * seg[0]:
+                raise ImageGuardError('Corrupt JPEG scan header')
+            scan = []
+            for c in range(seg[0]):
+                cid, tdta = seg[1 + 2 * c], seg[2 + 2 * c]
+                dc, ac = tables.get((0, tdta >> 4)), tables.get((1, tdta & 15))
+                if cid not in frame[2] or dc is None or ac is None:
+                    return None
+                scan.append((cid, dc, ac))
+            return {
+                'frame': frame,
+                'scan': scan,
+                'restart_interval': restart_interval,
+                'scan_start': pos + 2 + length,
+            }
+        pos += 2 + length
+
+
+def _split_jpeg_scan(image_bytes, info):
+    """
+    Cut the first scan out of the file.
+    Returns (head, segments, rst_markers, tail) where segments are the
+    unstuffed entropy-coded restart intervals.
+    """
+    start = info['scan_start']
+    m = _JPEG_SCAN_END.search(image_bytes, start)
+    end = m.start() if m else len(image_bytes)
+    parts = _JPEG_RST.split(image_bytes[start:end])
+    segments = [bytearray(p.replace(b'\xff\x00', b'\xff')) for p in parts[0::2]]
+    return image_bytes[:start], segments, parts[1::2], image_bytes[end:]
+
+
+def _iter_jsteg_slots(info, segments):
+    """
+    Yield (segment, bit_pos) of the last magnitude bit of every AC coefficient
+    with |value| >= 2, in scan order. Flipping that bit keeps the coefficient in
+    the same size category, so Huffman symbols and stream length are unchanged
+    and no DCT or Huffman re-encoding is needed.
+    """
+    width, height, comps = info['frame']
+    hmax = max(h for h, v in comps.values())
+    vmax = max(v for h, v in comps.values())
+    if len(info['scan']) == 1:
+        # Non-interleaved scan: one block per MCU
+        cid, dc, ac = info['scan'][0]
+        h, v = comps[cid]
+        blocks_x = math.ceil(math.ceil(width * h / hmax) / 8)
+        blocks_y = math.ceil(math.ceil(height * v / vmax) / 8)
+        mcu_count = blocks_x * blocks_y
+        mcu_tables = [(dc, ac)]
+    else:
+        mcu_count = math.ceil(width / (8 * hmax)) * math.ceil(height / (8 * vmax))
+        mcu_tables = []
+        for cid, dc, ac in info['scan']:
+            h, v = comps[cid]
+            mcu_tables.extend([(dc, ac)] * (h * v))
+
+    restart_interval = info['restart_interval']
+    seg_idx = 0
+    data = segments[0]
+    end = len(data) * 8
+    pos = 0
+    for mcu in range(mcu_count):
+        if restart_interval and mcu and mcu % restart_interval == 0:
+            seg_idx += 1
+            if seg_idx >= len(segments):
+                raise ImageGuardError('Truncated JPEG scan')
+            data = segments[seg_idx]
+            end = len(data) * 8
+            pos = 0
+        for dc, ac in mcu_tables:
+            size, pos = dc.decode(data, pos)
+            pos += size
+            k = 1
+            while k < 64:
+                rs, pos = ac.decode(data, pos)
+                run, size = rs >> 4, rs & 15
+                if size == 0:
+                    if run != 15:
+                        break
+                    k += 16
+                    continue
+                k += run + 1
+                pos += size
+                if size >= 2:
+                    if pos > end:
+                        raise ImageGuardError('Truncated JPEG scan')
+                    yield seg_idx, pos - 1
+        if pos > end:
+            raise ImageGuardError('Truncated JPEG scan')
+
+
+def _transcode_baseline_jpeg(image_bytes):
+    """Re-save a progressive/arithmetic JPEG as baseline, keeping its quantization tables."""
+    try:
+        with span('jpeg_transcode'), Image.open(BytesIO(image_bytes)) as img:
+            check_decode_budget(*img.size)
+            out = BytesIO()
+            img.save(out, format='JPEG', quality='keep', subsampling='keep')
+    except (OSError, Image.DecompressionBombError) as e:
+        raise ImageGuardError(f'Cannot decode JPEG image: {e}')
+    return out.getvalue()
+
+
+def _jsteg_positions(info, segments, n_bits, password=None):
+    """Positions for n_bits payload bits, or None if the scan is too small."""
+    slots = _iter_jsteg_slots(info, segments)
+    if not password:
+        positions = list(itertools.islice(slots, n_bits))
+        return positions if len(positions) == n_bits else None
+    slots = list(slots)
+    if n_bits > len(slots):
+        return None
+    order = _slot_order(len(slots), password)
+    return [slots[order(i)] for i in range(n_bits)]
+
+
+def estimate_jpeg_capacity(image_bytes, ecc=False):
+    """Message bytes (after framing) that fit in a JPEG."""
+    info = _parse_jpeg(image_bytes)
+    if info is None:
+        image_bytes = _transcode_baseline_jpeg(image_bytes)
+        info = _parse_jpeg(image_bytes)
+    segments = _split_jpeg_scan(image_bytes, info)[1]
+    usable = sum(1 for _ in _iter_jsteg_slots(info, segments))
+    return payload_capacity(usable, ecc)
+
+
+def embed_bits_in_jpeg(image_bytes, bits, password=None):
+    """Embed bits into JPEG by JSteg-style LSB replacement on quantized AC coefficients.
+    The entropy-coded scan is edited in place; only non-sequential JPEGs are re-encoded first.
+    Returns JPEG bytes with embedded bits or None if too large.
+    """
+    info = _parse_jpeg(image_bytes)
+    if info is None:
+        image_bytes = _transcode_baseline_jpeg(image_bytes)
+        info = _parse_jpeg(image_bytes)
+        if info is None:
+            raise ImageGuardError('Unsupported JPEG encoding')
+    with span('image_decode'):
+        head, segments, markers, tail = _split_jpeg_scan(image_bytes, info)
+        positions = _jsteg_positions(info, segments, len(bits), password)
+    if positions is None:
+        return None
+    with span('bit_packing'):
+        for (seg_idx, pos), bit in zip(positions, bits):
+            mask = 0x80 >> (pos & 7)
+            if bit:
+                segments[seg_idx][pos >> 3] |= mask
+            else:
+                segments[seg_idx][pos >> 3] &= ~mask & 0xFF
+
+    out = [head]
+    for i, segment in enumerate(segments):
+        out.append(bytes(segment).replace(b'\xff', b'\xff\x00'))
+        if i < len(markers):
+            out.append(markers[i])
+    out.append(tail)
+    return b''.join(out)
+
+
+def embed_payload_in_jpeg(image_bytes, msg_bytes, password=None, ecc=False):
+    """Embed raw bytes into JPEG, optionally Reed-Solomon protected. Returns JPEG bytes or None if too large."""
+    if len(msg_bytes) > STEG_MAX_PAYLOAD:
+        return None
+    return embed_bits_in_jpeg(image_bytes, _frame_payload(msg_bytes, ecc), password)
+
+
+def embed_message_in_jpeg(image_bytes, message, password=None, ecc=False):
+    """Embed a utf-8 message into JPEG. Returns JPEG bytes or None if too large."""
+    return embed_payload_in_jpeg(image_bytes, message.encode('utf-8'), password, ecc)
+
+
+def _jpeg_bit_reader(image_bytes, password=None):
+    """Bit reader over a JPEG's usable AC coefficients for _unframe_payload.
+    Without a password the scan is only parsed as far as the bits requested.
+    """
+    info = _parse_jpeg(image_bytes)
+    if info is None:
+        return None
+    segments = _split_jpeg_scan(image_bytes, info)[1]
+    pending = _iter_jsteg_slots(info, segments)
+    if password:
+        slots = list(pending)
+        order = _slot_order(len(slots), password)
+    else:
+        slots = []
+        order = None
+
+    def read(start, stop):
+        if order is None and stop > len(slots):
+            slots.extend(itertools.islice(pending, stop - len(slots)))
+        if stop > len(slots):
+            return None
+        positions = [slots[order(i) if order else i] for i in range(start, stop)]
+        return _bits_to_bytes([(segments[s][p >> 3] >> (7 - (p & 7))) & 1 for s, p in positions])
+    return read
+
+
+def extract_payload_from_jpeg(image_bytes, password=None, ecc=False):
+    """Extract raw bytes embedded in JPEG AC coefficients. Returns bytes or None."""
+    read = _jpeg_bit_reader(image_bytes, password)
+    if read is None:
+        return None
+    return _unframe_payload(read, ecc)
+
+
+def extract_message_from_jpeg(image_bytes, password=None, ecc=False):
+    """Extract message embedded in JPEG AC coefficients. Returns message string or None."""
+    msg_bytes = extract_payload_from_jpeg(image_bytes, password, ecc)
+    if msg_bytes is None:
+        return None
+    try:
+        return msg_bytes.decode('utf-8')
+    except Exception:
+        return None
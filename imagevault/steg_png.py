@@ -0,0 +1,305 @@
+"""LSB steganography in PNG pixels, plus payload framing shared with JPEG."""
+import hashlib
+import os
+
+import numpy as np
+
+from .crypto import derive_key_from_password
+from .fec import FEC_DATA, FEC_HEADER_BITS, FEC_HEADER_PARITY, FEC_PARITY, fec_body_size, fec_decode, fec_decode_length, fec_encode
+from .imaging import PNGStripWriter, inspect_png_header, iter_png_strips
+from .metrics import span
+
+
+def _int_to_bits(n, length):
+    return [(n >> i) & 1 for i in range(length)][::-1]
+
+def _bytes_to_bits(b):
+    bits = []
+    for byte in b:
+        bits.extend(_int_to_bits(byte, 8))
+    return bits
+
+def _bits_to_bytes(bits):
+    out = bytearray()
+    for i in range(0, len(bits), 8):
+        byte = 0
+        for bit in bits[i:i+8]:
+            byte = (byte << 1) | bit
+        out.append(byte)
+    return bytes(out)
+
+# Largest payload embedded or extracted, whatever the cover holds; bounds the work a forged length header causes
+STEG_MAX_PAYLOAD = int(os.environ.get('STEG_MAX_PAYLOAD', 1024 * 1024))
+# Keyed slot positions are generated and sorted this many at a time when reading
+SLOT_CHUNK = 1 << 19
+
+# Fixed salt so the embed and extract sides derive the same ordering key
+STEG_KEY_SALT = b'lsb-pixel-order!'
+
+class KeyedPermutation:
+    """
+    Pseudo-random permutation of range(n) keyed by a secret.
+    A 4-round Feistel network over the smallest even-bit domain >= n,
+    with cycle-walking back into range; each position is computed
+    on demand, so no n-element shuffle is ever built. Each round only
+    sees half the bits, so many() tabulates the round functions once and
+    permutes whole arrays of indices with numpy.
+    """
+    ROUNDS = 4
+
+    def __init__(self, key, n):
+        self.key = key
+        self.n = n
+        bits = max(2, (n - 1).bit_length())
+        self.half_bits = (bits + 1) // 2
+        self.mask = (1 << self.half_bits) - 1
+        self._tables = None
+
+    def _round(self, r, value):
+        digest = hashlib.blake2b(bytes([r]) + value.to_bytes(8, 'big'), key=self.key, digest_size=8).digest()
+        return int.from_bytes(digest, 'big') & self.mask
+
+    def __call__(self, index):
+        x = index
+        while True:
+            left, right = x >> self.half_bits, x & self.mask
+            for r in range(self.ROUNDS):
+                left, right = right, left ^ self._round(r, right)
+            x = (left << self.half_bits) | right
+            if x < self.n:
+                return x
+
+    def many(self, indices):
+        """Permute an int64 array of indices; same results as calling the permutation on each."""
+        if self._tables is None and len(indices) * 2 < self.mask + 1:
+            # Too few to pay for the round tables
+            return np.fromiter((self(int(i)) for i in indices), np.int64, len(indices))
+        if self._tables is None:
+            self._tables = np.array([[self._round(r, v) for v in range(self.mask + 1)] for r in range(self.ROUNDS)],
+                                    dtype=np.int64)
+        out = np.array(indices, dtype=np.int64)
+        pending = np.arange(len(out))
+        while len(pending):
+            x = out[pending]
+            left, right = x >> self.half_bits, x & self.mask
+            for r in range(self.ROUNDS):
+                left, right = right, left ^ self._tables[r][right]
+            out[pending] = (left << self.half_bits) | right
+            pending = pending[out[pending] >= self.n]
+        return out
+
+def _slot_order(capacity, password=None):
+    """
+    Map payload bit index -> channel slot (pixel * 3 + channel).
+    Sequential without a password, scattered by a KeyedPermutation with one.
+    """
+    if not password:
+        return lambda i: i
+    return KeyedPermutation(derive_key_from_password(password, STEG_KEY_SALT), capacity)
+
+def _slot_positions(order, start, stop):
+    """order applied to payload bits start..stop-1, as an int64 array."""
+    if isinstance(order, KeyedPermutation):
+        return order.many(np.arange(start, stop, dtype=np.int64))
+    return np.arange(start, stop, dtype=np.int64)
+
+def _strip_bytes(slots):
+    """RGBA byte offsets of channel slots (pixel * 3 + channel) counted from a strip's first slot."""
+    return slots + slots // 3
+
+def _read_sorted_slots(image_bytes, width, slots):
+    """
+    LSBs at ascending channel slots, as a uint8 array, decoding one strip at a
+    time and stopping at the strip holding the last one.
+    """
+    values = np.empty(len(slots), dtype=np.uint8)
+    idx = 0
+    for y, rows, strip in iter_png_strips(image_bytes):
+        if idx == len(slots):
+            break
+        first = y * width * 3
+        stop = int(np.searchsorted(slots, first + rows * width * 3))
+        if stop > idx:
+            pixels = np.frombuffer(strip, dtype=np.uint8)
+            values[idx:stop] = pixels[_strip_bytes(slots[idx:stop] - first)] & 1
+            idx = stop
+    return values
+
+def _read_slot_run(image_bytes, width, start, stop):
+    """LSBs of channel slots start..stop-1 packed into bytes, a strip at a time."""
+    out = bytearray()
+    carry = np.empty(0, dtype=np.uint8)
+    for y, rows, strip in iter_png_strips(image_bytes):
+        first = y * width * 3
+        end = first + rows * width * 3
+        if end <= start:
+            continue
+        channels = np.frombuffer(strip, dtype=np.uint8).reshape(-1, 4)[:, :3].reshape(-1)
+        bits = np.concatenate((carry, channels[max(start, first) - first:min(stop, end) - first] & 1))
+        whole = len(bits) - len(bits) % 8
+        out += np.packbits(bits[:whole]).tobytes()
+        carry = bits[whole:]
+        if end >= stop:
+            break
+    return bytes(out)
+
+def _read_lsb_slots(image_bytes, width, slots):
+    """Read the LSB at each channel slot, decoding strips only up to the last one needed."""
+    slots = np.asarray(slots, dtype=np.int64)
+    order = np.argsort(slots, kind='stable')
+    values = np.empty(len(slots), dtype=np.uint8)
+    values[order] = _read_sorted_slots(image_bytes, width, slots[order])
+    return values.tolist()
+
+def payload_capacity(bits, ecc=False):
+    """Largest payload in bytes that fits in `bits` embeddable bits once framed."""
+    if not ecc:
+        return min(STEG_MAX_PAYLOAD, max(0, bits // 8 - 4))
+    usable = bits // 8 - (4 + FEC_HEADER_PARITY)
+    if usable <= FEC_PARITY:
+        return 0
+    full, rest = divmod(usable, FEC_DATA + FEC_PARITY)
+    length = full * FEC_DATA + max(0, rest - FEC_PARITY)
+    while length and fec_body_size(length) > usable:
+        length -= 1
+    return min(STEG_MAX_PAYLOAD, length)
+
+def _frame_bytes(payload, ecc=False):
+    """Bytes to embed: a 32-bit length prefix + payload, or the Reed-Solomon container."""
+    if ecc:
+        return fec_encode(payload)
+    return len(payload).to_bytes(4, 'big') + payload
+
+def _frame_payload(payload, ecc=False):
+    """_frame_bytes as a list of bits."""
+    with span('bit_packing'):
+        return _bytes_to_bits(_frame_bytes(payload, ecc))
+
+def _unframe_payload(read, ecc=False):
+    """
+    Read a framed payload through read(start, stop), which returns the bytes
+    packed from the bits in that range, or None past the end of the capacity.
+    A length header above STEG_MAX_PAYLOAD is rejected before reading the body.
+    """
+    if ecc:
+        header = read(0, FEC_HEADER_BITS)
+        if header is None:
+            return None
+        length = fec_decode_length(header)
+        if length is None or length > STEG_MAX_PAYLOAD:
+            return None
+        body = read(FEC_HEADER_BITS, FEC_HEADER_BITS + fec_body_size(length) * 8)
+        if body is None:
+            return None
+        return fec_decode(body, length)
+
+    # First 32 bits = length in bytes
+    header = read(0, 32)
+    if header is None:
+        return None
+    msg_len = int.from_bytes(header, 'big')
+    if msg_len > STEG_MAX_PAYLOAD:
+        return None
+    return read(32, 32 + msg_len * 8)
+
+def embed_bits_in_png(image_bytes, bits, password=None, progress=None):
+    """Embed bits into PNG using simple LSB on RGB channels.
+    With a password, bits are scattered over the image in a keyed order.
+    The image is processed in row strips, so beyond the payload's own slot
+    positions memory stays bounded by the strip size;
+    progress('embed', rows_done, height) is called after each strip.
+    Returns PNG bytes with embedded bits or None if too large.
+    """
+    width, height = inspect_png_header(image_bytes)[:2]
+
+    # Each pixel gives 3 bits (R,G,B LSB)
+    capacity = width * height * 3
+    if len(bits) > capacity:
+        return None
+
+    bits = np.asarray(bits, dtype=np.uint8)
+    writes = None
+    if password:
+        # Slot and bit packed into one sorted int64 array: slot * 2 + bit
+        order = _slot_order(capacity, password)
+        with span('bit_packing'):
+            writes = np.empty(len(bits), dtype=np.int64)
+            for start in range(0, len(bits), SLOT_CHUNK):
+                stop = min(start + SLOT_CHUNK, len(bits))
+                writes[start:stop] = _slot_positions(order, start, stop) * 2
+            writes |= bits
+            writes.sort()
+    writer = PNGStripWriter(width, height)
+    for y, rows, strip in iter_png_strips(image_bytes):
+        # Channel slot of the strip's first R value; strips without payload bits are copied unchanged
+        first = y * width * 3
+        end = first + rows * width * 3
+        if writes is None:
+            slots = np.arange(first, min(end, len(bits)), dtype=np.int64)
+            values = bits[first:first + len(slots)]
+        else:
+            lo, hi = np.searchsorted(writes, (first * 2, end * 2))
+            slots = writes[lo:hi] >> 1
+            values = (writes[lo:hi] & 1).astype(np.uint8)
+        if len(slots):
+            with span('bit_packing'):
+                pixels = np.frombuffer(strip, dtype=np.uint8).copy()
+                offsets = _strip_bytes(slots - first)
+                pixels[offsets] = (pixels[offsets] & 0xFE) | values
+                strip = pixels.tobytes()
+        writer.write_strip(strip, rows)
+        if progress:
+            progress('embed', y + rows, height)
+    return writer.finish()
+
+def embed_payload_in_png(image_bytes, msg_bytes, password=None, ecc=False, progress=None):
+    """Embed raw bytes into PNG, optionally Reed-Solomon protected. Returns PNG bytes or None if too large."""
+    if len(msg_bytes) > STEG_MAX_PAYLOAD:
+        return None
+    with span('bit_packing'):
+        bits = np.unpackbits(np.frombuffer(_frame_bytes(msg_bytes, ecc), dtype=np.uint8))
+    return embed_bits_in_png(image_bytes, bits, password, progress)
+
+def embed_message_in_png(image_bytes, message, password=None, ecc=False, progress=None):
+    """Embed a utf-8 message into PNG. Returns PNG bytes or None if too large."""
+    return embed_payload_in_png(image_bytes, message.encode('utf-8'), password, ecc, progress)
+
+def _png_bit_reader(image_bytes, password=None):
+    """Bit reader over a PNG's LSB slots for _unframe_payload.
+    Only the channel slots asked for are read, and decoding stops at the strip
+    holding the last one. Keyed slots are generated and sorted SLOT_CHUNK at
+    a time, one strip pass per chunk, so no whole-payload position list is built.
+    """
+    width, height = inspect_png_header(image_bytes)[:2]
+    capacity = width * height * 3
+    order = _slot_order(capacity, password) if password else None
+
+    def read(start, stop):
+        if stop > capacity:
+            return None
+        if order is None:
+            return _read_slot_run(image_bytes, width, start, stop)
+        out = bytearray()
+        for begin in range(start, stop, SLOT_CHUNK):
+            end = min(begin + SLOT_CHUNK, stop)
+            slots = _slot_positions(order, begin, end)
+            ranks = np.argsort(slots, kind='stable')
+            values = np.empty(len(slots), dtype=np.uint8)
+            values[ranks] = _read_sorted_slots(image_bytes, width, slots[ranks])
+            out += np.packbits(values).tobytes()
+        return bytes(out)
+    return read
+
+def extract_payload_from_png(image_bytes, password=None, ecc=False):
+    """Extract raw bytes embedded in PNG via LSB. Returns bytes or None."""
+    return _unframe_payload(_png_bit_reader(image_bytes, password), ecc)
+
+def extract_message_from_png(image_bytes, password=None, ecc=False):
+    """Extract message embedded in PNG via LSB. Returns message string or None."""
+    msg_bytes = extract_payload_from_png(image_bytes, password, ecc)
+    if msg_bytes is None:
+        return None
+    try:
+        return msg_bytes.decode('utf-8')
+    except Exception:
+        return None
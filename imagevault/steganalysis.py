@@ -0,0 +1,200 @@
+"""Statistical detectors for LSB payloads in PNG and JPEG images."""
+import math
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+from .imaging import iter_png_strips, inspect_png_header
+from .steg_jpeg import _parse_jpeg, extract_message_from_jpeg
+from .steg_png import _bits_to_bytes, _read_lsb_slots
+
+CHI_SQUARE_BANDS = 10
+SUSPICIOUS_RATE = 0.05
+RS_MASK = np.array([0, 1, 1, 0], dtype=bool)
+
+
+def _chi_square_p_value(histogram):
+    """
+    Westfeld-Pfitzmann pairs-of-values test on a 256-bin histogram.
+    Returns the probability that the value pairs were equalized by LSB embedding.
+    """
+    even = histogram[0::2].astype(np.float64)
+    odd = histogram[1::2].astype(np.float64)
+    expected = (even + odd) / 2
+    valid = expected > 4
+    dof = int(valid.sum()) - 1
+    if dof < 1:
+        return 0.0
+    chi2 = float((((even - expected) ** 2)[valid] / expected[valid]).sum())
+    # Wilson-Hilferty approximation of the chi-square upper tail
+    z = ((chi2 / dof) ** (1 / 3) - (1 - 2 / (9 * dof))) / math.sqrt(2 / (9 * dof))
+    return 0.5 * math.erfc(z / math.sqrt(2))
+
+
+def _rs_counts(groups):
+    """Regular/singular group counts for mask M and -M over (..., 4) pixel groups."""
+    def smoothness(g):
+        return np.abs(np.diff(g, axis=-1)).sum(axis=-1)
+
+    base = smoothness(groups)
+    flip_pos = groups.copy()
+    flip_pos[..., RS_MASK] ^= 1
+    flip_neg = groups.copy()
+    flip_neg[..., RS_MASK] = ((flip_neg[..., RS_MASK] + 1) ^ 1) - 1
+    pos, neg = smoothness(flip_pos), smoothness(flip_neg)
+    return np.array([(pos > base).sum(), (pos < base).sum(), (neg > base).sum(), (neg < base).sum()])
+
+
+def _rs_rate(counts, flipped_counts, total):
+    """Solve the RS quadratic (Fridrich et al.) for the embedding rate."""
+    if total == 0:
+        return 0.0
+    r_m, s_m, r_nm, s_nm = (float(n) / total for n in counts)
+    r_m1, s_m1, r_nm1, s_nm1 = (float(n) / total for n in flipped_counts)
+    d0, d1 = r_m - s_m, r_m1 - s_m1
+    dn0, dn1 = r_nm - s_nm, r_nm1 - s_nm1
+    a = 2 * (d1 + d0)
+    b = dn0 - dn1 - d1 - 3 * d0
+    c = d0 - dn0
+    if abs(a) < 1e-12:
+        x = -c / b if abs(b) > 1e-12 else 0.0
+    else:
+        disc = b * b - 4 * a * c
+        if disc < 0:
+            # The roots run off to infinity as the rate nears 1, so near-full embeds
+            # leave no real root at all: report the maximum rate, not a clean cover
+            return 1.0
+        roots = [(-b + math.sqrt(disc)) / (2 * a), (-b - math.sqrt(disc)) / (2 * a)]
+        x = min(roots, key=abs)
+    if abs(x - 0.5) < 1e-12:
+        return 1.0
+    return min(1.0, max(0.0, x / (x - 0.5)))
+
+
+def _sample_pair_rate(x, y, k, n):
+    """Sample pair analysis (Dumitrescu et al.) estimate from the pair counts."""
+    if k == 0 or n == 0:
+        return 0.0
+    a = 2 * k
+    b = 2 * (2 * x - n)
+    c = y - x
+    disc = b * b - 4 * a * c
+    if disc < 0:
+        # Near-full embeds can leave no real root; the vertex is the closest fit
+        beta = -b / (2 * a)
+    else:
+        # The smaller root is the fraction of flipped LSBs, half the embedding rate
+        beta = min((-b + math.sqrt(disc)) / (2 * a), (-b - math.sqrt(disc)) / (2 * a))
+    return min(1.0, max(0.0, 2 * beta))
+
+
+def _check_own_png_payload(image_bytes, width, height):
+    """
+    Fast check for a sequential embed_message_in_png payload: the 32-bit
+    length header must fit the image and the first bytes must be valid UTF-8.
+    """
+    capacity = width * height * 3
+    if capacity < 32:
+        return {'detected': False}
+    header_bits = _read_lsb_slots(image_bytes, width, list(range(32)))
+    msg_len = int.from_bytes(_bits_to_bytes(header_bits), 'big')
+    if msg_len == 0 or 32 + msg_len * 8 > capacity:
+        return {'detected': False}
+    sample = _bits_to_bytes(_read_lsb_slots(image_bytes, width, list(range(32, 32 + min(msg_len, 64) * 8))))
+    try:
+        sample.decode('utf-8')
+    except UnicodeDecodeError as e:
+        # A multi-byte character cut off by the sample window is still plausible
+        if e.start < len(sample) - 3:
+            return {'detected': False}
+    return {'detected': True, 'message_length': msg_len}
+
+
+def analyze_png_lsb(image_bytes):
+    """
+    Run chi-square, RS and sample pair analysis over the RGB channels of a PNG,
+    accumulating vectorized statistics strip by strip.
+    Returns a dict of per-test results and an overall estimated embedding rate.
+    """
+    width, height = inspect_png_header(image_bytes)[:2]
+    band_hists = np.zeros((CHI_SQUARE_BANDS, 256), dtype=np.int64)
+    rs = np.zeros(4, dtype=np.int64)
+    rs_flipped = np.zeros(4, dtype=np.int64)
+    rs_groups = 0
+    pairs = np.zeros(4, dtype=np.int64)  # x, y, k, n
+
+    for y, rows, strip in iter_png_strips(image_bytes):
+        rgb = np.frombuffer(strip, dtype=np.uint8).reshape(rows, width, 4)[:, :, :3]
+
+        # Chi-square histograms per horizontal band, for the sequential-fill profile
+        bands = np.arange(y, y + rows) * CHI_SQUARE_BANDS // height
+        for band in np.unique(bands):
+            values = rgb[bands == band].ravel()
+            band_hists[band] += np.bincount(values, minlength=256)
+
+        # RS: horizontal groups of 4 pixels, each channel separately
+        usable = width - width % 4
+        if usable:
+            groups = rgb[:, :usable, :].astype(np.int16).transpose(0, 2, 1).reshape(rows, 3, -1, 4)
+            rs += _rs_counts(groups)
+            rs_flipped += _rs_counts(groups ^ 1)
+            rs_groups += groups.shape[0] * groups.shape[1] * groups.shape[2]
+
+        # Sample pairs: horizontally adjacent pixels in the same channel
+        if width > 1:
+            u = rgb[:, :-1, :].astype(np.int16)
+            v = rgb[:, 1:, :].astype(np.int16)
+            v_even = (v & 1) == 0
+            pairs += np.array([
+                ((v_even & (u < v)) | (~v_even & (u > v))).sum(),
+                ((v_even & (u > v)) | (~v_even & (u < v))).sum(),
+                ((u >> 1) == (v >> 1)).sum(),
+                u.size,
+            ])
+
+    cumulative = np.cumsum(band_hists, axis=0)
+    p_values = [round(_chi_square_p_value(h), 4) for h in cumulative]
+    filled_bands = 0
+    for p in p_values:
+        if p < 0.5:
+            break
+        filled_bands += 1
+
+    rs_rate = _rs_rate(rs, rs_flipped, rs_groups)
+    spa_rate = _sample_pair_rate(*(int(n) for n in pairs))
+    own_payload = _check_own_png_payload(image_bytes, width, height)
+    estimated_rate = (rs_rate + spa_rate) / 2
+
+    return {
+        'format': 'png',
+        'width': width,
+        'height': height,
+        'chi_square': {
+            'p_values': p_values,
+            'embedded_fraction': filled_bands / CHI_SQUARE_BANDS,
+        },
+        'rs_analysis': {'rate': round(rs_rate, 4)},
+        'sample_pairs': {'rate': round(spa_rate, 4)},
+        'own_payload': own_payload,
+        'estimated_rate': round(estimated_rate, 4),
+        'suspicious': own_payload['detected'] or estimated_rate > SUSPICIOUS_RATE,
+    }
+
+
+def analyze_jpeg_payload(image_bytes):
+    """Header plausibility check for a sequential embed_message_in_jpeg payload."""
+    info = _parse_jpeg(image_bytes)
+    width, height = Image.open(BytesIO(image_bytes)).size if info is None else info['frame'][:2]
+    own_payload = {'detected': False}
+    if info is not None:
+        message = extract_message_from_jpeg(image_bytes)
+        if message:
+            own_payload = {'detected': True, 'message_length': len(message.encode('utf-8'))}
+    return {
+        'format': 'jpeg',
+        'width': width,
+        'height': height,
+        'own_payload': own_payload,
+        'suspicious': own_payload['detected'],
+    }
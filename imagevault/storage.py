@@ -0,0 +1,134 @@
+"""Local and Vercel Blob storage configuration and helpers."""
+import mmap
+import os
+
+# Vercel Blob storage imports (only available on Vercel platform)
+VERCEL_BLOB_AVAILABLE = False
+try:
+    import vercel.blob  # noqa: F401
+    VERCEL_BLOB_AVAILABLE = True
+except ImportError:
+    pass
+
+# Check if running on Vercel
+IS_VERCEL = os.environ.get('VERCEL') == '1'
+
+# Default local folder for encrypted and stego files
+UPLOAD_FOLDER = 'encrypted_files'
+
+
+def save_file(data, filename, folder):
+    """
+    Save output to Vercel Blob storage when deployed, otherwise to folder.
+    data may be bytes or a list of byte chunks, which are written out in turn.
+    Returns: (blob URL or None for local files, error)
+    """
+    parts = data if isinstance(data, list) else [data]
+    if IS_VERCEL and VERCEL_BLOB_AVAILABLE:
+        # The blob client uploads a single buffer
+        return save_to_blob(b''.join(parts), filename)
+    with open(os.path.join(folder, filename), 'wb') as f:
+        f.writelines(parts)
+    return None, None
+
+class MappedFile:
+    """
+    Read-only view of a stored file. Local files are mmap'ed, so reading them
+    costs no Python bytes, and pages already processed can be dropped with
+    release() to keep RSS flat on large files. Blob data is wrapped as is.
+    """
+
+    def __init__(self, path=None, data=None):
+        self._file = self._map = None
+        self._released = 0
+        if path is not None:
+            self._file = open(path, 'rb')
+            # A zero-length file cannot be mapped
+            if os.fstat(self._file.fileno()).st_size:
+                self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            data = self._map if self._map is not None else b''
+        self.view = memoryview(data)
+
+    def __len__(self):
+        return len(self.view)
+
+    def release(self, end):
+        """Drop the mapped pages before offset end from this process; they are re-read from the page cache if touched."""
+        if self._map is None or not hasattr(self._map, 'madvise') or not hasattr(mmap, 'MADV_DONTNEED'):
+            return
+        end -= end % mmap.PAGESIZE
+        if end > self._released:
+            self._map.madvise(mmap.MADV_DONTNEED, self._released, end - self._released)
+            self._released = end
+
+    def chunks(self, size, offset=0):
+        """Yield consecutive slices of up to size bytes from offset, releasing each one's pages once the next is asked for."""
+        for start in range(offset, len(self.view), size):
+            yield self.view[start:start + size]
+            self.release(start + size)
+
+    def close(self):
+        try:
+            self.view.release()
+            if self._map is not None:
+                self._map.close()
+        except BufferError:
+            pass  # views still held elsewhere; the mapping goes when they do
+        if self._file is not None:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def save_to_blob(data, filename):
+    """Save data to Vercel Blob storage and return the blob URL."""
+    if not VERCEL_BLOB_AVAILABLE:
+        return None, "Blob storage not available"
+
+    try:
+        from vercel.blob import put
+        blob = put(filename, data)
+        return blob.url, None
+    except Exception as e:
+        return None, str(e)
+
+def get_from_blob(url):
+    """Get data from Vercel Blob storage URL."""
+    if not VERCEL_BLOB_AVAILABLE:
+        return None, "Blob storage not available"
+
+    try:
+        from vercel.blob import get
+        blob = get(url)
+        return blob.read(), None
+    except Exception as e:
+        return None, str(e)
+
+def delete_from_blob(url):
+    """Delete file from Vercel Blob storage."""
+    if not VERCEL_BLOB_AVAILABLE:
+        return False, "Blob storage not available"
+
+    try:
+        from vercel.blob import delete
+        delete(url)
+        return True, None
+    except Exception as e:
+        return False, str(e)
+
+def list_blobs(prefix=''):
+    """List blobs whose pathname starts with prefix. Returns ([{'url', 'pathname', 'size', 'uploaded'}], error)."""
+    if not VERCEL_BLOB_AVAILABLE:
+        return None, "Blob storage not available"
+
+    try:
+        from vercel.blob import list as blob_list
+        result = blob_list(prefix=prefix)
+        blobs = getattr(result, 'blobs', result)
+        return [{'url': b.url, 'pathname': b.pathname, 'size': getattr(b, 'size', None),
+                 'uploaded': getattr(b, 'uploaded_at', None)} for b in blobs], None
+    except Exception as e:
+        return None, str(e)
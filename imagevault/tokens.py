@@ -0,0 +1,46 @@
+"""
+Signed, expiring download links.
+
+A token is an HMAC-SHA256 over the object key (local filename or blob URL)
+and an expiry timestamp, keyed with the app's secret key. Checking one needs
+no session or storage lookup, so any worker or serverless instance sharing
+the secret can authorize a download.
+"""
+import base64
+import hashlib
+import hmac
+import os
+import time
+from urllib.parse import urlencode
+
+DOWNLOAD_TOKEN_TTL = int(os.environ.get('DOWNLOAD_TOKEN_TTL', 3600))  # seconds a link stays valid
+
+
+def _signature(key, expires, secret):
+    secret = secret.encode() if isinstance(secret, str) else secret
+    digest = hmac.new(secret, f'download\n{key}\n{expires}'.encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b'=').decode()
+
+
+def sign_download(key, secret, ttl=DOWNLOAD_TOKEN_TTL, now=None):
+    """Returns: (expires, sig) query values authorizing a download of key."""
+    expires = int(now if now is not None else time.time()) + ttl
+    return expires, _signature(key, expires, secret)
+
+
+def verify_download(key, expires, sig, secret, now=None):
+    """Check a download token in constant time. Returns: True if valid and not expired."""
+    try:
+        expires = int(expires)
+    except (TypeError, ValueError):
+        return False
+    if expires < (now if now is not None else time.time()) or not sig:
+        return False
+    # Compare bytes: compare_digest rejects str arguments with non-ASCII characters
+    return hmac.compare_digest(_signature(key, expires, secret).encode(), sig.encode())
+
+
+def download_url(key, secret, ttl=DOWNLOAD_TOKEN_TTL):
+    """Relative /download URL for key with a fresh token."""
+    expires, sig = sign_download(key, secret, ttl)
+    return f"/download/{key}?{urlencode({'expires': expires, 'sig': sig})}"
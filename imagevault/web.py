@@ -0,0 +1,962 @@
+"""Flask application factory and routes."""
+import base64
+import os
+import secrets
+import sqlite3
+import tempfile
+from datetime import timedelta
+from io import BytesIO
+
+from flask import (
+    Blueprint, Flask, Response, current_app, g, jsonify, redirect, render_template, request, send_file, session, url_for,
+)
+from werkzeug.utils import secure_filename
+
+from . import catalog as catalog_module
+from . import logs
+from . import metrics as metrics_module
+from . import profiling
+from . import progress as progress_module
+from . import ratelimit
+from . import sessions
+from .catalog import (
+    CATALOG_BACKEND, CATALOG_MAX_PAGE_SIZE, CATALOG_PAGE_SIZE, ENCRYPTED, KINDS, STEGO, decode_cursor, describe, hash_later,
+)
+from .crypto import (
+    HEADER_SIZE, STREAM_CHUNK, container_version, decrypt_into, encrypt_image_parts, header_format, header_length,
+    open_thumbnail, parse_header, read_header, rekey_fields,
+)
+from .engine import CRYPTO_SELF_TEST, TAG_SIZE, self_test
+from .errors import (
+    CapacityError, CryptoError, ImageVaultError, IncompleteShardSetError, PayloadNotFoundError, StorageError,
+    error_status,
+)
+from .formats import EXTENSION_FORMATS, IMAGE_FORMATS, SNIFF_BYTES, sniff_format, sniff_upload
+from .jobs import FINISHED, JobRunner, open_job_store
+from .metrics import span
+from .preview import PREVIEW_FORMATS, build_previews, get_entropy_histogram, get_hex_preview, get_hexdump
+from .profiling import PROFILE_NAME, list_profiles, load_profile
+from .progress import event_stream, publish, reporter, valid_progress_id
+from .storage import IS_VERCEL, UPLOAD_FOLDER, VERCEL_BLOB_AVAILABLE, MappedFile, delete_from_blob, get_from_blob, save_to_blob
+from .tokens import download_url, verify_download
+
+# Templates and static files live with the original app
+WEB_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Project_of_IS')
+
+# Configuration
+ALLOWED_EXTENSIONS = set(EXTENSION_FORMATS)
+# Formats the LSB and DCT stego engines handle
+STEG_FORMATS = ('png', 'jpeg')
+MAX_FILE_SIZE = 50 * 1024 * 1024  # 50MB
+
+# Simple team info to display after login
+TEAM_NAMES = "1) Muhammad Tayyab Mujtaba Khan (F24609035)  2) Owais Ismail (F24609055)  3) Qasim Usman (F24609008)"
+
+# Stego and steganalysis routes import their engine modules on first use,
+# so serverless cold starts for encrypt/decrypt skip numpy and Pillow
+bp = Blueprint('web', __name__)
+
+
+def create_app(static_folder=None, template_folder=None, upload_folder=UPLOAD_FOLDER, catalog_backend=CATALOG_BACKEND):
+    """
+    Build the Flask app with routes, metrics and profiling hooks registered.
+    catalog_backend is a CATALOG_BACKEND URL; pass one alongside a temporary upload_folder.
+    """
+    app = Flask(
+        __name__,
+        static_folder=static_folder or os.path.join(WEB_ROOT, 'static'),
+        static_url_path='/static',
+        template_folder=template_folder or os.path.join(WEB_ROOT, 'templates'),
+    )
+    # Also signs download links, so every instance must share it
+    app.secret_key = os.environ.get('SECRET_KEY', 'your-secret-key-change-this-in-production')
+    app.config['SESSION_PERMANENT'] = False
+    app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(hours=1)
+    app.config['UPLOAD_FOLDER'] = upload_folder
+    # First, so app.logger writes JSON and even a rate-limited response gets a request id
+    logs.init_app(app)
+    # internal_error logs unhandled exceptions through report_error, with their
+    # code and request id; Flask's own log_exception would log each one twice
+    app.log_exception = lambda exc_info: None
+    if CRYPTO_SELF_TEST:
+        # MB/s single-threaded and across the crypto pool, for sizing workers
+        app.config['CRYPTO_SELF_TEST'] = self_test()
+        app.logger.info('crypto self-test: %s', app.config['CRYPTO_SELF_TEST'])
+
+    if not IS_VERCEL and not os.path.exists(upload_folder):
+        os.makedirs(upload_folder)
+
+    metrics_module.init_app(app)
+    profiling.init_app(app)
+    progress_module.init_app(app)
+    # After progress, so a refused upload still closes its event stream with the 429
+    ratelimit.init_app(app)
+    sessions.init_app(app)
+    catalog_module.init_app(app, catalog_backend)
+    app.extensions['imagevault_jobs'] = JobRunner(open_job_store(), upload_folder,
+                                                  catalog=app.extensions.get('imagevault_catalog'))
+    app.register_blueprint(bp)
+    return app
+
+
+def allowed_file(filename):
+    """Check if file extension is allowed."""
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+
+
+def thumbnail_for(image_bytes):
+    """
+    Thumbnail bytes when the 'thumbnail' form field is set, else None.
+    Images Pillow cannot decode are encrypted without one.
+    """
+    if request.form.get('thumbnail', '') not in ('1', 'true', 'on'):
+        return None
+    from .imaging import ImageGuardError, make_thumbnail
+    try:
+        return make_thumbnail(image_bytes)
+    except ImageGuardError:
+        return None
+
+
+def sniff_uploads(files, allowed=None):
+    """
+    Check each upload's magic bytes against its extension before any body is read,
+    so mismatched or non-image files are rejected before decoding or encryption.
+    Returns: (list of format names, error)
+    """
+    formats = []
+    for file in files:
+        image_format, error = sniff_upload(file, allowed)
+        if error:
+            return None, f'{file.filename}: {error}' if len(files) > 1 else error
+        formats.append(image_format)
+    return formats, None
+
+
+def error_response(exc, message='Internal server error', **fields):
+    """
+    JSON error for exc, counted and logged under its error code. Typed errors
+    keep their message; anything else gets message and the request id to find it in the logs.
+    """
+    code = logs.report_error(exc)
+    status = error_status(exc)
+    if isinstance(exc, ImageVaultError):
+        message = str(exc)
+    elif status == 503:
+        message = 'Server is out of memory; retry later'
+    return jsonify({'error': message, 'code': code, 'request_id': g.get('request_id'), **fields}), status
+
+
+def catalog_add(key, data, kind):
+    """
+    Record a newly stored file of kind (ENCRYPTED or STEGO) in the catalog; its content
+    hash is filled in after the response. A catalog failure is logged; the upload still succeeds.
+    """
+    catalog = current_app.extensions.get('imagevault_catalog')
+    if catalog is None:
+        return
+    try:
+        with span('catalog_write'):
+            catalog.add(describe(key, data, session.get('user'), digest=False, kind=kind))
+        hash_later(catalog, key, data, kind)
+    except sqlite3.Error as e:
+        current_app.logger.warning('catalog write failed for %s: %s', key, e)
+
+
+def preview_formats():
+    """Extra preview formats asked for in the comma-separated 'preview' field. Returns (formats, error)."""
+    formats = [name.strip() for name in request.values.get('preview', '').split(',') if name.strip()]
+    unknown = [name for name in formats if name not in PREVIEW_FORMATS]
+    if unknown:
+        return None, f"Unknown preview format: {', '.join(unknown)}. Choose from {', '.join(PREVIEW_FORMATS)}"
+    return [name for name in formats if name != 'hex'], None
+
+# ============= FLASK ROUTES =============
+
+@bp.route('/')
+def index():
+    """Render landing home page."""
+    # require login
+    if not session.get('user'):
+        return redirect(url_for('.login'))
+    return render_template('home.html', team_names=TEAM_NAMES)
+
+
+@bp.route('/app')
+def app_page():
+    """Render the main application page (encrypt/decrypt/steganography)."""
+    if not session.get('user'):
+        return redirect(url_for('.login'))
+    return render_template('index.html', team_names=TEAM_NAMES)
+
+@bp.route('/background')
+def background():
+    """Render project background page."""
+    if not session.get('user'):
+        return redirect(url_for('.login'))
+    return render_template('background.html', team_names=TEAM_NAMES)
+
+@bp.route('/encrypt', methods=['POST'])
+def encrypt_route():
+    """
+    Encrypt uploaded image.
+    Expects: image file + password
+    Returns: encrypted file info + hex preview
+    """
+    try:
+        # Validate request
+        if 'image' not in request.files or 'password' not in request.form:
+            return jsonify({'error': 'Missing image or password'}), 400
+        
+        file = request.files['image']
+        password = request.form.get('password', '')
+        
+        if file.filename == '':
+            return jsonify({'error': 'No file selected'}), 400
+        
+        if not allowed_file(file.filename):
+            return jsonify({'error': 'Invalid file type. Only PNG, JPG, GIF, BMP, WebP, TIFF allowed'}), 400
+        
+        if len(password) < 4:
+            return jsonify({'error': 'Password must be at least 4 characters'}), 400
+
+        formats, error = preview_formats()
+        if error:
+            return jsonify({'error': error}), 400
+
+        sniffed, error = sniff_uploads([file])
+        if error:
+            return jsonify({'error': error}), 400
+        
+        # Read image bytes
+        with span('upload_read'):
+            image_bytes = file.read()
+        
+        if len(image_bytes) > MAX_FILE_SIZE:
+            return jsonify({'error': f'File too large. Max {MAX_FILE_SIZE/(1024*1024)}MB'}), 400
+        
+        # Encrypt image; the output stays in chunks so a large file is never copied into one buffer
+        thumbnail = thumbnail_for(image_bytes)
+        parts = encrypt_image_parts(image_bytes, password, reporter(), sniffed[0], thumbnail)
+        file_size = sum(len(part) for part in parts)
+
+        # Save encrypted file
+        filename = secure_filename(file.filename)
+        base_name = os.path.splitext(filename)[0]
+        encrypted_filename = f"{base_name}_{secrets.token_hex(4)}.enc"
+
+        if IS_VERCEL and VERCEL_BLOB_AVAILABLE:
+            # Use Vercel Blob storage
+            with span('storage_write'):
+                blob_url, error = save_to_blob(b''.join(parts), encrypted_filename)
+            if error:
+                return error_response(StorageError(f'Blob storage error: {error}'))
+        else:
+            # Use local filesystem
+            filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], encrypted_filename)
+            with span('storage_write'), open(filepath, 'wb') as f:
+                f.writelines(parts)
+            blob_url = None
+        publish('stored', bytes=file_size)
+        catalog_add(blob_url or encrypted_filename, parts, ENCRYPTED)
+
+        # Generate hex preview (and any extra formats) from the leading chunks
+        previews = build_previews(parts, ['hex'] + formats)
+        
+        response_data = {
+            'success': True,
+            'message': 'Image encrypted successfully',
+            'encrypted_filename': encrypted_filename,
+            'hex_preview': previews.pop('hex'),
+            'file_size': file_size,
+            'original_name': filename,
+            'thumbnail_size': len(thumbnail) if thumbnail else 0,
+            # Signed link; /download checks it without a session or storage lookup
+            'download_url': download_url(blob_url or encrypted_filename, current_app.secret_key),
+            **previews
+        }
+
+        return jsonify(response_data), 200
+    
+    except Exception as e:
+        return error_response(e, 'Encryption failed')
+
+@bp.route('/download/<path:filename>')
+def download_encrypted(filename):
+    """Download an encrypted or stego file. Requires the expires/sig token from the download_url."""
+    if not verify_download(filename, request.args.get('expires'), request.args.get('sig'), current_app.secret_key):
+        return jsonify({'error': 'Invalid or expired download link'}), 403
+    try:
+        if IS_VERCEL and VERCEL_BLOB_AVAILABLE:
+            # Handle blob storage URLs
+            if filename.startswith('http'):
+                # This is a blob URL, fetch and serve the content
+                data, error = get_from_blob(filename)
+                if error:
+                    return error_response(StorageError(f'Blob retrieval error: {error}'))
+                if data is None:
+                    return jsonify({'error': 'File not found'}), 404
+
+                # Extract filename from URL or use default
+                download_name = filename.split('/')[-1] if '/' in filename else 'encrypted_file.enc'
+                return Response(data, mimetype='application/octet-stream',
+                              headers={'Content-Disposition': f'attachment; filename={download_name}'})
+            else:
+                return jsonify({'error': 'Invalid file URL'}), 400
+        else:
+            # Local filesystem handling
+            # Security: prevent directory traversal
+            if '..' in filename or '/' in filename or '\\' in filename:
+                return jsonify({'error': 'Invalid filename'}), 400
+
+            filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
+
+            if not os.path.exists(filepath):
+                return jsonify({'error': 'File not found'}), 404
+
+            return send_file(filepath, as_attachment=True, download_name=filename)
+
+    except Exception as e:
+        return error_response(e, 'Download failed')
+
+@bp.route('/decrypt', methods=['POST'])
+def decrypt_route():
+    """
+    Decrypt uploaded encrypted file.
+    Expects: encrypted file + password
+    Returns: decrypted image (base64) or error message
+    """
+    try:
+        # Validate request
+        if 'encrypted_file' not in request.files or 'password' not in request.form:
+            return jsonify({'error': 'Missing encrypted file or password'}), 400
+        
+        file = request.files['encrypted_file']
+        password = request.form.get('password', '')
+        
+        if file.filename == '':
+            return jsonify({'error': 'No file selected'}), 400
+        
+        if not file.filename.endswith('.enc'):
+            return jsonify({'error': 'File must be .enc (encrypted) file'}), 400
+        
+        # Read encrypted file
+        with span('upload_read'):
+            encrypted_data = file.read()
+        
+        # Decrypt; the error type tells a wrong password from a damaged file
+        out = BytesIO()
+        try:
+            decrypt_into(encrypted_data, out, password)
+        except CryptoError as e:
+            return error_response(e)
+        decrypted_bytes = out.getvalue()
+        
+        # Convert to base64 for display
+        image_base64 = base64.b64encode(decrypted_bytes).decode('utf-8')
+        
+        # The header records the format (authenticated by the GCM tag); only legacy files are sniffed
+        image_type = header_format(encrypted_data) or sniff_format(decrypted_bytes) or 'png'
+        mime_type = IMAGE_FORMATS[image_type][1]
+        
+        return jsonify({
+            'success': True,
+            'message': 'Image decrypted successfully',
+            'image_data': f"data:{mime_type};base64,{image_base64}",
+            'image_type': image_type
+        }), 200
+    
+    except Exception as e:
+        return error_response(e, 'Decryption failed')
+
+@bp.route('/decrypt/preview', methods=['POST'])
+def decrypt_preview():
+    """
+    Decrypt only the thumbnail stored in an .enc file.
+    Expects: password + either an uploaded encrypted_file, or the file key with
+    the expires/sig of its download link (file, expires, sig). Only the header
+    is read, so the image ciphertext is never decrypted.
+    """
+    password = request.form.get('password', '')
+    if not password:
+        return jsonify({'error': 'Missing password'}), 400
+    if 'encrypted_file' in request.files:
+        with span('upload_read'):
+            head = read_header(request.files['encrypted_file'].stream)
+    elif 'file' in request.form:
+        key = request.form['file']
+        if not verify_download(key, request.form.get('expires'), request.form.get('sig'), current_app.secret_key):
+            return jsonify({'error': 'Invalid or expired download link'}), 403
+        head, error = _read_stored_header(key)
+        if error:
+            return jsonify({'error': error[0]}), error[1]
+    else:
+        return jsonify({'error': 'Missing encrypted file'}), 400
+
+    try:
+        thumbnail = open_thumbnail(head, password)
+    except CryptoError as e:
+        return error_response(e)
+    return jsonify({
+        'success': True,
+        'image_data': f"data:image/jpeg;base64,{base64.b64encode(thumbnail).decode('utf-8')}",
+        'image_type': 'jpeg',
+        'original_type': header_format(head),
+        'bytes_read': len(head),
+    }), 200
+
+
+def _open_stored(key):
+    """
+    Open a stored file by its download key: local files are mmap'ed, blobs are
+    fetched whole since the blob client has no ranged reads.
+    Raises StorageError if the blob cannot be fetched, answered by error_response.
+    Returns (MappedFile, None) or (None, (error, status)); close the MappedFile when done.
+    """
+    if IS_VERCEL and VERCEL_BLOB_AVAILABLE:
+        if not key.startswith('http'):
+            return None, ('Invalid file URL', 400)
+        data, error = get_from_blob(key)
+        if error:
+            raise StorageError(f'Blob retrieval error: {error}')
+        if data is None:
+            return None, ('File not found', 404)
+        return MappedFile(data=data), None
+    if '..' in key or '/' in key or '\\' in key:
+        return None, ('Invalid filename', 400)
+    filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], key)
+    if not os.path.exists(filepath):
+        return None, ('File not found', 404)
+    return MappedFile(filepath), None
+
+
+def _read_stored_header(key):
+    """Read the header of a stored .enc file. Returns (head, None) or (None, (error, status))."""
+    stored, error = _open_stored(key)
+    if error:
+        return None, error
+    with stored:
+        return bytes(stored.view[:header_length(stored.view[:HEADER_SIZE])]), None
+
+
+@bp.route('/decrypt/stored', methods=['POST'])
+def decrypt_stored():
+    """
+    Decrypt a stored .enc file and send the image back as a download.
+    Expects: password + the file key with the expires/sig of its download link.
+    Local files are mmap'ed and decrypted a batch at a time into a temporary
+    file, dropping pages as they are read, so memory stays flat for any size.
+    """
+    password = request.form.get('password', '')
+    if not password:
+        return jsonify({'error': 'Missing password'}), 400
+    key = request.form.get('file', '')
+    if not verify_download(key, request.form.get('expires'), request.form.get('sig'), current_app.secret_key):
+        return jsonify({'error': 'Invalid or expired download link'}), 403
+    stored, error = _open_stored(key)
+    if error:
+        return jsonify({'error': error[0]}), error[1]
+    out = tempfile.TemporaryFile()
+    with stored:
+        try:
+            decrypt_into(stored.view, out, password, stored.release)
+        except CryptoError as e:
+            out.close()
+            return error_response(e)
+        recorded_format = header_format(stored.view)
+    out.seek(0)
+    image_type = recorded_format or sniff_format(out.read(SNIFF_BYTES)) or 'png'
+    out.seek(0)
+    name = key.rsplit('/', 1)[-1]
+    name = name[:-4] if name.endswith('.enc') else name
+    if '.' not in name:
+        name += '.' + IMAGE_FORMATS[image_type][2][0]
+    return send_file(out, mimetype=IMAGE_FORMATS[image_type][1], as_attachment=True, download_name=name)
+
+
+@bp.route('/rekey', methods=['POST'])
+def rekey():
+    """
+    Change the password of a stored .enc file without re-encrypting it.
+    Expects: password, new_password + the file key with the expires/sig of its download link.
+    Only the wrapped data key in the header is rewritten: local files are patched
+    in place, blobs are uploaded again with the new header and the old blob deleted.
+    Copies of the file taken earlier still open with the old password.
+    Returns: a download_url for the rekeyed file
+    """
+    password = request.form.get('password', '')
+    new_password = request.form.get('new_password', '')
+    if not password or not new_password:
+        return jsonify({'error': 'Missing password or new password'}), 400
+    if len(new_password) < 4:
+        return jsonify({'error': 'New password must be at least 4 characters'}), 400
+    key = request.form.get('file', '')
+    if not verify_download(key, request.form.get('expires'), request.form.get('sig'), current_app.secret_key):
+        return jsonify({'error': 'Invalid or expired download link'}), 403
+    head, error = _read_stored_header(key)
+    if error:
+        return jsonify({'error': error[0]}), error[1]
+    try:
+        offset, key_fields = rekey_fields(head, password, new_password)
+    except CryptoError as e:
+        return error_response(e)
+
+    if IS_VERCEL and VERCEL_BLOB_AVAILABLE:
+        data, error = get_from_blob(key)
+        if error or data is None:
+            return error_response(StorageError(f'Blob retrieval error: {error or "file not found"}'))
+        with span('storage_write'):
+            new_key, error = save_to_blob(data[:offset] + key_fields + data[offset + len(key_fields):],
+                                          key.rsplit('/', 1)[-1])
+        if error:
+            return error_response(StorageError(f'Blob storage error: {error}'))
+        if new_key != key:
+            # The old blob still opens with the old password
+            delete_from_blob(key)
+            catalog = current_app.extensions.get('imagevault_catalog')
+            if catalog is not None:
+                catalog.rename(key, new_key)
+    else:
+        with span('storage_write'), open(os.path.join(current_app.config['UPLOAD_FOLDER'], key), 'r+b') as f:
+            f.seek(offset)
+            f.write(key_fields)
+        new_key = key
+    return jsonify({
+        'success': True,
+        'message': 'Password changed',
+        'download_url': download_url(new_key, current_app.secret_key),
+    }), 200
+
+
+@bp.route('/stat/<path:filename>')
+def stat_stored(filename):
+    """
+    Describe a stored .enc file without decrypting it: header fields, sizes and
+    previews (the 'preview' query field takes the same formats as /encrypt; the
+    entropy histogram covers the ciphertext after the header).
+    Requires the expires/sig token from its download_url. Local files are
+    mmap'ed; the entropy histogram walks them a chunk at a time.
+    """
+    if not verify_download(filename, request.args.get('expires'), request.args.get('sig'), current_app.secret_key):
+        return jsonify({'error': 'Invalid or expired download link'}), 403
+    formats, error = preview_formats()
+    if error:
+        return jsonify({'error': error}), 400
+    stored, error = _open_stored(filename)
+    if error:
+        return jsonify({'error': error[0]}), error[1]
+    with stored:
+        view = stored.view
+        header = parse_header(view)
+        if header is None:
+            return jsonify({'error': 'Not an encrypted file'}), 400
+        body_size = len(view) - header.offset
+        segments = None
+        if header.segment_size:
+            segments = -(-body_size // (header.segment_size + TAG_SIZE))
+        result = {
+            'success': True,
+            'file_size': len(view),
+            'version': container_version(view) or 0,
+            'image_format': header.image_format,
+            'cipher': header.cipher,
+            'rekeyable': header.wrapped_key is not None,
+            'segment_size': header.segment_size or None,
+            'segments': segments,
+            'header_size': header.offset,
+            'thumbnail_size': header.thumbnail[3] if header.thumbnail else None,
+            'plaintext_size': body_size - (segments * TAG_SIZE if segments is not None else 0),
+            'hex_preview': get_hex_preview(view),
+        }
+        if 'hexdump' in formats:
+            result['hexdump'] = get_hexdump(view)
+        if 'entropy' in formats:
+            result['entropy'] = get_entropy_histogram(stored.chunks(STREAM_CHUNK, header.offset))
+    return jsonify(result), 200
+
+
+@bp.route('/files')
+def list_files():
+    """
+    Page through the catalog of stored files, newest first, without listing storage.
+    Query: owner ('' for files stored without a login), kind (encrypted, stego),
+    format, hash (SHA-256), min_size, max_size, since, until (Unix times), limit, cursor
+    Returns: files, each with a signed download_url, and next_cursor (null on the last page)
+    """
+    if not session.get('user'):
+        return jsonify({'error': 'Login required'}), 401
+    catalog = current_app.extensions.get('imagevault_catalog')
+    if catalog is None:
+        return jsonify({'error': 'File catalog is disabled'}), 404
+    args = request.args
+    if args.get('kind') not in (None,) + KINDS:
+        return jsonify({'error': f"Unknown kind. Use one of: {', '.join(KINDS)}"}), 400
+    try:
+        filters = {name: int(args[name]) for name in ('min_size', 'max_size') if name in args}
+        filters.update({name: float(args[name]) for name in ('since', 'until') if name in args})
+        limit = int(args.get('limit', CATALOG_PAGE_SIZE))
+        if not 1 <= limit <= CATALOG_MAX_PAGE_SIZE:
+            raise ValueError(f'limit must be between 1 and {CATALOG_MAX_PAGE_SIZE}')
+        cursor = decode_cursor(args['cursor']) if 'cursor' in args else None
+    except ValueError as e:
+        return jsonify({'error': f'Invalid query: {e}'}), 400
+    entries, next_cursor = catalog.query(owner=args.get('owner'), kind=args.get('kind'),
+                                         image_format=args.get('format'), content_hash=args.get('hash'),
+                                         cursor=cursor, limit=limit, **filters)
+    for entry in entries:
+        entry['download_url'] = download_url(entry.pop('key'), current_app.secret_key)
+    return jsonify({'success': True, 'files': entries, 'next_cursor': next_cursor}), 200
+
+
+@bp.route('/health')
+def health():
+    """Health check endpoint, with the startup crypto self-test when CRYPTO_SELF_TEST=1."""
+    body = {'status': 'ok'}
+    if 'CRYPTO_SELF_TEST' in current_app.config:
+        body['crypto'] = current_app.config['CRYPTO_SELF_TEST']
+    return jsonify(body), 200
+
+
+@bp.route('/metrics')
+def metrics():
+    """Request and phase latency histograms and error counters in the Prometheus text format."""
+    body = (metrics_module.REQUEST_LATENCY.render() + metrics_module.PHASE_LATENCY.render()
+            + logs.ERRORS.render() + logs.DROPPED.render())
+    return Response(body, mimetype='text/plain; version=0.0.4')
+
+
+def _save_stego_image(stego_bytes, original_filename):
+    """Store a stego image. Returns (response entry, error)."""
+    from .steg_jpeg import JPEG_SOI
+    filename = secure_filename(original_filename)
+    base_name = os.path.splitext(filename)[0]
+    is_jpeg = stego_bytes[:2] == JPEG_SOI
+    image_type = 'jpeg' if is_jpeg else 'png'
+    stego_filename = f"{base_name}_stego_{secrets.token_hex(4)}.{'jpg' if is_jpeg else 'png'}"
+
+    if IS_VERCEL and VERCEL_BLOB_AVAILABLE:
+        # Use Vercel Blob storage
+        with span('storage_write'):
+            blob_url, error = save_to_blob(stego_bytes, stego_filename)
+        if error:
+            return None, error
+    else:
+        # Use local filesystem
+        filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], stego_filename)
+        with span('storage_write'), open(filepath, 'wb') as f:
+            f.write(stego_bytes)
+        blob_url = None
+    publish('stored', bytes=len(stego_bytes))
+    catalog_add(blob_url or stego_filename, stego_bytes, STEGO)
+
+    # Also provide base64 preview
+    b64 = base64.b64encode(stego_bytes).decode('utf-8')
+    entry = {
+        'stego_filename': stego_filename,
+        'image_data': f"data:image/{image_type};base64,{b64}",
+        'download_url': download_url(blob_url or stego_filename, current_app.secret_key),
+    }
+
+    return entry, None
+
+
+@bp.route('/steg/embed', methods=['POST'])
+def steg_embed():
+    """
+    Embed a message into an uploaded PNG or JPEG image and return the stego image as downloadable file and preview.
+    When several images are uploaded, the message is sharded across them.
+    """
+    from .imaging import ImageGuardError
+    from .steg import SHARD_HEADER, embed_message_in_images, embed_payload, steg_capacity
+    from .steg_jpeg import STEG_EXTENSIONS
+    if 'image' not in request.files or 'message' not in request.form:
+        return jsonify({'error': 'Missing image or message'}), 400
+    files = request.files.getlist('image')
+    message = request.form.get('message', '')
+    password = request.form.get('password', '')
+    ecc = request.form.get('ecc', '') in ('1', 'true', 'on')
+    if any(file.filename == '' for file in files):
+        return jsonify({'error': 'No file selected'}), 400
+    # PNG uses pixel LSBs, JPEG uses quantized DCT coefficients
+    if not all(file.filename.lower().endswith(STEG_EXTENSIONS) for file in files):
+        return jsonify({'error': 'Steganography only supports PNG and JPEG images'}), 400
+    _, error = sniff_uploads(files, STEG_FORMATS)
+    if error:
+        return jsonify({'error': error}), 400
+    with span('upload_read'):
+        images = [file.read() for file in files]
+    try:
+        if len(images) > 1:
+            stego_images = embed_message_in_images(images, message, password or None, ecc)
+            if stego_images is None:
+                capacity = sum(max(0, steg_capacity(image_bytes, ecc) - SHARD_HEADER.size) for image_bytes in images)
+                return error_response(CapacityError('Message too large for the combined capacity of the images'),
+                                      capacity=capacity)
+        else:
+            stego_bytes = embed_payload(images[0], message.encode('utf-8'), password or None, ecc, reporter())
+            if stego_bytes is None:
+                return error_response(CapacityError('Message too large for image capacity'),
+                                      capacity=steg_capacity(images[0], ecc))
+            stego_images = [(0, stego_bytes)]
+    except ImageGuardError as e:
+        return error_response(e)
+
+    # Save stego images
+    entries = []
+    for index, stego_bytes in stego_images:
+        entry, error = _save_stego_image(stego_bytes, files[index].filename)
+        if error:
+            return error_response(StorageError(f'Blob storage error: {error}'))
+        entries.append(entry)
+
+    response_data = {
+        'success': True,
+        'message': 'Message embedded successfully',
+        **entries[0],
+    }
+    if len(images) > 1:
+        response_data['message'] = f'Message split across {len(entries)} images'
+        response_data['shards'] = entries
+
+    return jsonify(response_data), 200
+
+
+@bp.route('/steg/extract', methods=['POST'])
+def steg_extract():
+    """
+    Extract hidden message from uploaded PNG or JPEG image.
+    Several images are treated as one sharded set and reassembled.
+    """
+    from .imaging import ImageGuardError
+    from .steg import extract_message_from_images, extract_payload, is_shard_payload, reassemble_shards
+    from .steg_jpeg import STEG_EXTENSIONS
+    if 'image' not in request.files:
+        return jsonify({'error': 'Missing image file'}), 400
+    files = request.files.getlist('image')
+    password = request.form.get('password', '')
+    ecc = request.form.get('ecc', '') in ('1', 'true', 'on')
+    if any(file.filename == '' for file in files):
+        return jsonify({'error': 'No file selected'}), 400
+    if not all(file.filename.lower().endswith(STEG_EXTENSIONS) for file in files):
+        return jsonify({'error': 'Extraction only supports PNG and JPEG images'}), 400
+    _, error = sniff_uploads(files, STEG_FORMATS)
+    if error:
+        return jsonify({'error': error}), 400
+    with span('upload_read'):
+        images = [file.read() for file in files]
+    try:
+        if len(images) > 1:
+            message = extract_message_from_images(images, password or None, ecc)
+        else:
+            payload = extract_payload(images[0], password or None, ecc)
+            if is_shard_payload(payload):
+                message = reassemble_shards([payload])
+            else:
+                try:
+                    message = payload.decode('utf-8') if payload is not None else None
+                except UnicodeDecodeError:
+                    message = None
+    except (ImageGuardError, IncompleteShardSetError) as e:
+        return error_response(e)
+    if message is None:
+        return error_response(PayloadNotFoundError('No hidden message found or file corrupted'))
+    return jsonify({
+        'success': True,
+        'message': 'Hidden message extracted',
+        'hidden_message': message
+    }), 200
+
+
+@bp.route('/steg/analyze', methods=['POST'])
+def steg_analyze():
+    """Scan an uploaded image for existing LSB payloads."""
+    from .imaging import ImageGuardError
+    from .steg_jpeg import JPEG_SOI, STEG_EXTENSIONS
+    from .steganalysis import analyze_jpeg_payload, analyze_png_lsb
+    if 'image' not in request.files:
+        return jsonify({'error': 'Missing image file'}), 400
+    file = request.files['image']
+    if file.filename == '':
+        return jsonify({'error': 'No file selected'}), 400
+    if not file.filename.lower().endswith(STEG_EXTENSIONS):
+        return jsonify({'error': 'Analysis only supports PNG and JPEG images'}), 400
+    _, error = sniff_uploads([file], STEG_FORMATS)
+    if error:
+        return jsonify({'error': error}), 400
+    with span('upload_read'):
+        image_bytes = file.read()
+    try:
+        if image_bytes[:2] == JPEG_SOI:
+            report = analyze_jpeg_payload(image_bytes)
+        else:
+            report = analyze_png_lsb(image_bytes)
+    except ImageGuardError as e:
+        return error_response(e)
+    return jsonify({
+        'success': True,
+        'message': 'Image analyzed',
+        'analysis': report
+    }), 200
+
+
+@bp.route('/progress/<progress_id>')
+def progress_events(progress_id):
+    """
+    Server-sent events for the upload sent with the same X-Progress-Id header:
+    received, kdf, encrypt/embed and stored, then complete with the HTTP status.
+    """
+    if not valid_progress_id(progress_id):
+        return jsonify({'error': 'Invalid progress id'}), 400
+    return Response(event_stream(progress_id), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+# ============= BACKGROUND JOBS =============
+
+def _job_response(job, code=200):
+    job['status_url'] = url_for('.job_status', job_id=job['id'])
+    # Results keep the storage key; links are signed per response so they never go stale in the store
+    result = job.get('result')
+    if result and 'download_key' in result:
+        result['download_url'] = download_url(result.pop('download_key'), current_app.secret_key)
+    return jsonify(job), code
+
+
+@bp.route('/jobs/encrypt', methods=['POST'])
+def job_encrypt():
+    """
+    Queue an encryption and return at once with a job id to poll.
+    Expects: image file + password, as for /encrypt
+    """
+    if 'image' not in request.files or 'password' not in request.form:
+        return jsonify({'error': 'Missing image or password'}), 400
+    file = request.files['image']
+    password = request.form.get('password', '')
+    if file.filename == '':
+        return jsonify({'error': 'No file selected'}), 400
+    if not allowed_file(file.filename):
+        return jsonify({'error': 'Invalid file type. Only PNG, JPG, GIF, BMP, WebP, TIFF allowed'}), 400
+    if len(password) < 4:
+        return jsonify({'error': 'Password must be at least 4 characters'}), 400
+    formats, error = preview_formats()
+    if error:
+        return jsonify({'error': error}), 400
+    sniffed, error = sniff_uploads([file])
+    if error:
+        return jsonify({'error': error}), 400
+    with span('upload_read'):
+        image_bytes = file.read()
+    if len(image_bytes) > MAX_FILE_SIZE:
+        return jsonify({'error': f'File too large. Max {MAX_FILE_SIZE/(1024*1024)}MB'}), 400
+    job = current_app.extensions['imagevault_jobs'].submit('encrypt', image_bytes,
+                                                       {'filename': file.filename, 'preview': formats, 'format': sniffed[0],
+                                                        'thumbnail': request.form.get('thumbnail', '') in ('1', 'true', 'on'),
+                                                        'user': session.get('user')},
+                                                       {'password': password})
+    return _job_response(job, 202)
+
+
+@bp.route('/jobs/steg/embed', methods=['POST'])
+def job_steg_embed():
+    """
+    Queue a message embed into one PNG or JPEG image.
+    Expects: image file + message, optional password and ecc, as for /steg/embed
+    """
+    from .steg_jpeg import STEG_EXTENSIONS
+    if 'image' not in request.files or 'message' not in request.form:
+        return jsonify({'error': 'Missing image or message'}), 400
+    file = request.files['image']
+    if file.filename == '':
+        return jsonify({'error': 'No file selected'}), 400
+    if not file.filename.lower().endswith(STEG_EXTENSIONS):
+        return jsonify({'error': 'Steganography only supports PNG and JPEG images'}), 400
+    _, error = sniff_uploads([file], STEG_FORMATS)
+    if error:
+        return jsonify({'error': error}), 400
+    with span('upload_read'):
+        image_bytes = file.read()
+    params = {'filename': file.filename, 'ecc': request.form.get('ecc', '') in ('1', 'true', 'on'),
+              'user': session.get('user')}
+    private = {'message': request.form.get('message', ''), 'password': request.form.get('password', '') or None}
+    job = current_app.extensions['imagevault_jobs'].submit('steg_embed', image_bytes, params, private)
+    return _job_response(job, 202)
+
+
+@bp.route('/jobs/<job_id>', methods=['GET', 'DELETE'])
+def job_status(job_id):
+    """
+    GET: job status, phase progress and, once done, the result with its download_url.
+    DELETE: cancel a queued or running job.
+    """
+    runner = current_app.extensions['imagevault_jobs']
+    job = runner.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    if request.method == 'DELETE':
+        if job['status'] in FINISHED:
+            return jsonify({'error': f"Job already {job['status']}"}), 409
+        job = runner.cancel(job_id)
+    return _job_response(job)
+
+
+@bp.route('/profiles')
+def profiles():
+    """List recently captured request profiles."""
+    if not session.get('user'):
+        return jsonify({'error': 'Login required'}), 401
+    entries, error = list_profiles()
+    if error:
+        return error_response(StorageError(f'Blob storage error: {error}'))
+    return jsonify({'success': True, 'profiles': entries}), 200
+
+
+@bp.route('/profiles/<name>')
+def download_profile(name):
+    """Download one profile (.folded stacks for flamegraphs, .pstats for pstats/snakeviz)."""
+    if not session.get('user'):
+        return jsonify({'error': 'Login required'}), 401
+    if not PROFILE_NAME.match(name):
+        return jsonify({'error': 'Invalid profile name'}), 400
+    data, error = load_profile(name)
+    if error:
+        return error_response(StorageError(f'Blob storage error: {error}'))
+    if data is None:
+        return jsonify({'error': 'Profile not found'}), 404
+    return Response(data, mimetype='application/octet-stream',
+                    headers={'Content-Disposition': f'attachment; filename={name}'})
+
+
+@bp.route('/login', methods=['GET', 'POST'])
+def login():
+    """Simple login page. Required credentials: admin / pass"""
+    if request.method == 'POST':
+        username = request.form.get('username', '')
+        password = request.form.get('password', '')
+        if username == 'admin' and password == 'pass':
+            session['user'] = username
+            # Rate limiting key when RATE_LIMIT_KEY=session
+            session['client_id'] = secrets.token_urlsafe(16)
+            return redirect(url_for('.index'))
+        else:
+            return render_template('login.html', error='Invalid credentials')
+    else:
+        return render_template('login.html')
+
+
+@bp.route('/logout')
+def logout():
+    session.pop('user', None)
+    return redirect(url_for('.login'))
+
+@bp.app_errorhandler(404)
+def not_found(error):
+    return jsonify({'error': 'Not found'}), 404
+
+@bp.app_errorhandler(ImageVaultError)
+def engine_error(error):
+    return error_response(error)
+
+@bp.app_errorhandler(500)
+def internal_error(error):
+    return error_response(getattr(error, 'original_exception', None) or error)
+
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Load test for the Vercel code path, run locally.
+
+Drives api/index.py's handler with VERCEL=1 and the fake_blob stand-in as
+vercel.blob, at a fixed concurrency, and reports latency percentiles and RSS.
+
+    python load_test.py                                   # all scenarios, 4 workers
+    python load_test.py --concurrency 16 --requests 400
+    python load_test.py --scenarios encrypt,download --output load.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import secrets
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT)
+
+import fake_blob  # noqa: E402
+
+KB = 1024
+PASSWORD = 'load-test-password'
+SCENARIOS = ('encrypt', 'decrypt', 'steg_embed', 'steg_extract', 'download')
+
+
+def load_handler():
+    """Import api/index.py the way Vercel does, with blob storage pointed at an in-process fake."""
+    os.environ['VERCEL'] = '1'
+    # Download links are signed with the app secret, so pin one the requests can sign with
+    os.environ.setdefault('SECRET_KEY', 'load-test-secret')
+    # Every request comes from one client; measure the app, not the rate limiter
+    os.environ.setdefault('RATE_LIMIT_BACKEND', 'off')
+    fake_blob.install()
+    sys.path.insert(0, os.path.join(ROOT, 'api'))
+    import index
+    return index.handler
+
+
+def multipart(fields, files):
+    """Encode form fields and (name, filename, bytes) files. Returns (content_type, body)."""
+    boundary = secrets.token_hex(16)
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, filename, data in files:
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                     f'Content-Type: application/octet-stream\r\n\r\n'.encode() + data + b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return f'multipart/form-data; boundary={boundary}', b''.join(parts)
+
+
+def post_request(url, fields, files):
+    content_type, body = multipart(fields, files)
+    return {'method': 'POST', 'url': url, 'headers': {'content-type': content_type}, 'body': body}
+
+
+def build_requests(image_size, cover_size):
+    """Return {scenario: request dict} with inputs prepared up front."""
+    # Imported here so the engine only loads once load_handler() has set VERCEL=1
+    from benchmark import fake_image, make_png
+    from imagevault.crypto import encrypt_image
+    from imagevault.steg_png import embed_message_in_png
+    from imagevault.tokens import download_url
+
+    image = fake_image(image_size)
+    encrypted = encrypt_image(image, PASSWORD)[0]
+    cover = make_png(cover_size, cover_size)
+    stego = embed_message_in_png(cover, 'load test message')
+    blob_url = fake_blob.put('load_test.enc', encrypted).url
+    return {
+        'encrypt': post_request('/encrypt', {'password': PASSWORD}, [('image', 'load.png', image)]),
+        'decrypt': post_request('/decrypt', {'password': PASSWORD}, [('encrypted_file', 'load.enc', encrypted)]),
+        'steg_embed': post_request('/steg/embed', {'message': 'load test message'}, [('image', 'cover.png', cover)]),
+        'steg_extract': post_request('/steg/extract', {}, [('image', 'stego.png', stego)]),
+        'download': {'method': 'GET', 'url': download_url(blob_url, os.environ['SECRET_KEY']), 'headers': {}, 'body': b''},
+    }
+
+
+def current_rss():
+    """Resident set size in bytes (Linux /proc), falling back to the peak."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return peak_rss()
+
+
+def peak_rss():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, round(pct / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+async def run_scenario(handler, request, total, concurrency):
+    loop = asyncio.get_running_loop()
+    latencies = []
+    errors = 0
+    remaining = iter(range(total))
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        async def worker():
+            nonlocal errors
+            # The iterator is shared, so workers stop once `total` requests are issued
+            for _ in remaining:
+                start = time.perf_counter()
+                response = await loop.run_in_executor(pool, handler, request)
+                latencies.append(time.perf_counter() - start)
+                if response['statusCode'] >= 400:
+                    errors += 1
+
+        rss_before = current_rss()
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        wall = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'requests': total,
+        'errors': errors,
+        'rps': total / wall,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'max_ms': latencies[-1] * 1000 if latencies else 0.0,
+        'rss_before_mb': rss_before / (1024 * 1024),
+        'rss_after_mb': current_rss() / (1024 * 1024),
+        'peak_rss_mb': peak_rss() / (1024 * 1024),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the Vercel handler against a local fake blob store')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help=f'comma-separated subset of {", ".join(SCENARIOS)}')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=100, help='requests per scenario')
+    parser.add_argument('--image-size', type=int, default=256 * KB, help='bytes of the image sent to /encrypt')
+    parser.add_argument('--cover-size', type=int, default=512, help='side in pixels of the stego cover PNG')
+    parser.add_argument('--output', help='write results JSON to this path')
+    args = parser.parse_args()
+
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f'unknown scenario(s): {", ".join(sorted(unknown))}')
+
+    handler = load_handler()
+    requests = build_requests(args.image_size, args.cover_size)
+
+    results = {}
+    print(f"{'scenario':14} {'reqs':>6} {'errors':>6} {'rps':>8} {'p50':>10} {'p95':>10} {'p99':>10} {'rss':>9}")
+    for name in scenarios:
+        result = asyncio.run(run_scenario(handler, requests[name], args.requests, args.concurrency))
+        results[name] = result
+        print(f"{name:14} {result['requests']:6} {result['errors']:6} {result['rps']:8.1f} "
+              f"{result['p50_ms']:8.1f}ms {result['p95_ms']:8.1f}ms {result['p99_ms']:8.1f}ms "
+              f"{result['rss_after_mb']:7.1f}MB")
+    print(f"\nPeak RSS: {peak_rss() / (1024 * 1024):.1f}MB")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'concurrency': args.concurrency, 'results': results}, f, indent=2)
+        print(f"Results written to {args.output}")
+    return 1 if any(result['errors'] for result in results.values()) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -4,6 +4,10 @@ Test script to verify Vercel deployment setup
 """
 import sys
 import os
+import tempfile
+
+# Routes hit through Project_of_IS.app record files in a throwaway catalog, not the instance folder's
+os.environ['CATALOG_BACKEND'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='imagevault-test-'), 'catalog.db')
 
 def test_imports():
     """Test that all required imports work"""
@@ -61,6 +65,671 @@ def test_vercel_handler():
         print(f"[FAIL] Vercel handler import error: {e}")
         return False
 
+# Engine tests: plain asserts, so pytest reports them; the __main__ runner wraps them too
+
+def _cover_png(width, height, seed):
+    """A smooth, mildly noisy RGB cover, deterministic per seed"""
+    from io import BytesIO
+    import numpy as np
+    from PIL import Image
+
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:height, 0:width]
+    pixels = np.stack([xx * 255 / width, yy * 255 / height, (xx + yy) * 127 / (width + height)], axis=-1)
+    pixels = np.clip(pixels + rng.normal(0, 3, pixels.shape), 0, 255).astype(np.uint8)
+    buf = BytesIO()
+    Image.fromarray(pixels).save(buf, 'PNG')
+    return buf.getvalue()
+
+def _cover_jpeg(width, height, seed, mode='RGB', **options):
+    from io import BytesIO
+    from PIL import Image
+
+    buf = BytesIO()
+    Image.open(BytesIO(_cover_png(width, height, seed))).convert(mode).save(buf, 'JPEG', quality=90, **options)
+    return buf.getvalue()
+
+def _decrypt_error(encrypted, password):
+    """The CryptoError decrypt_into raises for encrypted, or None if it decrypts"""
+    from io import BytesIO
+    from imagevault.crypto import decrypt_into
+    from imagevault.errors import CryptoError
+
+    try:
+        decrypt_into(encrypted, BytesIO(), password)
+    except CryptoError as e:
+        return e
+    return None
+
+def _segmented_v3(data, password, segment_size, cipher='aes-256-gcm'):
+    """A version 3 file: segments sealed directly under the password-derived key (new files are version 4)"""
+    import os
+    from imagevault.crypto import CONTAINER_MAGIC, SEGMENTED_PREFIX, SEGMENTED_VERSION, derive_key_from_password
+    from imagevault.engine import CIPHER_IDS, NONCE_SIZES, new_aead, seal_segments
+
+    prefix = SEGMENTED_PREFIX.pack(CONTAINER_MAGIC, SEGMENTED_VERSION, 0, CIPHER_IDS[cipher], segment_size, 0)
+    salt, nonce = os.urandom(16), os.urandom(NONCE_SIZES[cipher])
+    aead, iv = new_aead(cipher, derive_key_from_password(password, salt), nonce)
+    return b''.join([prefix, salt, nonce] + seal_segments(aead, iv, prefix, data, segment_size))
+
+def test_png_strip_limits():
+    """Corrupt PNG data is rejected as a bad image, and payload lengths above STEG_MAX_PAYLOAD are refused up front"""
+    import os
+    from io import BytesIO
+    import numpy as np
+    from Project_of_IS.app import app
+    from imagevault import steg_png
+    from imagevault.imaging import ImageGuardError, iter_png_strips
+    from imagevault.steg_png import KeyedPermutation, embed_payload_in_png, extract_payload_from_png
+
+    cover = _cover_png(64, 64, 5)
+    idat = cover.index(b'IDAT') + 4
+    corrupt = cover[:idat + 20] + bytes([0xff]) * 40 + cover[idat + 60:]
+    for decode in (lambda: list(iter_png_strips(corrupt)), lambda: embed_payload_in_png(corrupt, b'hi'),
+                   lambda: extract_payload_from_png(corrupt)):
+        try:
+            decode()
+            assert False, 'corrupt PNG decoded'
+        except ImageGuardError:
+            pass
+    with app.test_client() as client:
+        response = client.post('/steg/embed', data={'message': 'hi', 'image': (BytesIO(corrupt), 'bad.png')})
+        assert response.status_code == 400 and response.get_json()['code'] == 'image_rejected'
+
+    # A forged length header within the image's capacity but above the cap reads nothing past the header
+    payload = os.urandom(1000)
+    forged = embed_payload_in_png(cover, payload)
+    assert extract_payload_from_png(forged) == payload
+    saved = steg_png.STEG_MAX_PAYLOAD
+    steg_png.STEG_MAX_PAYLOAD = 999
+    try:
+        assert extract_payload_from_png(forged) is None
+        assert embed_payload_in_png(cover, payload) is None
+        assert steg_png.payload_capacity(64 * 64 * 3) == 999
+    finally:
+        steg_png.STEG_MAX_PAYLOAD = saved
+
+    # Keyed positions are permuted a whole array at a time, with the same order as one at a time
+    for n in (1, 3, 4099):
+        assert KeyedPermutation(b'k' * 32, n).many(np.arange(n)).tolist() == [KeyedPermutation(b'k' * 32, n)(i)
+                                                                               for i in range(n)]
+    assert extract_payload_from_png(embed_payload_in_png(cover, payload, 'pw', ecc=True), 'pw', ecc=True) == payload
+
+def test_keyed_permutation():
+    """KeyedPermutation is a keyed bijection on range(n), and a keyed embed needs its password"""
+    from imagevault.steg_png import KeyedPermutation, embed_message_in_png, extract_message_from_png
+
+    for n in (1, 2, 3, 17, 256, 1000, 4099):
+        perm = KeyedPermutation(b'k' * 32, n)
+        assert sorted(perm(i) for i in range(n)) == list(range(n))
+    first = [KeyedPermutation(b'a' * 32, 1000)(i) for i in range(1000)]
+    second = [KeyedPermutation(b'b' * 32, 1000)(i) for i in range(1000)]
+    assert first != second and first != list(range(1000))
+
+    stego = embed_message_in_png(_cover_png(64, 48, 0), 'keyed message', password='pw')
+    assert extract_message_from_png(stego, password='pw') == 'keyed message'
+    assert extract_message_from_png(stego, password='other') != 'keyed message'
+    assert extract_message_from_png(stego) != 'keyed message'
+
+def test_jpeg_scan_roundtrip():
+    """JPEG payloads survive subsampling, restart markers, grayscale and progressive covers"""
+    from io import BytesIO
+    from PIL import Image
+    from imagevault.imaging import ImageGuardError
+    from imagevault.steg_jpeg import _parse_jpeg, embed_message_in_jpeg, extract_message_from_jpeg
+
+    covers = [
+        _cover_jpeg(120, 90, 3),
+        _cover_jpeg(120, 90, 3, subsampling=0),
+        _cover_jpeg(120, 90, 3, restart_marker_blocks=3),
+        _cover_jpeg(120, 90, 3, mode='L'),
+    ]
+    assert _parse_jpeg(covers[2])['restart_interval'] == 3
+    for cover in covers:
+        for password in (None, 'pw'):
+            stego = embed_message_in_jpeg(cover, 'héllo jpeg', password=password)
+            # Coefficients are flipped within their size category, so the scan keeps its length
+            assert len(stego) == len(cover)
+            Image.open(BytesIO(stego)).load()
+            assert extract_message_from_jpeg(stego, password=password) == 'héllo jpeg'
+        assert extract_message_from_jpeg(embed_message_in_jpeg(cover, 'x', password='pw')) != 'x'
+        assert embed_message_in_jpeg(cover, 'x' * 100000) is None
+
+    progressive = _cover_jpeg(120, 90, 3, progressive=True)
+    assert _parse_jpeg(progressive) is None
+    assert extract_message_from_jpeg(embed_message_in_jpeg(progressive, 'baseline now')) == 'baseline now'
+
+    # Damaged headers and scans are rejected as bad input, never with a bare IndexError
+    stego = embed_message_in_jpeg(covers[0], 'hi', password='pw')
+    for damaged in (covers[0][:200], b'\x89PNG' + covers[0][4:], stego[:len(stego) // 2]):
+        try:
+            extract_message_from_jpeg(damaged, password='pw')
+            assert False, 'damaged JPEG parsed'
+        except ImageGuardError:
+            pass
+
+def test_steganalysis_full_embed():
+    """Covers filled to capacity are reported with a high rate, clean ones with a low one"""
+    import random
+    from imagevault.steg_png import embed_payload_in_png, payload_capacity
+    from imagevault.steganalysis import analyze_png_lsb
+
+    # These seeds include covers whose RS and sample pair quadratics have no real root when full
+    for seed in (1, 7, 12, 15):
+        cover = _cover_png(128, 128, seed)
+        assert analyze_png_lsb(cover)['estimated_rate'] < 0.15
+        payload = random.Random(seed).randbytes(payload_capacity(128 * 128 * 3))
+        report = analyze_png_lsb(embed_payload_in_png(cover, payload))
+        assert report['estimated_rate'] > 0.8, report
+        assert report['suspicious']
+
+def test_shard_sets():
+    """Sharded messages reassemble in any order, and partial or mixed sets raise their own error"""
+    from imagevault.errors import IncompleteShardSetError
+    from imagevault.steg import embed_message_in_images, extract_message_from_images
+
+    covers = [_cover_png(40, 30, seed) for seed in range(4)]
+    message = 'sharded ü ' * 100
+    stego = [image for _, image in embed_message_in_images(covers, message, password='pw')]
+    other = [image for _, image in embed_message_in_images(covers, message, password='pw')]
+    assert len(stego) > 2
+    assert extract_message_from_images(stego[::-1], password='pw') == message
+    for partial in (stego[:-1], stego[:-1] + other[-1:]):
+        try:
+            extract_message_from_images(partial, password='pw')
+            assert False, 'partial shard set accepted'
+        except IncompleteShardSetError:
+            pass
+    assert extract_message_from_images(covers[:2], password='pw') is None
+
+def test_fec_roundtrip():
+    """RS(255,223) data and RS(16,4) length codewords correct up to their limits and reject beyond"""
+    import random
+    from io import BytesIO
+    import numpy as np
+    from PIL import Image
+    from imagevault.fec import (FEC_HEADER_BITS, FEC_PARITY, _fec_layout, fec_body_size, fec_decode,
+                                fec_decode_length, fec_encode)
+    from imagevault.steg_png import embed_payload_in_png, extract_payload_from_png
+
+    rng = random.Random(31)
+    header_size = FEC_HEADER_BITS // 8
+    for length in (0, 1, 223, 224, 1000):
+        data = rng.randbytes(length)
+        encoded = bytearray(fec_encode(data))
+        assert len(encoded) == header_size + fec_body_size(length)
+        assert fec_decode_length(bytes(encoded[:header_size])) == length
+        assert fec_decode(bytes(encoded[header_size:]), length) == data
+        if not length:
+            continue
+        # The body is interleaved column by column, so codeword 0 holds every count-th byte
+        count = _fec_layout(length)[0]
+        damaged = bytearray(encoded)
+        for i in rng.sample(range(header_size, len(encoded), count), FEC_PARITY // 2):
+            damaged[i] ^= 0xFF
+        for i in rng.sample(range(header_size), 6):
+            damaged[i] ^= 0x5A
+        assert fec_decode_length(bytes(damaged[:header_size])) == length
+        assert fec_decode(bytes(damaged[header_size:]), length) == data
+        for i in rng.sample(range(header_size, len(encoded), count), FEC_PARITY):
+            damaged[i] ^= 0xA5
+        assert fec_decode(bytes(damaged[header_size:]), length) != data
+
+    # A burst of 120 flipped LSBs in the stego image is spread over the codewords and corrected
+    payload = rng.randbytes(600)
+    stego = embed_payload_in_png(_cover_png(64, 48, 5), payload, ecc=True)
+    pixels = np.array(Image.open(BytesIO(stego)))
+    pixels[2, :40] ^= 1
+    buf = BytesIO()
+    Image.fromarray(pixels).save(buf, 'PNG')
+    assert extract_payload_from_png(buf.getvalue(), ecc=True) == payload
+
+def test_cli_batch_failures():
+    """One failing file in a CLI batch is reported and counted, and the rest of the batch still runs"""
+    import os
+    import tempfile
+    import zlib
+    from contextlib import redirect_stderr
+    from io import StringIO
+    from imagevault import cli
+
+    embed = cli.JOBS['embed']
+
+    def flaky_embed(src, dst, options):
+        if src.endswith('c.png'):
+            raise zlib.error('Error -3 while decompressing data')
+        return embed(src, dst, options)
+
+    with tempfile.TemporaryDirectory() as folder:
+        covers, out = os.path.join(folder, 'covers'), os.path.join(folder, 'out')
+        os.makedirs(covers)
+        for name, data in (('a.png', _cover_png(32, 32, 1)), ('b.png', b'\x89PNG\r\n\x1a\n broken'),
+                           ('c.png', _cover_png(32, 32, 2)), ('d.png', _cover_png(32, 32, 3))):
+            with open(os.path.join(covers, name), 'wb') as f:
+                f.write(data)
+        # Forked pool workers see the patched job table
+        cli.JOBS['embed'] = flaky_embed
+        stderr = StringIO()
+        try:
+            with redirect_stderr(stderr):
+                status = cli.main(['embed', covers, '-o', out, '--message', 'hi', '-j', '2'])
+        finally:
+            cli.JOBS['embed'] = embed
+        assert status == 1
+        assert sorted(os.listdir(out)) == ['a.png', 'd.png']
+        report = stderr.getvalue()
+        assert "c.png: internal (error: Error -3 while decompressing data)" in report, report
+        assert 'b.png: Not a valid PNG image' in report and 'embed: 2/4 files (2 failed)' in report, report
+
+def test_job_cancel_claim_race():
+    """A queued job is either claimed by a worker or cancelled, never both, in every job store"""
+    import os
+    import tempfile
+    import threading
+    import time
+    from imagevault.jobs import CANCELLED, RUNNING, JobRunner, MemoryJobStore, open_job_store
+
+    with tempfile.TemporaryDirectory() as folder:
+        for url in ('memory://', f"sqlite:///{os.path.join(folder, 'jobs.db')}", 'redis+local://'):
+            store = open_job_store(url)
+            job_ids = [f'{i:04d}' for i in range(40)]
+            for job_id in job_ids:
+                store.create(job_id, 'encrypt', {}, 'owner')
+            claimed, cancelled = [], []
+
+            def work():
+                while True:
+                    job = store.claim('owner', 0.2)
+                    if job is None:
+                        return
+                    claimed.append(job['id'])
+                    time.sleep(0.002)
+
+            # Claims start at the oldest job and cancels at the newest, at the same pace, so they meet mid-queue
+            worker = threading.Thread(target=work)
+            worker.start()
+            for job_id in reversed(job_ids):
+                if store.cancel_queued(job_id):
+                    cancelled.append(job_id)
+                time.sleep(0.002)
+            worker.join()
+            assert sorted(claimed + cancelled) == job_ids, url
+            assert all(store.get(job_id)['status'] == RUNNING for job_id in claimed), url
+            assert all(store.get(job_id)['status'] == CANCELLED for job_id in cancelled), url
+            assert not store.cancel_queued(job_ids[0]), url
+
+        # Cancelling a job a worker has just claimed only asks it to stop; its input stays in place
+        runner = JobRunner(MemoryJobStore(), folder, workers=0)
+        job_id = runner.submit('encrypt', b'data', {}, {'password': 'pw'})['id']
+        assert runner.store.claim(runner.owner, 0)['id'] == job_id
+        assert runner.cancel(job_id)['status'] == RUNNING
+        assert runner.store.get(job_id)['cancel_requested']
+        assert job_id in runner._secrets and os.path.exists(os.path.join(runner.input_folder, job_id))
+
+def test_job_worker_survives_store_errors():
+    """A job worker backs off and keeps claiming after the store fails, so queued jobs still run"""
+    import sqlite3
+    import tempfile
+    import time
+    from imagevault.jobs import DONE, JobRunner, MemoryJobStore
+
+    class FlakyStore(MemoryJobStore):
+        failures = 3
+
+        def claim(self, owner, timeout):
+            if self.failures:
+                self.failures -= 1
+                raise sqlite3.OperationalError('database is locked')
+            return super().claim(owner, timeout)
+
+    with tempfile.TemporaryDirectory() as folder:
+        runner = JobRunner(FlakyStore(), folder, workers=1)
+        runner.BACKOFF = 0.01
+        job_id = runner.submit('encrypt', _cover_png(16, 16, 1), {'filename': 'a.png'}, {'password': 'pw'})['id']
+        deadline = time.time() + 10
+        while runner.get(job_id)['status'] != DONE and time.time() < deadline:
+            time.sleep(0.02)
+        assert runner.get(job_id)['status'] == DONE
+        assert runner.store.failures == 0 and all(thread.is_alive() for thread in runner._threads)
+
+def test_download_token_non_ascii():
+    """A download signature with non-ASCII characters is rejected with 403, not a 500"""
+    import time
+    from Project_of_IS.app import app
+    from imagevault.tokens import sign_download, verify_download
+
+    expires, sig = sign_download('a.enc', 'secret', now=1000)
+    assert verify_download('a.enc', expires, sig, 'secret', now=1000)
+    assert not verify_download('a.enc', expires, sig[:-1] + '\u00e9', 'secret', now=1000)
+    with app.test_client() as client:
+        response = client.get('/download/a.enc', query_string={'expires': int(time.time()) + 60, 'sig': '\u00e9'})
+        assert response.status_code == 403
+
+def test_truncated_header():
+    """A file cut off inside its header fields raises TruncatedFileError, and /decrypt/preview answers 422"""
+    from io import BytesIO
+    from Project_of_IS.app import app
+    from imagevault.crypto import encrypt_image, header_length, read_header
+    from imagevault.errors import TruncatedFileError
+
+    encrypted = encrypt_image(b'image bytes', 'pw', thumbnail=b'thumb bytes')[0]
+    for size in range(6, 15):
+        for reader in (header_length, lambda head: read_header(BytesIO(head))):
+            try:
+                reader(encrypted[:size])
+                assert False, f'{size} byte header accepted'
+            except TruncatedFileError:
+                pass
+    with app.test_client() as client:
+        response = client.post('/decrypt/preview', data={'password': 'pw',
+                                                          'encrypted_file': (BytesIO(encrypted[:10]), 'a.enc')})
+        assert response.status_code == 422 and response.get_json()['code'] == 'truncated'
+
+def test_segmented_v3_container():
+    """Version 3 segmented files decrypt, and damaged, reordered or truncated segments are rejected"""
+    import os
+    from io import BytesIO
+    from imagevault.crypto import decrypt_image, decrypt_stream, parse_header
+    from imagevault.errors import AuthenticationError
+
+    data = os.urandom(10000)
+    encrypted = _segmented_v3(data, 'pw', 4096)
+    header = parse_header(encrypted)
+    assert (header.segment_size, header.wrapped_key, header.offset) == (4096, None, 15 + 16 + 12)
+    assert decrypt_image(encrypted, 'pw') == data
+    out = BytesIO()
+    assert decrypt_stream(BytesIO(encrypted), out, 'pw') and out.getvalue() == data
+    assert decrypt_image(_segmented_v3(b'', 'pw', 4096), 'pw') == b''
+
+    step = 4096 + 16
+    body = encrypted[header.offset:]
+    segments = [body[i:i + step] for i in range(0, len(body), step)]
+    flipped = bytearray(encrypted)
+    flipped[header.offset + step + 5] ^= 1
+    prefix_changed = bytearray(encrypted)
+    prefix_changed[9] ^= 1  # segment size, authenticated as AAD
+    for damaged in (bytes(flipped), bytes(prefix_changed),
+                    encrypted[:header.offset] + segments[1] + segments[0] + segments[2],
+                    encrypted[:header.offset] + b''.join(segments[:2]),
+                    encrypted[:header.offset]):
+        assert isinstance(_decrypt_error(damaged, 'pw'), AuthenticationError)
+        assert not decrypt_stream(BytesIO(damaged), BytesIO(), 'pw')
+    # Before envelope encryption a wrong password looks like any other failed tag
+    assert type(_decrypt_error(encrypted, 'wrong')) is AuthenticationError
+
+def test_xchacha20_vectors():
+    """HChaCha20 and XChaCha20-Poly1305 match draft-irtf-cfrg-xchacha, and every cipher round-trips"""
+    import os
+    from imagevault.crypto import decrypt_image, encrypt_image, parse_header
+    from imagevault.engine import CIPHERS, cipher_available, hchacha20, new_aead
+    from imagevault.errors import CorruptedFileError, WrongPasswordError
+
+    # Section 2.2.1
+    subkey = hchacha20(bytes(range(32)), bytes.fromhex('000000090000004a0000000031415927'))
+    assert subkey.hex() == '82413b4227b27bfed30e42508a877d73a0f9e4d58a74a853c12ec41326d3ecdc'
+
+    # Appendix A.3.1
+    plaintext = (b"Ladies and Gentlemen of the class of '99: If I could offer you only one tip "
+                 b"for the future, sunscreen would be it.")
+    aad = bytes.fromhex('50515253c0c1c2c3c4c5c6c7')
+    aead, iv = new_aead('xchacha20-poly1305', bytes(range(0x80, 0xa0)), bytes(range(0x40, 0x58)))
+    sealed = aead.encrypt(iv, plaintext, aad)
+    assert sealed[:-16].hex() == (
+        'bd6d179d3e83d43b9576579493c0e939572a1700252bfaccbed2902c21396cbb731c7f1b0b4aa6440bf3a82f4eda7e39'
+        'ae64c6708c54c216cb96b72e1213b4522f8c9ba40db5d945b11b69b982c1bb9e3f3fac2bc369488f76b2383565d3fff9'
+        '21f9664c97637da9768812f615c68b13b52e')
+    assert sealed[-16:].hex() == 'c0875924c1c7987947deafd8780acf49'
+    assert aead.decrypt(iv, sealed, aad) == plaintext
+
+    data = os.urandom(5000)
+    for cipher in CIPHERS:
+        if not cipher_available(cipher):
+            continue
+        encrypted = encrypt_image(data, 'pw', cipher=cipher)[0]
+        header = parse_header(encrypted)
+        assert header.cipher == cipher
+        assert decrypt_image(encrypted, 'pw') == data
+        # The cipher id is authenticated: relabelling the file breaks the key unwrap
+        relabelled = bytearray(encrypted)
+        relabelled[7] = CIPHERS['aes-256-gcm' if cipher != 'aes-256-gcm' else 'chacha20-poly1305'][0]
+        assert _decrypt_error(bytes(relabelled), 'pw') is not None
+        nonce_changed = bytearray(encrypted)
+        nonce_changed[header.offset - 1] ^= 1
+        assert isinstance(_decrypt_error(bytes(nonce_changed), 'pw'), CorruptedFileError)
+        assert isinstance(_decrypt_error(encrypted, 'wrong'), WrongPasswordError)
+
+def test_envelope_v4_container():
+    """Version 4 files tell a wrong password from damage, and rekeying rewrites only the key fields"""
+    import os
+    from io import BytesIO
+    from imagevault.crypto import (decrypt_image, decrypt_stream, decrypt_thumbnail, encrypt_image, encrypt_stream,
+                                   parse_header, rekey_stream)
+    from imagevault.errors import CorruptedFileError, TruncatedFileError, WrongPasswordError
+
+    data = os.urandom(10000)
+    out = BytesIO()
+    assert encrypt_stream(BytesIO(data), out, 'pw', segment_size=4096, cipher='aes-256-gcm') == len(data)
+    encrypted = out.getvalue()
+    header = parse_header(encrypted)
+    assert header.wrapped_key is not None and header.segment_size == 4096
+    assert decrypt_image(encrypted, 'pw') == data
+
+    wrapped_changed = bytearray(encrypted)
+    wrapped_changed[15 + 16 + 12 + 47] ^= 1  # last byte of the wrapped data key
+    body_changed = bytearray(encrypted)
+    body_changed[header.offset + 4096 + 16 + 3] ^= 1
+    assert isinstance(_decrypt_error(encrypted, 'wrong'), WrongPasswordError)
+    assert isinstance(_decrypt_error(bytes(wrapped_changed), 'pw'), WrongPasswordError)
+    assert type(_decrypt_error(bytes(body_changed), 'pw')) is CorruptedFileError
+    assert type(_decrypt_error(encrypted[:-100], 'pw')) is CorruptedFileError
+    assert isinstance(_decrypt_error(encrypted[:header.offset], 'pw'), TruncatedFileError)
+
+    thumbnailed = encrypt_image(data, 'pw', thumbnail=b'thumb bytes', cipher='xchacha20-poly1305')[0]
+    assert decrypt_thumbnail(thumbnailed, 'pw') == b'thumb bytes'
+    assert decrypt_thumbnail(thumbnailed, 'wrong') is None
+
+    for original in (encrypted, thumbnailed):
+        f = BytesIO(original)
+        assert not rekey_stream(f, 'wrong', 'new') and f.getvalue() == original
+        f.seek(0)
+        assert rekey_stream(f, 'pw', 'new')
+        rekeyed = f.getvalue()
+        changed = [i for i in range(len(original)) if rekeyed[i] != original[i]]
+        assert len(rekeyed) == len(original) and changed and changed[-1] < parse_header(original).offset
+        assert decrypt_image(rekeyed, 'new') == data
+        assert isinstance(_decrypt_error(rekeyed, 'pw'), WrongPasswordError)
+    assert decrypt_thumbnail(rekeyed, 'new') == b'thumb bytes'
+    assert not rekey_stream(BytesIO(_segmented_v3(data, 'pw', 4096)), 'pw', 'new')
+    assert not decrypt_stream(BytesIO(encrypted), BytesIO(), 'wrong')
+
+def test_catalog_rebuild():
+    """The catalog lives outside the upload folder, takes kinds from the storing route, and hashes uploads later"""
+    import os
+    import tempfile
+    from io import BytesIO
+    from imagevault.catalog import (CATALOG_FOLDER, ENCRYPTED, STEGO, _pool, default_backend, describe, hash_later,
+                                    open_catalog, rebuild)
+    from imagevault.crypto import encrypt_image_parts
+    from imagevault.steg_png import embed_message_in_png
+
+    cover = _cover_png(64, 64, 3)
+    parts = encrypt_image_parts(cover, 'pw', image_format='png')
+    with tempfile.TemporaryDirectory() as folder:
+        uploads = os.path.join(folder, 'uploads')
+        os.makedirs(uploads)
+        backend = default_backend(os.path.join(folder, 'instance'))
+        assert backend == 'sqlite:///' + os.path.join(folder, 'instance', 'catalog.db')
+        assert os.path.isdir(os.path.join(folder, 'instance'))
+        catalog = open_catalog(backend)
+        # A web upload, a keyed web stego image, a stego image named like the CLI leaves it, and
+        # files the app did not write: plain covers are not stego, whatever their format
+        files = {
+            'photo_1a2b3c4d.enc': b''.join(parts),
+            'trip_stego_5e6f7a8b.png': embed_message_in_png(cover, 'hi', password='key'),
+            'holiday.png': embed_message_in_png(cover, 'hi'),
+            'cover.png': cover,
+            'cover.jpg': _cover_jpeg(32, 32, 4),
+            'notes.png': b'not an image',
+            'readme.txt': b'text',
+        }
+        for name, data in files.items():
+            with open(os.path.join(uploads, name), 'wb') as f:
+                f.write(data)
+        count, errors = rebuild(catalog, uploads, workers=2)
+        assert (count, errors) == (3, [])
+        kinds = {entry['key']: entry['kind'] for entry in catalog.query()[0]}
+        assert kinds == {'photo_1a2b3c4d.enc': ENCRYPTED, 'trip_stego_5e6f7a8b.png': STEGO, 'holiday.png': STEGO}
+        # The storing route's kind wins over what the contents suggest
+        assert describe('upload.png', cover, kind=STEGO)['kind'] == STEGO and describe('upload.png', cover) is None
+
+        # Uploads are added without a hash, which is filled in off the request path
+        entry = describe('new_5e6f7a8b.enc', parts, 'alice', digest=False, kind=ENCRYPTED)
+        assert entry['content_hash'] is None and entry['size'] == len(files['photo_1a2b3c4d.enc'])
+        catalog.add(entry)
+        hash_later(catalog, 'new_5e6f7a8b.enc', parts, ENCRYPTED).result()
+        assert catalog.get('new_5e6f7a8b.enc')['content_hash'] == catalog.get('photo_1a2b3c4d.enc')['content_hash']
+
+        # The default catalog is in the app's instance folder, not the working directory, and an
+        # app given its own catalog records its uploads there
+        from imagevault.web import create_app
+        app = create_app(upload_folder=uploads, catalog_backend=backend)
+        assert os.path.realpath(app.instance_path) == CATALOG_FOLDER
+        assert app.config['CATALOG_BACKEND'] == backend
+        with app.test_client() as client:
+            response = client.post('/encrypt', data={'password': 'pass', 'image': (BytesIO(cover), 'web.png')})
+            key = response.get_json()['encrypted_filename']
+            assert catalog.get(key)['kind'] == ENCRYPTED
+            response = client.post('/steg/embed', data={'message': 'hi', 'password': 'key',
+                                                         'image': (BytesIO(cover), 'web.png')})
+            body = response.get_json()
+        assert response.status_code == 200 and catalog.get(body['stego_filename'])['kind'] == STEGO
+        # Let the routes' background hashing finish before the folder is removed
+        _pool().submit(int).result()
+
+def test_typed_error_responses():
+    """Only a missing final segment counts as truncation, and preview and rekey failures answer with typed errors"""
+    import os
+    import tempfile
+    from io import BytesIO
+    from urllib.parse import parse_qs, urlsplit
+    from Project_of_IS.app import app
+    from imagevault.crypto import decrypt_into, encrypt_image, open_thumbnail, parse_header, rekey_fields
+    from imagevault.engine import MissingFinalSegmentError, new_aead, open_segments
+    from imagevault.errors import (CorruptedFileError, EnvelopeRequiredError, NoThumbnailError, TruncatedFileError,
+                                   WrongPasswordError)
+    from imagevault.tokens import download_url
+
+    aead, iv = new_aead('aes-256-gcm', bytes(32), bytes(12))
+    try:
+        open_segments(aead, iv, b'', b'')
+        assert False, 'empty final data was accepted'
+    except MissingFinalSegmentError:
+        pass
+    data = os.urandom(5000)
+    encrypted = encrypt_image(data, 'pw', thumbnail=b'thumb bytes')[0]
+    header_only = encrypted[:parse_header(encrypted).offset]
+    assert isinstance(_decrypt_error(header_only, 'pw'), TruncatedFileError)
+    # Any other ValueError is a bug, not a damaged file
+    closed = BytesIO()
+    closed.close()
+    try:
+        decrypt_into(encrypted, closed, 'pw')
+        assert False, 'writing to a closed file succeeded'
+    except ValueError as e:
+        assert not isinstance(e, MissingFinalSegmentError)
+
+    plain = encrypt_image(data, 'pw')[0]
+    for head, password, error in ((plain, 'pw', NoThumbnailError), (encrypted, 'wrong', WrongPasswordError)):
+        try:
+            open_thumbnail(head, password)
+            assert False, error.__name__
+        except error:
+            pass
+    damaged = bytearray(encrypted)
+    damaged[parse_header(encrypted).thumbnail[2]] ^= 1
+    try:
+        open_thumbnail(bytes(damaged), 'pw')
+        assert False, 'damaged thumbnail decrypted'
+    except CorruptedFileError:
+        pass
+    try:
+        rekey_fields(_segmented_v3(data, 'pw', 4096), 'pw', 'new')
+        assert False, 'version 3 file rekeyed'
+    except EnvelopeRequiredError:
+        pass
+
+    upload_folder = app.config['UPLOAD_FOLDER']
+    with tempfile.TemporaryDirectory() as folder, app.test_client() as client:
+        app.config['UPLOAD_FOLDER'] = folder
+        try:
+            response = client.post('/decrypt/preview', data={'password': 'pw',
+                                                              'encrypted_file': (BytesIO(plain), 'a.enc')})
+            assert response.status_code == 404 and response.get_json()['code'] == 'no_thumbnail'
+            response = client.post('/decrypt/preview', data={'password': 'wrong',
+                                                              'encrypted_file': (BytesIO(encrypted), 'a.enc')})
+            body = response.get_json()
+            assert response.status_code == 401 and body['code'] == 'wrong_password' and body['request_id']
+
+            for name, contents in (('v4.enc', encrypted), ('v3.enc', _segmented_v3(data, 'pw', 4096))):
+                with open(os.path.join(folder, name), 'wb') as f:
+                    f.write(contents)
+            for name, password, status, code in (('v4.enc', 'wrong', 401, 'wrong_password'),
+                                                 ('v3.enc', 'pw', 400, 'envelope_required')):
+                token = parse_qs(urlsplit(download_url(name, app.secret_key)).query)
+                response = client.post('/rekey', data={'file': name, 'password': password, 'new_password': 'new pw',
+                                                        'expires': token['expires'][0], 'sig': token['sig'][0]})
+                assert (response.status_code, response.get_json()['code']) == (status, code), name
+            with open(os.path.join(folder, 'v4.enc'), 'rb') as f:
+                assert f.read() == encrypted
+        finally:
+            app.config['UPLOAD_FOLDER'] = upload_folder
+
+def test_unhandled_error_logged_once():
+    """An unhandled exception is logged once, with one traceback, by report_error"""
+    import logging
+    import tempfile
+    from imagevault.web import create_app
+
+    with tempfile.TemporaryDirectory() as folder:
+        app = create_app(upload_folder=folder, catalog_backend='off')
+
+        @app.route('/boom')
+        def boom():
+            raise RuntimeError('boom')
+
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        logger = logging.getLogger('imagevault')
+        logger.addHandler(handler)
+        try:
+            with app.test_client() as client:
+                response = client.get('/boom')
+        finally:
+            logger.removeHandler(handler)
+    assert response.status_code == 500 and response.get_json()['code'] == 'internal'
+    assert [record.getMessage() for record in records if record.exc_info] == ['error']
+
+ENGINE_TESTS = [
+    test_png_strip_limits,
+    test_keyed_permutation,
+    test_jpeg_scan_roundtrip,
+    test_steganalysis_full_embed,
+    test_shard_sets,
+    test_fec_roundtrip,
+    test_cli_batch_failures,
+    test_job_cancel_claim_race,
+    test_job_worker_survives_store_errors,
+    test_download_token_non_ascii,
+    test_truncated_header,
+    test_segmented_v3_container,
+    test_xchacha20_vectors,
+    test_envelope_v4_container,
+    test_catalog_rebuild,
+    test_typed_error_responses,
+    test_unhandled_error_logged_once,
+]
+
 if __name__ == "__main__":
     print("Vercel Deployment Test Suite")
     print("=" * 30)
@@ -71,6 +740,15 @@ if __name__ == "__main__":
     all_passed &= test_app_initialization()
     all_passed &= test_vercel_handler()
 
+    print("\nTesting engines...")
+    for test in ENGINE_TESTS:
+        try:
+            test()
+            print(f"[PASS] {test.__doc__}")
+        except Exception as e:
+            print(f"[FAIL] {test.__doc__}: {e!r}")
+            all_passed = False
+
     print("\n" + "=" * 30)
     if all_passed:
         print("[PASS] All tests passed! Ready for deployment.")